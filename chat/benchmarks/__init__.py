@@ -0,0 +1,207 @@
+"""Offline micro-benchmarks for the search pipeline.
+
+Runs the parsing, per-product post-processing, ranking and dedup stages against
+the result pages in ``fixtures/``, without touching the network, and optionally
+the parse pool. Use ``python manage.py benchmark_search``.
+
+The fixtures are synthetic: pages built to each marketplace's result markup (the
+elements our selectors read, at a realistic page weight and product count, with
+gaps such as a missing rating), not captured pages. Every product carries the
+text fields the extractors' _process_product requires (title, price, and on
+Amazon the list price). Any product that fails to extract is reported as an
+error, and the command exits non-zero, so a run never quietly times exception
+paths.
+"""
+import gc
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from selectorlib import Extractor
+
+from chat.utils.extraction import CompiledExtractor
+from chat.utils.parsing import ParsePool
+from chat.utils.products import MultiPlatformSearcher
+from chat.utils.SearchAmazon import AmazonSearchExtractor, YAML_STRING as AMAZON_YAML
+from chat.utils.SearchAliexpress import AliExpressSearchExtractor, YAML_STRING as ALIEXPRESS_YAML
+from chat.utils.SearchJumia import JumiaSearchExtractor, YAML_STRING as JUMIA_YAML
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+SOURCES = {
+    'amazon': (AmazonSearchExtractor, AMAZON_YAML, 'amazon_search.html'),
+    'aliexpress': (AliExpressSearchExtractor, ALIEXPRESS_YAML, 'aliexpress_search.html'),
+    'jumia': (JumiaSearchExtractor, JUMIA_YAML, 'jumia_search.html'),
+}
+
+ENGINES = {
+    'selectorlib': Extractor.from_yaml_string,
+    'compiled': CompiledExtractor.from_yaml_string,
+}
+
+DEFAULT_RANK_SIZES = (100, 1000, 10000)
+# Matches the products repeated in the closing event of a streamed chat response
+DEFAULT_RANK_TOP_K = 20
+
+
+def load_fixture(source: str) -> str:
+    return (FIXTURES_DIR / SOURCES[source][2]).read_text(encoding='utf-8')
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Time ``fn`` ``repeat`` times and trace the allocations of one extra run."""
+    fn()  # warm up caches and lazy imports
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    allocated_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+
+    return {
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'peak_kib': peak / 1024,
+        'blocks': allocated_blocks,
+    }
+
+
+def bench_parse(source: str, engine: str, repeat: int) -> Dict[str, Any]:
+    html = load_fixture(source)
+    extractor = ENGINES[engine](SOURCES[source][1])
+    count = len(extractor.extract(html)['products'] or [])
+    result = measure(lambda: extractor.extract(html), repeat)
+    return {'stage': 'parse', 'source': source, 'engine': engine, 'items': count, **result}
+
+
+def bench_process(source: str, repeat: int) -> Dict[str, Any]:
+    extractor_cls, yaml_string, _ = SOURCES[source]
+    extractor = extractor_cls()
+    raw_products = CompiledExtractor.from_yaml_string(yaml_string).extract(load_fixture(source))['products'] or []
+
+    def run():
+        errors = 0
+        for product in raw_products:
+            try:
+                extractor._process_product(product)
+            except Exception:
+                errors += 1
+        return errors
+
+    errors = run()
+    result = measure(run, repeat)
+    return {'stage': 'process', 'source': source, 'engine': '-', 'items': len(raw_products), 'errors': errors, **result}
+
+
+def processed_corpus() -> List[Dict[str, Any]]:
+    """All fixture products, through ``_process_product``."""
+    corpus = []
+    for source, (extractor_cls, yaml_string, _) in SOURCES.items():
+        extractor = extractor_cls()
+        for product in CompiledExtractor.from_yaml_string(yaml_string).extract(load_fixture(source))['products'] or []:
+            corpus.append(extractor._process_product(product))
+    return corpus
+
+
+def synthetic_products(corpus: List[Dict[str, Any]], size: int, seed: int = 0) -> List[Dict[str, Any]]:
+    # Resample the fixture products at random so larger runs keep a realistic mix of
+    # sources and missing fields, and the sort never sees pre-ordered input
+    rnd = random.Random(seed)
+    return [dict(rnd.choice(corpus)) for _ in range(size)]
+
+
+def bench_rank(size: int, repeat: int, corpus: List[Dict[str, Any]] = None, top_k: int = None) -> Dict[str, Any]:
+    products = synthetic_products(corpus or processed_corpus(), size)
+    searcher = MultiPlatformSearcher()
+    sort_criteria = [('price', False), ('rating', True)]
+    count = searcher.ranker.rank(products, sort_criteria, top_k)[1]
+    result = measure(lambda: searcher.ranker.rank(products, sort_criteria, top_k), repeat)
+    engine = f'top{top_k}' if top_k else '-'
+    return {'stage': 'rank', 'source': 'all', 'engine': engine, 'items': size, 'kept': count, **result}
+
+
+def bench_dedup(size: int, repeat: int, corpus: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # Suffix the titles and images so most resampled listings are distinct, like a
+    # real result set, instead of exact copies that are merged without hashing
+    rnd = random.Random(1)
+    products = [
+        dict(product, title=f"{product['title']} {rnd.randint(0, size)}", image=f"{product['image']}.{i}")
+        for i, product in enumerate(synthetic_products(corpus or processed_corpus(), size))
+    ]
+    searcher = MultiPlatformSearcher()
+    count = searcher.rank_products(products, top_k=DEFAULT_RANK_TOP_K)[1]
+    result = measure(lambda: searcher.rank_products(products, top_k=DEFAULT_RANK_TOP_K), repeat)
+    return {'stage': 'dedup', 'source': 'all', 'engine': f'top{DEFAULT_RANK_TOP_K}', 'items': size, 'kept': count, **result}
+
+
+def bench_parse_pool(workers: int, pages: int, repeat: int) -> Dict[str, Any]:
+    """Parse and process ``pages`` fixture pages (the sources in turn) from as many
+    threads, like the concurrent fetches of a busy worker; ``workers`` processes in
+    the parse pool, or 0 to parse on the threads themselves."""
+    extractors = [(extractor_cls(), load_fixture(source).encode('utf-8')) for source, (extractor_cls, _, _) in SOURCES.items()]
+    jobs = [extractors[i % len(extractors)] for i in range(pages)]
+    pool = ParsePool({'WORKERS': workers, 'MIN_BYTES': 0})
+
+    def parse(job):
+        extractor, content = job
+        try:
+            products = pool.parse(extractor, content, 'utf-8') if pool.enabled else None
+            if products is None:
+                products = extractor.process(extractor.parse(content.decode('utf-8')))
+        except Exception:
+            return 0, 1
+        return len(products), 0
+
+    executor = ThreadPoolExecutor(max_workers=pages)
+    try:
+        def run():
+            counts = list(executor.map(parse, jobs))
+            return sum(count for count, _ in counts), sum(errors for _, errors in counts)
+
+        count, errors = run()
+        result = measure(run, repeat)
+    finally:
+        executor.shutdown()
+        pool.shutdown()
+    engine = f'{workers} procs' if workers else 'threads'
+    return {'stage': 'pool', 'source': 'all', 'engine': engine, 'items': count, 'errors': errors, **result}
+
+
+def run_suite(sources=None, engines=None, rank_sizes=DEFAULT_RANK_SIZES, repeat: int = 20, pool_workers=(), pool_pages: int = 24) -> List[Dict[str, Any]]:
+    sources = sources or list(SOURCES)
+    engines = engines or list(ENGINES)
+    results = []
+    for source in sources:
+        for engine in engines:
+            results.append(bench_parse(source, engine, repeat))
+        results.append(bench_process(source, repeat))
+
+    corpus = processed_corpus()
+    for size in rank_sizes:
+        results.append(bench_rank(size, repeat, corpus))
+        results.append(bench_rank(size, repeat, corpus, top_k=DEFAULT_RANK_TOP_K))
+        results.append(bench_dedup(size, repeat, corpus))
+
+    if pool_workers:
+        results.append(bench_parse_pool(0, pool_pages, repeat))
+        for workers in pool_workers:
+            results.append(bench_parse_pool(workers, pool_pages, repeat))
+
+    for result in results:
+        result['items_per_sec'] = result['items'] / result['median'] if result['median'] else float('inf')
+    return results
@@ -0,0 +1,142 @@
+import logging
+import re
+
+from django.conf import settings
+
+from .models import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Most recent messages sent to the model word for word
+    'MAX_MESSAGES': 12,
+    # Messages allowed to pile up past the window before they are folded into the summary;
+    # the summary is only recomputed once every SUMMARY_STEP messages
+    'SUMMARY_STEP': 6,
+    'MAX_SUMMARY_CHARS': 2000,
+}
+
+SUMMARY_PROMPT = """
+You are maintaining a running summary of a conversation between a shopper and chatshop, a product search assistant.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep the products the user searched for, their requirements (budget, brand, specs, sizes) and any preferences or decisions. Leave out greetings and product listings. Answer with the summary only, in at most {max_chars} characters.
+"""
+
+_product_json = re.compile(r'\{[^{}]*"product"[^{}]*\}')
+
+
+def strip_product_json(text):
+    """Replace ``{"product": ...}`` blocks in a model turn with a short note."""
+    def note(match):
+        product = re.search(r'"product"\s*:\s*"([^"]*)"', match.group(0))
+        return f"(searched for: {product.group(1)})" if product else ''
+    return _product_json.sub(note, text).strip()
+
+
+def history_entry(role, text):
+    return {'role': role, 'parts': [{'text': text}]}
+
+
+class ContextWindow:
+    """Bounds the conversation sent to the model on each turn.
+
+    The model sees, in order: a rolling summary of everything up to
+    ``ChatHistory.summary_seq``, the messages after it that have left the window
+    (product JSON stripped), and the last ``MAX_MESSAGES`` messages verbatim. Only
+    messages after the summary boundary are read, so the prompt and the query stay
+    the same size however long the session runs.
+    """
+
+    def __init__(self, client, config=None):
+        config = {**DEFAULTS, **(config if config is not None else getattr(settings, 'CHATSHOP_CONTEXT', {}))}
+        self.client = client
+        self.max_messages = config['MAX_MESSAGES']
+        self.summary_step = config['SUMMARY_STEP']
+        self.max_summary_chars = config['MAX_SUMMARY_CHARS']
+
+    def build(self, chat_history, pending=()):
+        messages = list(chat_history.messages.filter(seq__gt=chat_history.summary_seq))
+        if len(messages) > self.max_messages + self.summary_step:
+            evicted, messages = messages[:-self.max_messages], messages[-self.max_messages:]
+            self.advance_summary(chat_history, evicted)
+        return self.entries(chat_history, messages, pending)
+
+    async def abuild(self, chat_history, pending=()):
+        messages = [message async for message in chat_history.messages.filter(seq__gt=chat_history.summary_seq)]
+        if len(messages) > self.max_messages + self.summary_step:
+            evicted, messages = messages[:-self.max_messages], messages[-self.max_messages:]
+            await self.aadvance_summary(chat_history, evicted)
+        return self.entries(chat_history, messages, pending)
+
+    def entries(self, chat_history, messages, pending):
+        entries = []
+        if chat_history.summary:
+            entries.append(history_entry('user', f"Summary of our conversation so far: {chat_history.summary}"))
+            entries.append(history_entry('model', "Thanks, I'll keep that in mind."))
+
+        cutoff = len(messages) - self.max_messages
+        for i, message in enumerate(messages):
+            text = message.text
+            if i < cutoff and message.role == 'model':
+                text = strip_product_json(text)
+            entries.append(history_entry(message.role, text))
+
+        entries.extend(history_entry(role, text) for role, text in pending)
+        return entries
+
+    def advance_summary(self, chat_history, evicted):
+        summary = self.summarize(chat_history.summary, evicted)
+        # Another request on this session may have advanced the summary concurrently; only
+        # the first writer wins and the loser just uses its own summary for this turn
+        ChatHistory.objects.filter(pk=chat_history.pk, summary_seq=chat_history.summary_seq).update(
+            summary=summary,
+            summary_seq=evicted[-1].seq,
+        )
+        chat_history.summary = summary
+        chat_history.summary_seq = evicted[-1].seq
+
+    async def aadvance_summary(self, chat_history, evicted):
+        summary = await self.asummarize(chat_history.summary, evicted)
+        await ChatHistory.objects.filter(pk=chat_history.pk, summary_seq=chat_history.summary_seq).aupdate(
+            summary=summary,
+            summary_seq=evicted[-1].seq,
+        )
+        chat_history.summary = summary
+        chat_history.summary_seq = evicted[-1].seq
+
+    def _summary_lines(self, messages):
+        return [f"{message.role}: {strip_product_json(message.text) if message.role == 'model' else message.text}" for message in messages]
+
+    def _summary_prompt(self, summary, lines):
+        return SUMMARY_PROMPT.format(
+            summary=summary or '(none yet)',
+            messages='\n'.join(lines),
+            max_chars=self.max_summary_chars,
+        )
+
+    def _fallback_summary(self, summary, lines, error):
+        logger.warning("Summarizing chat history failed, falling back to truncation: %s", error)
+        # Keep the most recent part when we cannot ask the model to condense it
+        return ' '.join([summary] + lines).strip()[-self.max_summary_chars:]
+
+    def summarize(self, summary, messages):
+        lines = self._summary_lines(messages)
+        try:
+            new_summary = self.client.generate(self._summary_prompt(summary, lines)).strip()
+        except Exception as e:
+            return self._fallback_summary(summary, lines, e)
+        return new_summary[:self.max_summary_chars]
+
+    async def asummarize(self, summary, messages):
+        lines = self._summary_lines(messages)
+        try:
+            new_summary = (await self.client.agenerate(self._summary_prompt(summary, lines))).strip()
+        except Exception as e:
+            return self._fallback_summary(summary, lines, e)
+        return new_summary[:self.max_summary_chars]
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+
+from .utils.cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Answer explicit product requests ("I want to buy an iphone 13 128gb") without the model;
+    # opt-in, since a misread request scrapes for something the user never asked for
+    'RULES': False,
+    # Words a request's product phrase needs before the rules trust it; shorter ones
+    # ("a laptop") go to the model, which asks for details
+    'MIN_WORDS': 3,
+    'MAX_WORDS': 12,
+    # Django cache alias for model replies; None disables the reply cache
+    'CACHE_ALIAS': 'search',
+    'CACHE_TTL': 24 * 60 * 60,
+}
+
+_intent = re.compile(
+    r"^(?:(?:hi|hello|hey)\b[\s,!.]*)?(?:please\s+)?(?:"
+    r"i(?:'d| would)\s+like\s+(?:to\s+(?:buy|purchase|order|get)\s+)?"
+    r"|i\s+(?:want|need)\s+(?:to\s+(?:buy|purchase|order|get)\s+)?"
+    r"|(?:i'm|i\s+am)\s+looking\s+for\s+"
+    r"|looking\s+for\s+"
+    r"|(?:search|find|show|get)\s+(?:me\s+)?(?:for\s+)?"
+    r"|(?:buy|purchase|order)\s+"
+    r")(?:an?|some|the|new)?\s*",
+    re.IGNORECASE,
+)
+# Continuations that make a request something other than a product ("I want to know...",
+# "show me how...", "find my order")
+_not_a_product = re.compile(
+    r"^(?:to|how|what|where|when|why|who|which|if|whether|my|your|our|his|her|their|me|us)\b",
+    re.IGNORECASE,
+)
+_trailing = re.compile(r"[\s,.!]*(?:\b(?:please|thanks|thank you)\b[\s,.!]*)*$", re.IGNORECASE)
+_word = re.compile(r"[\w'-]+")
+# Words that make a request depend on context or need a judgement call from the model
+AMBIGUOUS_WORDS = frozenset({
+    'it', 'one', 'ones', 'that', 'this', 'these', 'those', 'them', 'same', 'similar', 'another', 'other',
+    'more', 'cheaper', 'better', 'something', 'anything', 'stuff', 'thing', 'things', 'gift', 'present',
+    'recommend', 'recommendation', 'recommendations', 'suggest', 'suggestion', 'or', 'but', 'not',
+    "don't", 'dont', 'no', 'never', 'help', 'idea', 'ideas',
+})
+# Words of support and account requests, which the model should handle
+SERVICE_WORDS = frozenset({
+    'order', 'orders', 'refund', 'refunds', 'return', 'returns', 'policy', 'policies', 'agent', 'human',
+    'person', 'support', 'service', 'customer', 'account', 'password', 'login', 'delivery', 'shipping',
+    'tracking', 'track', 'cancel', 'complaint', 'job', 'jobs', 'results', 'history', 'previous',
+})
+
+GREETING = "Hi, I'm chatshop, your shopping assistant!"
+
+
+class FastReply(NamedTuple):
+    """Stands in for a model response; only ``text`` is read."""
+    text: str
+
+
+class FastPath:
+    """Answers chat turns without calling the model when that is safe.
+
+    Explicit product requests are recognised by a few conservative rules and get a
+    reply in the model's format (the ``{"product": ...}`` block, then the message).
+    Other turns are looked up in a cache of model replies keyed by the normalized
+    input and everything else the model would be sent (the session's rolling
+    summary and its recent messages), so a reply is only reused for a turn the
+    model would see the same way, e.g. the opening message of a new session.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+
+    # Rules
+
+    def extract(self, user_input: str) -> Optional[str]:
+        """The product phrase of an unambiguous product request, else None."""
+        text = ' '.join((user_input or '').split())
+        if not text or '?' in text:
+            return None
+        match = _intent.match(text)
+        if match is None:
+            return None
+        product = _trailing.sub('', text[match.end():])
+        if _not_a_product.match(product):
+            return None
+        words = _word.findall(product.lower())
+        if not self.config['MIN_WORDS'] <= len(words) <= self.config['MAX_WORDS']:
+            return None
+        if any(word in AMBIGUOUS_WORDS or word in SERVICE_WORDS for word in words):
+            return None
+        return product
+
+    def rule_reply(self, user_input: str, is_new_session: bool) -> Optional[FastReply]:
+        if not (self.enabled and self.config['RULES']):
+            return None
+        product = self.extract(user_input)
+        if product is None:
+            return None
+        message = f'Here are some options I found for "{product}".'
+        if is_new_session:
+            message = f"{GREETING} {message}"
+        return FastReply(f'{json.dumps({"product": product})}\n{message}')
+
+    # Reply cache
+
+    def _cache(self):
+        alias = self.config['CACHE_ALIAS']
+        if not self.enabled or alias is None:
+            return None
+        from django.core.cache import caches
+        return caches[alias]
+
+    def key(self, user_input: str, history: List[Dict[str, Any]], is_new_session: bool) -> str:
+        """Cache key for a turn; ``history`` is what the model would be sent, ending with this input."""
+        # All of the context, not just its tail: the cache is shared by every session
+        state = json.dumps([is_new_session, normalize_query(user_input).strip(' .!'), history[:-1]], sort_keys=True)
+        return f"chatshop:reply:{hashlib.sha1(state.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[FastReply]:
+        cache = self._cache()
+        if cache is None:
+            return None
+        try:
+            text = cache.get(key)
+        except Exception as e:
+            logger.warning("Reply cache read failed: %s", e)
+            return None
+        return None if text is None else FastReply(text)
+
+    def set(self, key: str, text: str) -> None:
+        cache = self._cache()
+        if cache is None or not text:
+            return
+        try:
+            cache.set(key, text, timeout=self.config['CACHE_TTL'])
+        except Exception as e:
+            logger.warning("Reply cache write failed: %s", e)
+
+    async def aget(self, key: str) -> Optional[FastReply]:
+        cache = self._cache()
+        if cache is None:
+            return None
+        try:
+            text = await cache.aget(key)
+        except Exception as e:
+            logger.warning("Reply cache read failed: %s", e)
+            return None
+        return None if text is None else FastReply(text)
+
+    async def aset(self, key: str, text: str) -> None:
+        cache = self._cache()
+        if cache is None or not text:
+            return
+        try:
+            await cache.aset(key, text, timeout=self.config['CACHE_TTL'])
+        except Exception as e:
+            logger.warning("Reply cache write failed: %s", e)
+
+
+_fast_path = None
+_fast_path_lock = threading.Lock()
+
+
+def get_fast_path() -> FastPath:
+    """Return the process-wide fast path, configured from CHATSHOP_FAST_PATH."""
+    global _fast_path
+    if _fast_path is None:
+        with _fast_path_lock:
+            if _fast_path is None:
+                _fast_path = FastPath(getattr(settings, 'CHATSHOP_FAST_PATH', None))
+    return _fast_path
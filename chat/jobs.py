@@ -0,0 +1,197 @@
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import SearchJob
+from .utils.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Chat turns search inline unless this is on and run_search_worker processes are running
+    'ENABLED': False,
+    # Seconds a worker holds a job between progress updates before another may take it over
+    'LEASE': 120,
+    # Claims per job, including ones whose worker died, before it is marked failed
+    'MAX_ATTEMPTS': 3,
+    # Seconds an idle worker waits before looking for work again; also sent to
+    # pollers as Retry-After
+    'POLL_INTERVAL': 1.0,
+    # Best offers stored after each page while a job runs; the final result has them all
+    'PARTIAL_LIMIT': 20,
+}
+
+
+def worker_name(suffix: Any = None) -> str:
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    return (name if suffix is None else f'{name}:{suffix}')[-64:]
+
+
+class SearchJobQueue:
+    """Product searches queued in the database and run by ``run_search_worker``.
+
+    Workers claim the oldest queued job with ``SELECT ... FOR UPDATE SKIP LOCKED``
+    where the database supports it, so any number of them can drain the table
+    without a broker. A claim is a lease: a job whose worker stops extending it
+    goes back to the queue.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self.lease = timedelta(seconds=self.config['LEASE'])
+        self.max_attempts = self.config['MAX_ATTEMPTS']
+        self.poll_interval = self.config['POLL_INTERVAL']
+        self.partial_limit = self.config['PARTIAL_LIMIT']
+
+    # Producing
+
+    def enqueue(self, query: str, chat=None, num_pages: int = 3, sources=None) -> SearchJob:
+        with timed('db', operation='enqueue_job'):
+            return SearchJob.objects.create(query=query, chat=chat, num_pages=num_pages, sources=list(sources or []))
+
+    async def aenqueue(self, query: str, chat=None, num_pages: int = 3, sources=None) -> SearchJob:
+        with timed('db', operation='enqueue_job'):
+            return await SearchJob.objects.acreate(query=query, chat=chat, num_pages=num_pages, sources=list(sources or []))
+
+    # Consuming
+
+    def claim(self, worker: str) -> Optional[SearchJob]:
+        """Take the oldest available job for ``worker``, or return None when there is none."""
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                pending = (
+                    SearchJob.objects
+                    .filter(status__in=[SearchJob.QUEUED, SearchJob.RUNNING])
+                    .filter(Q(status=SearchJob.QUEUED) | Q(lease_until__lt=now))
+                    .order_by('created_at')
+                )
+                if connection.features.has_select_for_update_skip_locked:
+                    pending = pending.select_for_update(skip_locked=True)
+                job = pending.first()
+                if job is None:
+                    return None
+
+                if job.attempts >= self.max_attempts:
+                    # Its last worker died holding it
+                    SearchJob.objects.filter(pk=job.pk, attempts=job.attempts).update(
+                        status=SearchJob.FAILED,
+                        error=job.error or 'The worker running this search stopped responding',
+                        lease_until=None,
+                        finished_at=now,
+                    )
+                    continue
+
+                # attempts doubles as a version number, so two workers racing on a
+                # database without row locks can't both win
+                claimed = SearchJob.objects.filter(pk=job.pk, attempts=job.attempts).update(
+                    status=SearchJob.RUNNING,
+                    worker=worker,
+                    lease_until=now + self.lease,
+                    attempts=F('attempts') + 1,
+                    started_at=now,
+                )
+            if claimed:
+                job.refresh_from_db()
+                return job
+
+    def _update(self, job: SearchJob, worker: str, **fields) -> bool:
+        """Write ``fields`` if ``worker`` still holds ``job``; False means the lease was lost."""
+        return bool(SearchJob.objects.filter(pk=job.pk, worker=worker, status=SearchJob.RUNNING).update(**fields))
+
+    def run(self, job: SearchJob, worker: str, searcher=None) -> None:
+        """Search for ``job``, storing ranked results after every page."""
+        from .utils.products import MultiPlatformSearcher
+
+        searcher = searcher or MultiPlatformSearcher()
+        if job.sources:
+            # Searchers share the registry's extractors, so one per job costs nothing
+            searcher = MultiPlatformSearcher(sources=job.sources)
+        try:
+            products = searcher.search_index(job.query, job.num_pages)
+            if products is None:
+                products = []
+                pages_total = len(searcher.extractors) * job.num_pages
+                pages_done = 0
+                for _, _, page in searcher.iter_search(job.query, job.num_pages):
+                    products.extend(page)
+                    pages_done += 1
+                    if pages_done == pages_total:
+                        continue
+                    partial, count = searcher.rank_products(products, top_k=self.partial_limit)
+                    if not self._update(
+                        job, worker,
+                        products=partial,
+                        count=count,
+                        pages_done=pages_done,
+                        pages_total=pages_total,
+                        lease_until=timezone.now() + self.lease,
+                    ):
+                        logger.warning("Search job %s was taken over by another worker", job.pk)
+                        return
+            else:
+                pages_total = pages_done = 0
+
+            ranked, count = searcher.rank_products(products)
+            self._update(
+                job, worker,
+                status=SearchJob.DONE,
+                products=ranked,
+                count=count,
+                pages_done=pages_done,
+                pages_total=pages_total,
+                error='',
+                lease_until=None,
+                finished_at=timezone.now(),
+            )
+        except Exception as e:
+            logger.warning("Search job %s failed: %s", job.pk, e)
+            if job.attempts >= self.max_attempts:
+                self._update(job, worker, status=SearchJob.FAILED, error=str(e), lease_until=None, finished_at=timezone.now())
+            else:
+                self._update(job, worker, status=SearchJob.QUEUED, error=str(e), lease_until=None)
+
+    def work(self, worker: str, stop: threading.Event, burst: bool = False, poll_interval: float = None) -> None:
+        """Claim and run jobs until ``stop`` is set, or, with ``burst``, until the queue is empty."""
+        from .utils.products import MultiPlatformSearcher
+
+        poll_interval = self.poll_interval if poll_interval is None else poll_interval
+        searcher = MultiPlatformSearcher()
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = self.claim(worker)
+            except OperationalError as e:
+                # e.g. SQLite's "database is locked" with several workers
+                logger.warning("Claiming a search job failed: %s", e)
+                job = None
+            if job is not None:
+                self.run(job, worker, searcher)
+                continue
+            if burst:
+                break
+            stop.wait(poll_interval)
+        close_old_connections()
+
+
+_search_job_queue: Optional[SearchJobQueue] = None
+_search_job_queue_lock = threading.Lock()
+
+
+def get_search_job_queue() -> SearchJobQueue:
+    """Return the process-wide search job queue, configured from CHATSHOP_SEARCH_JOBS."""
+    global _search_job_queue
+    if _search_job_queue is None:
+        with _search_job_queue_lock:
+            if _search_job_queue is None:
+                from django.conf import settings
+                _search_job_queue = SearchJobQueue(getattr(settings, 'CHATSHOP_SEARCH_JOBS', None))
+    return _search_job_queue
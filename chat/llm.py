@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .utils.metrics import timed
+
+DEFAULTS = {
+    # 'gemini', 'stub' or a dotted path to a backend class
+    'BACKEND': 'gemini',
+    'MODEL': 'gemini-1.5-flash',
+    # Seconds allowed for a single model call
+    'TIMEOUT': 30,
+    # Model calls allowed in flight per worker process; further callers wait ACQUIRE_TIMEOUT seconds
+    'MAX_IN_FLIGHT': 8,
+    'ACQUIRE_TIMEOUT': 5,
+    # Simulated model latency in seconds for the stub backend
+    'STUB_LATENCY': 0,
+}
+
+BACKEND_ALIASES = {
+    'gemini': 'chat.llm.GeminiBackend',
+    'stub': 'chat.llm.StubBackend',
+}
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMBusyError(LLMError):
+    """Raised when the worker already has MAX_IN_FLIGHT model calls running."""
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when a model call runs past its deadline."""
+
+
+class GeminiBackend:
+    def __init__(self, config):
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        self._timeout_errors = (google_exceptions.DeadlineExceeded,)
+        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+        # GenerativeModel holds the gRPC client; building it once per worker keeps the channel warm
+        self.model = genai.GenerativeModel(config['MODEL'])
+
+    def start_chat(self, history):
+        return self.model.start_chat(history=history)
+
+    def send_message(self, chat, prompt, timeout):
+        try:
+            return chat.send_message(prompt, request_options={'timeout': timeout})
+        except self._timeout_errors as e:
+            raise LLMTimeoutError(str(e)) from e
+
+    def generate(self, prompt, timeout):
+        try:
+            return self.model.generate_content(prompt, request_options={'timeout': timeout}).text
+        except self._timeout_errors as e:
+            raise LLMTimeoutError(str(e)) from e
+
+    async def asend_message(self, chat, prompt, timeout):
+        try:
+            return await asyncio.wait_for(chat.send_message_async(prompt, request_options={'timeout': timeout}), timeout)
+        except (asyncio.TimeoutError, *self._timeout_errors) as e:
+            raise LLMTimeoutError(str(e) or f"Model call exceeded the {timeout}s deadline") from e
+
+    async def agenerate(self, prompt, timeout):
+        try:
+            response = await asyncio.wait_for(self.model.generate_content_async(prompt, request_options={'timeout': timeout}), timeout)
+        except (asyncio.TimeoutError, *self._timeout_errors) as e:
+            raise LLMTimeoutError(str(e) or f"Model call exceeded the {timeout}s deadline") from e
+        return response.text
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubChat:
+    def __init__(self, history):
+        self.history = list(history)
+
+
+class StubBackend:
+    """Deterministic offline backend for load tests and local development.
+
+    Replies like the product assistant would: inputs that mention buying or
+    searching for something come back with a ``{"product": ...}`` JSON block,
+    anything else gets a canned nudge back towards shopping.
+    """
+    product_pattern = re.compile(
+        r'^.*?\b(?:buy|purchase|want|need|looking for|search for|search|find|show me|get me)\b'
+        r'(?:\s+(?:to\s+buy|to\s+purchase))?\s*(?:an?|some|the)?\s+',
+        re.IGNORECASE,
+    )
+    input_pattern = re.compile(r'User input:\s*(.*?)\s*\n\s*\n', re.DOTALL)
+
+    def __init__(self, config):
+        self.latency = config['STUB_LATENCY']
+
+    def start_chat(self, history):
+        return StubChat(history)
+
+    def reply(self, prompt):
+        match = self.input_pattern.search(prompt)
+        user_input = match.group(1).strip() if match else prompt.strip()
+        match = self.product_pattern.search(user_input)
+        if match and user_input[match.end():].strip(' ,.!?'):
+            product = user_input[match.end():].strip(' ,.!?')
+            return f'{json.dumps({"product": product})}\nHere are some options I found for "{product}".'
+        return "Hi, I'm chatshop! What product would you like to search for today?"
+
+    def _respond(self, chat, prompt):
+        text = self.reply(prompt)
+        chat.history.extend([
+            {'role': 'user', 'parts': [{'text': prompt}]},
+            {'role': 'model', 'parts': [{'text': text}]},
+        ])
+        return StubResponse(text)
+
+    def send_message(self, chat, prompt, timeout):
+        if self.latency:
+            if self.latency > timeout:
+                time.sleep(timeout)
+                raise LLMTimeoutError(f"Stub reply exceeded the {timeout}s deadline")
+            time.sleep(self.latency)
+        return self._respond(chat, prompt)
+
+    def generate(self, prompt, timeout):
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+        return ' '.join(prompt.split())[:500]
+
+    async def asend_message(self, chat, prompt, timeout):
+        if self.latency:
+            if self.latency > timeout:
+                await asyncio.sleep(timeout)
+                raise LLMTimeoutError(f"Stub reply exceeded the {timeout}s deadline")
+            await asyncio.sleep(self.latency)
+        return self._respond(chat, prompt)
+
+    async def agenerate(self, prompt, timeout):
+        if self.latency:
+            await asyncio.sleep(min(self.latency, timeout))
+        return ' '.join(prompt.split())[:500]
+
+
+class ChatSession:
+    """A conversation bound to an LLMClient; every call goes through its limits."""
+
+    def __init__(self, client, chat):
+        self.client = client
+        self._chat = chat
+
+    def send_message(self, prompt):
+        return self.client.send_message(self._chat, prompt)
+
+    async def asend_message(self, prompt):
+        return await self.client.asend_message(self._chat, prompt)
+
+
+class LLMClient:
+    def __init__(self, backend, timeout=30, max_in_flight=8, acquire_timeout=5):
+        self.backend = backend
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        # asyncio semaphores belong to one event loop; async callers get one per loop
+        self._async_slots = weakref.WeakKeyDictionary()
+
+    @contextmanager
+    def _slot(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise LLMBusyError("Too many model calls in flight, try again shortly")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def _async_slot(self):
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = asyncio.BoundedSemaphore(self.max_in_flight)
+        try:
+            await asyncio.wait_for(slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise LLMBusyError("Too many model calls in flight, try again shortly")
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def start_chat(self, history):
+        return ChatSession(self, self.backend.start_chat(history))
+
+    def send_message(self, chat, prompt):
+        with self._slot(), timed('llm', call='chat'):
+            return self.backend.send_message(chat, prompt, self.timeout)
+
+    def generate(self, prompt):
+        with self._slot(), timed('llm', call='generate'):
+            return self.backend.generate(prompt, self.timeout)
+
+    async def asend_message(self, chat, prompt):
+        async with self._async_slot():
+            with timed('llm', call='chat'):
+                return await self.backend.asend_message(chat, prompt, self.timeout)
+
+    async def agenerate(self, prompt):
+        async with self._async_slot():
+            with timed('llm', call='generate'):
+                return await self.backend.agenerate(prompt, self.timeout)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def build_llm_client(config=None):
+    config = {**DEFAULTS, **(config or {})}
+    backend_cls = import_string(BACKEND_ALIASES.get(config['BACKEND'], config['BACKEND']))
+    return LLMClient(
+        backend_cls(config),
+        timeout=config['TIMEOUT'],
+        max_in_flight=config['MAX_IN_FLIGHT'],
+        acquire_timeout=config['ACQUIRE_TIMEOUT'],
+    )
+
+
+def get_llm_client():
+    """Return the worker's LLM client, built from CHATSHOP_LLM on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_llm_client(getattr(settings, 'CHATSHOP_LLM', None))
+    return _client
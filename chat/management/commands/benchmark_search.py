@@ -0,0 +1,57 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.benchmarks import DEFAULT_RANK_SIZES, ENGINES, SOURCES, run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark parsing, product post-processing, ranking and dedup offline against the fixture result pages. "
+        "Exits non-zero if any product fails to extract."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='append', choices=sorted(SOURCES), help="Limit to a source (repeatable).")
+        parser.add_argument('--engine', action='append', choices=sorted(ENGINES), help="Limit to a parsing engine (repeatable).")
+        parser.add_argument('--rank-size', action='append', type=int, help="Product counts for the ranking and dedup stages (repeatable).")
+        parser.add_argument('--pool-workers', action='append', type=int, help="Also time the parse pool with this many processes (repeatable).")
+        parser.add_argument('--pool-pages', type=int, default=24, help="Pages parsed at once in the parse pool benchmark.")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per benchmark.")
+        parser.add_argument('--json', action='store_true', help="Print raw results as JSON.")
+
+    def handle(self, *args, **options):
+        results = run_suite(
+            sources=options['source'],
+            engines=options['engine'],
+            rank_sizes=options['rank_size'] or DEFAULT_RANK_SIZES,
+            repeat=options['repeat'],
+            pool_workers=options['pool_workers'] or (),
+            pool_pages=options['pool_pages'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_table(results)
+
+        failed = [r for r in results if r.get('errors')]
+        if failed:
+            raise CommandError("Extraction failed for " + ', '.join(
+                f"{r['stage']} {r['source']} {r['engine']} ({r['errors']} failed)" for r in failed
+            ))
+
+    def print_table(self, results):
+        header = f"{'stage':<8} {'source':<11} {'engine':<12} {'items':>6} {'median ms':>10} {'min ms':>9} {'items/s':>11} {'peak KiB':>9} {'blocks':>8}  notes"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for r in results:
+            notes = []
+            if r.get('errors'):
+                notes.append(f"{r['errors']} failed")
+            if 'kept' in r:
+                notes.append(f"{r['kept']} kept")
+            self.stdout.write(
+                f"{r['stage']:<8} {r['source']:<11} {r['engine']:<12} {r['items']:>6} "
+                f"{r['median'] * 1000:>10.3f} {r['min'] * 1000:>9.3f} {r['items_per_sec']:>11.0f} "
+                f"{r['peak_kib']:>9.1f} {r['blocks']:>8}  {', '.join(notes)}"
+            )
@@ -0,0 +1,51 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+
+from chat.retention import get_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive chat sessions idle longer than CHATSHOP_RETENTION['MAX_AGE_DAYS'] to cold storage "
+        "and delete them in batches, with finished search jobs. Run from cron, or with --every."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, help="Override the configured MAX_AGE_DAYS.")
+        parser.add_argument('--batch-size', type=int, help="Sessions per archive file and delete transaction.")
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches; the rest waits for the next run.")
+        parser.add_argument('--no-archive', action='store_true', help="Delete without writing to cold storage.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be purged.")
+        parser.add_argument('--every', type=float, help="Keep running, purging every this many seconds.")
+
+    def handle(self, *args, **options):
+        retention = get_retention()
+        if options['batch_size']:
+            retention.batch_size = max(options['batch_size'], 1)
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            # A batch is archived before it is deleted, so stopping between runs loses nothing
+            self.stdout.write("Stopping after the current run...")
+            stop.set()
+
+        if options['every']:
+            signal.signal(signal.SIGTERM, shutdown)
+            signal.signal(signal.SIGINT, shutdown)
+
+        while True:
+            stats = retention.run(
+                max_age_days=options['max_age_days'],
+                archive=False if options['no_archive'] else None,
+                max_batches=options['max_batches'],
+                dry_run=options['dry_run'],
+                log=self.stdout.write,
+            )
+            verb = "Would purge" if options['dry_run'] else "Purged"
+            self.stdout.write(
+                f"{verb} {stats['sessions']} session(s), {stats['messages']} message(s) and "
+                f"{stats['jobs']} search job(s); {stats['files']} archive file(s) written"
+            )
+            if not options['every'] or stop.wait(options['every']):
+                break
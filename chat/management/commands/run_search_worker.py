@@ -0,0 +1,44 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+
+from chat.jobs import get_search_job_queue, worker_name
+
+
+class Command(BaseCommand):
+    help = "Run queued product searches (see CHATSHOP_SEARCH_JOBS). Start as many as scraping needs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1, help="Jobs run side by side in this process.")
+        parser.add_argument('--poll-interval', type=float, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        queue = get_search_job_queue()
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            # Finish the jobs in hand; anything interrupted goes back to the queue when its lease expires
+            self.stdout.write("Stopping after the current jobs...")
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        threads = [
+            threading.Thread(
+                target=queue.work,
+                args=(worker_name(i), stop),
+                kwargs={'burst': options['burst'], 'poll_interval': options['poll_interval']},
+                name=f'search-worker-{i}',
+                daemon=True,
+            )
+            for i in range(max(options['threads'], 1))
+        ]
+        self.stdout.write(f"Running {len(threads)} search worker thread(s) as {worker_name()}")
+        for thread in threads:
+            thread.start()
+        # Join with a timeout so the main thread keeps handling signals
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1.0)
@@ -0,0 +1,198 @@
+import time
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.cache import patch_vary_headers
+
+from .shaping import get_response_shaper
+from .utils.metrics import collect_request_timings, get_metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class ServerTimingMiddleware:
+    """Times every request and reports its stages in a ``Server-Timing`` header.
+
+    Stages timed with ``chat.utils.metrics.timed`` while the view runs (model call,
+    page fetches, parsing, ranking, database writes) are summed per stage and label.
+    Streamed bodies are produced after this returns; their stages only reach the
+    histograms.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.metrics = get_metrics()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with collect_request_timings() as timings:
+            response = self.get_response(request)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with collect_request_timings() as timings:
+            response = await self.get_response(request)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, elapsed):
+        if not self.metrics.enabled:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        self.metrics.observe(
+            'request', elapsed,
+            view=match.url_name if match and match.url_name else 'unmatched',
+            method=request.method,
+            status=response.status_code,
+        )
+        if self.metrics.config['SERVER_TIMING']:
+            response['Server-Timing'] = timings.header(total=elapsed)
+        return response
+
+
+class GzipStream:
+    def __init__(self):
+        # wbits 31 writes a gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def accepted_encodings(header):
+    """``{coding: q}`` for an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        accepted[coding] = weight
+    return accepted
+
+
+class CompressionMiddleware:
+    """Compresses responses with brotli or gzip, whichever the client prefers.
+
+    Unlike GZipMiddleware, streamed bodies are flushed after every chunk so
+    NDJSON and SSE chat events still reach the client as they are produced.
+    Brotli is only offered when the brotli package is installed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_response_shaper().config
+        self.codings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def choose_coding(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        best, best_weight = None, 0.0
+        # Ties go to the earlier, better compressing coding
+        for coding in self.codings:
+            weight = accepted.get(coding, accepted.get('*', 0.0))
+            if weight > best_weight:
+                best, best_weight = coding, weight
+        return best
+
+    def compressor(self, coding):
+        if coding == 'br':
+            return BrotliStream(self.config['BROTLI_QUALITY'])
+        return GzipStream()
+
+    def compress(self, request, response):
+        if not self.config['COMPRESSION'] or response.has_header('Content-Encoding'):
+            return response
+        # Not worth it for short bodies
+        if not response.streaming and len(response.content) < self.config['MIN_COMPRESS_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = self.choose_coding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.acompress_stream(response.streaming_content, self.compressor(coding))
+            else:
+                response.streaming_content = self.compress_stream(response.streaming_content, self.compressor(coding))
+            del response.headers['Content-Length']
+        else:
+            compressor = self.compressor(coding)
+            content = compressor.compress(response.content) + compressor.finish()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+
+        # The representation changed, so a strong ETag has to become a weak one
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = coding
+        return response
+
+    @staticmethod
+    def compress_stream(chunks, compressor):
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def acompress_stream(chunks, compressor):
+        async for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:49
+
+from django.db import migrations
+
+
+def copy_history_to_messages(apps, schema_editor):
+    ChatHistory = apps.get_model('chat', 'ChatHistory')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+
+    for chat in ChatHistory.objects.exclude(history=[]).iterator(chunk_size=500):
+        messages = [
+            ChatMessage(chat=chat, seq=seq, role=entry.get('role', ''), text=entry['parts'][0]['text'])
+            for seq, entry in enumerate(chat.history or [], start=1)
+        ]
+        ChatMessage.objects.bulk_create(messages, batch_size=500)
+        chat.message_count = len(messages)
+        chat.history = []
+        chat.save(update_fields=['message_count', 'history'])
+
+
+def copy_messages_to_history(apps, schema_editor):
+    ChatHistory = apps.get_model('chat', 'ChatHistory')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+
+    for chat in ChatHistory.objects.filter(message_count__gt=0).iterator(chunk_size=500):
+        chat.history = [
+            {'role': message.role, 'parts': [{'text': message.text}]}
+            for message in ChatMessage.objects.filter(chat=chat).order_by('seq')
+        ]
+        chat.save(update_fields=['history'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_history_to_messages, copy_messages_to_history),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chathistory_timestamps_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chathistory',
+            name='summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='chathistory',
+            name='summary_seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chathistory_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('source', models.CharField(max_length=32)),
+                ('url', models.TextField()),
+                ('title', models.TextField()),
+                ('image', models.TextField(blank=True, default='')),
+                ('price', models.FloatField(null=True)),
+                ('currency', models.CharField(blank=True, default='', max_length=8)),
+                ('rating', models.FloatField(null=True)),
+                ('number_of_ratings', models.PositiveIntegerField(null=True)),
+                ('data', models.JSONField()),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-last_seen'], name='chat_product_last_seen'), models.Index(fields=['source', '-last_seen'], name='chat_product_source_seen')],
+            },
+        ),
+    ]
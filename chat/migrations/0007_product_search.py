@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# Full-text indexes for chat_product.title. Postgres gets a tsvector GIN index plus a
+# trigram index for fuzzy matches; SQLite gets an FTS5 table kept in sync by triggers.
+# Other backends fall back to unindexed LIKE lookups (see chat/utils/product_index.py).
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS chat_product_title_fts ON chat_product USING gin (to_tsvector('simple', title))",
+    "CREATE INDEX IF NOT EXISTS chat_product_title_trgm ON chat_product USING gin (title gin_trgm_ops)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS chat_product_title_trgm",
+    "DROP INDEX IF EXISTS chat_product_title_fts",
+]
+
+# Note that Django rebuilds SQLite tables on most ALTERs, which drops these triggers;
+# a later migration touching chat_product has to recreate them.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_product_fts USING fts5("
+    "title, content='chat_product', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS chat_product_fts_insert AFTER INSERT ON chat_product BEGIN "
+    "INSERT INTO chat_product_fts(rowid, title) VALUES (new.id, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_product_fts_delete AFTER DELETE ON chat_product BEGIN "
+    "INSERT INTO chat_product_fts(chat_product_fts, rowid, title) VALUES ('delete', old.id, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_product_fts_update AFTER UPDATE OF title ON chat_product BEGIN "
+    "INSERT INTO chat_product_fts(chat_product_fts, rowid, title) VALUES ('delete', old.id, old.title); "
+    "INSERT INTO chat_product_fts(rowid, title) VALUES (new.id, new.title); END",
+    "INSERT INTO chat_product_fts(chat_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS chat_product_fts_update",
+    "DROP TRIGGER IF EXISTS chat_product_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_product_fts_insert",
+    "DROP TABLE IF EXISTS chat_product_fts",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_product'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
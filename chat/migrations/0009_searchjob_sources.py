@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_searchjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchjob',
+            name='sources',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
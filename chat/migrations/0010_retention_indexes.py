@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_searchjob_sources'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['updated_at'], name='chat_history_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='searchjob',
+            index=models.Index(condition=models.Q(('status__in', ['done', 'failed'])), fields=['finished_at'], name='chat_search_job_finished'),
+        ),
+    ]
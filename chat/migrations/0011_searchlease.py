@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchLease',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=64)),
+                ('lease_until', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:10
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    # Tables of the DatabaseCache aliases in CACHES (the shared search tier), so a fresh
+    # deploy doesn't depend on someone running createcachetable; existing ones are kept
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_searchlease'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
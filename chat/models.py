@@ -1,8 +1,174 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 import uuid
+
+from .sync import get_history_sync
+from .utils.metrics import timed
+
 class ChatHistory(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     session_key = models.CharField(max_length=40, blank=True)
     email = models.EmailField(blank=False, null=False)
     input = models.TextField()
+    # Legacy whole-conversation blob; messages now live in ChatMessage
     history = models.JSONField(default=list, blank=True)
+    # Highest ChatMessage.seq handed out for this session
+    message_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Rolling summary of every message with seq <= summary_seq, sent to the model in their place
+    summary = models.TextField(blank=True, default='')
+    summary_seq = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['email', 'session_key'], name='chat_history_email_session'),
+            models.Index(fields=['session_key'], name='chat_history_session'),
+            models.Index(fields=['email', '-created_at'], name='chat_history_email_created'),
+            models.Index(fields=['-created_at'], name='chat_history_created'),
+            # Retention walks idle sessions oldest first
+            models.Index(fields=['updated_at'], name='chat_history_updated'),
+        ]
+
+    def append_messages(self, messages):
+        """Append (role, text) pairs as new ChatMessage rows in one insert.
+
+        Sequence numbers are reserved with a single UPDATE on this row, so concurrent
+        turns on the same session never reuse a seq and the cost does not depend on
+        the conversation length.
+        """
+        if not messages:
+            return []
+        with timed('db', operation='save_chat'), transaction.atomic():
+            ChatHistory.objects.filter(pk=self.pk).update(
+                message_count=F('message_count') + len(messages),
+                updated_at=timezone.now(),
+            )
+            last_seq = ChatHistory.objects.filter(pk=self.pk).values_list('message_count', flat=True).get()
+            first_seq = last_seq - len(messages) + 1
+            created = ChatMessage.objects.bulk_create([
+                ChatMessage(chat=self, seq=first_seq + i, role=role, text=text)
+                for i, (role, text) in enumerate(messages)
+            ])
+            # Wake this process's long-polls on the session once the rows are visible
+            transaction.on_commit(lambda: get_history_sync().notify(self.pk))
+        self.message_count = last_seq
+        return created
+
+    async def aappend_messages(self, messages):
+        # The seq reservation needs a transaction, which the async ORM cannot open itself
+        return await sync_to_async(self.append_messages)(messages)
+
+    def get_history(self):
+        """The conversation in the shape of the old ``history`` JSON field."""
+        return [message.as_history_entry() for message in self.messages.all()]
+
+
+class ChatMessage(models.Model):
+    chat = models.ForeignKey(ChatHistory, related_name='messages', on_delete=models.CASCADE)
+    seq = models.PositiveIntegerField()
+    role = models.CharField(max_length=16)
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['seq']
+        constraints = [
+            models.UniqueConstraint(fields=['chat', 'seq'], name='chat_message_unique_seq'),
+        ]
+
+    def as_history_entry(self):
+        return {'role': self.role, 'parts': [{'text': self.text}]}
+
+    def as_sync_entry(self):
+        return {'seq': self.seq, **self.as_history_entry(), 'created_at': self.created_at}
+
+
+class Product(models.Model):
+    """A marketplace listing as last scraped, kept so searches can be answered from the index."""
+    # Identifies the listing across scrapes: source plus its canonical URL, hashed
+    key = models.CharField(max_length=40, unique=True)
+    source = models.CharField(max_length=32)
+    url = models.TextField()
+    title = models.TextField()
+    image = models.TextField(blank=True, default='')
+    # Converted to CHATSHOP_RANKING['BASE_CURRENCY']; null when the price could not be parsed
+    price = models.FloatField(null=True)
+    currency = models.CharField(max_length=8, blank=True, default='')
+    rating = models.FloatField(null=True)
+    number_of_ratings = models.PositiveIntegerField(null=True)
+    # The listing exactly as the extractor returned it
+    data = models.JSONField()
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_seen'], name='chat_product_last_seen'),
+            models.Index(fields=['source', '-last_seen'], name='chat_product_source_seen'),
+        ]
+
+
+class SearchJob(models.Model):
+    """A product search queued by a chat turn and run by a ``run_search_worker`` process."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    chat = models.ForeignKey(ChatHistory, related_name='search_jobs', null=True, blank=True, on_delete=models.CASCADE)
+    query = models.TextField()
+    num_pages = models.PositiveSmallIntegerField(default=3)
+    # Marketplaces picked by the request; empty for the deployment's default set
+    sources = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Worker holding the job, and until when; an expired lease puts the job back up for grabs
+    worker = models.CharField(max_length=64, blank=True, default='')
+    lease_until = models.DateTimeField(null=True, blank=True)
+    pages_done = models.PositiveSmallIntegerField(default=0)
+    pages_total = models.PositiveSmallIntegerField(default=0)
+    # Ranked results so far; final once status is done
+    products = models.JSONField(default=list, blank=True)
+    count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Only unfinished jobs are ever scanned by the workers
+            models.Index(
+                fields=['created_at'],
+                name='chat_search_job_pending',
+                condition=models.Q(status__in=['queued', 'running']),
+            ),
+            # Only finished jobs are ever purged
+            models.Index(
+                fields=['finished_at'],
+                name='chat_search_job_finished',
+                condition=models.Q(status__in=['done', 'failed']),
+            ),
+        ]
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class SearchLease(models.Model):
+    """Held by the worker fetching a search cache key, so other workers wait for its result
+    instead of scraping the same pages (see chat.utils.singleflight)."""
+    key = models.CharField(max_length=255, primary_key=True)
+    owner = models.CharField(max_length=64)
+    lease_until = models.DateTimeField()
@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ChatHistoryCursorPagination(CursorPagination):
+    # Keyset pagination over (created_at, id): each page is an index range scan, so
+    # deep pages cost the same as the first one
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
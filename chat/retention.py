@@ -0,0 +1,165 @@
+import gzip
+import json
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import ChatHistory, ChatMessage, SearchJob
+
+DEFAULTS = {
+    # Sessions without a message for this long are archived and removed from the hot tables
+    'MAX_AGE_DAYS': 180,
+    # Write expiring sessions to cold storage first; False only deletes them
+    'ARCHIVE': True,
+    # Django storage alias (see STORAGES) for the archive, e.g. an S3 bucket; None writes
+    # to ARCHIVE_DIR on the local disk
+    'STORAGE': None,
+    'ARCHIVE_DIR': 'archive',
+    # Sessions per archive file and per delete transaction; keeps every lock short
+    'BATCH_SIZE': 500,
+    # Seconds between batches, leaving the database room for regular traffic
+    'BATCH_PAUSE': 0.05,
+    # Finished search jobs are only useful to the client polling them
+    'JOB_MAX_AGE_DAYS': 7,
+}
+
+
+def delete_in_batches(queryset, batch_size: int = 500, pause: float = 0) -> int:
+    """Delete the rows of ``queryset`` ``batch_size`` at a time, each batch in its own
+    transaction, instead of in one statement that holds its locks until the end.
+    Returns the number of rows deleted (cascades not included)."""
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            deleted += queryset.model.objects.filter(pk__in=pks).delete()[1].get(queryset.model._meta.label, 0)
+        if len(pks) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+class Retention:
+    """Moves expired chat sessions to compressed cold storage and purges them in batches.
+
+    Each batch is written as one gzipped JSON Lines file, a session with all of its
+    messages per line, under ``chat-history/<year>/<month>/``; the rows are only
+    deleted once the file is stored. A session that gets a new message in between
+    is kept (its early copy stays in the archive).
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.batch_size = self.config['BATCH_SIZE']
+
+    def storage(self):
+        if self.config['STORAGE']:
+            from django.core.files.storage import storages
+            return storages[self.config['STORAGE']]
+        from django.core.files.storage import FileSystemStorage
+        return FileSystemStorage(location=self.config['ARCHIVE_DIR'])
+
+    def cutoff(self, max_age_days: Optional[float] = None):
+        days = self.config['MAX_AGE_DAYS'] if max_age_days is None else max_age_days
+        return timezone.now() - timedelta(days=days)
+
+    def expired(self, cutoff):
+        return ChatHistory.objects.filter(updated_at__lt=cutoff)
+
+    @staticmethod
+    def serialize(chat: ChatHistory) -> Dict[str, Any]:
+        return {
+            'id': chat.pk,
+            'email': chat.email,
+            'session_key': chat.session_key,
+            'input': chat.input,
+            'history': chat.history,
+            'summary': chat.summary,
+            'created_at': chat.created_at,
+            'updated_at': chat.updated_at,
+            'messages': [
+                {'seq': message.seq, 'role': message.role, 'text': message.text, 'created_at': message.created_at}
+                for message in chat.messages.all()
+            ],
+        }
+
+    def archive(self, chats: List[ChatHistory], storage=None) -> str:
+        """Store ``chats`` as one compressed file; returns its name in the storage."""
+        storage = storage or self.storage()
+        lines = ''.join(json.dumps(self.serialize(chat), cls=JSONEncoder) + '\n' for chat in chats)
+        now = timezone.now()
+        name = f"chat-history/{now:%Y/%m}/{now:%Y%m%dT%H%M%S%f}-{chats[0].pk.hex[:8]}.jsonl.gz"
+        # mtime=0 keeps the bytes a function of the sessions alone
+        return storage.save(name, ContentFile(gzip.compress(lines.encode('utf-8'), mtime=0)))
+
+    def run(self, max_age_days: Optional[float] = None, archive: Optional[bool] = None,
+            max_batches: Optional[int] = None, dry_run: bool = False, log=print) -> Dict[str, int]:
+        """Archive and delete sessions idle for longer than ``max_age_days``, then expired jobs."""
+        archive = self.config['ARCHIVE'] if archive is None else archive
+        cutoff = self.cutoff(max_age_days)
+        expired = self.expired(cutoff)
+        stats = {'sessions': 0, 'messages': 0, 'files': 0, 'jobs': 0}
+        if dry_run:
+            stats['sessions'] = expired.count()
+            stats['messages'] = ChatMessage.objects.filter(chat__in=expired).count()
+            stats['jobs'] = self.expired_jobs().count()
+            return stats
+
+        storage = self.storage() if archive else None
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            # Oldest first, along the updated_at index; only the batch is ever in memory
+            pks = list(expired.order_by('updated_at', 'pk').values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                break
+            if archive:
+                chats = list(
+                    ChatHistory.objects.filter(pk__in=pks)
+                    .prefetch_related(Prefetch('messages', queryset=ChatMessage.objects.order_by('seq')))
+                )
+                name = self.archive(chats, storage)
+                stats['files'] += 1
+                log(f"Archived {len(chats)} sessions to {name}")
+            with transaction.atomic():
+                # Sessions written to since they were picked stay
+                _, deleted = ChatHistory.objects.filter(pk__in=pks, updated_at__lt=cutoff).delete()
+            stats['sessions'] += deleted.get(ChatHistory._meta.label, 0)
+            stats['messages'] += deleted.get(ChatMessage._meta.label, 0)
+            stats['jobs'] += deleted.get(SearchJob._meta.label, 0)
+            batches += 1
+            if len(pks) < self.batch_size:
+                break
+            if self.config['BATCH_PAUSE']:
+                time.sleep(self.config['BATCH_PAUSE'])
+
+        if max_batches is None or batches < max_batches:
+            stats['jobs'] += delete_in_batches(self.expired_jobs(), self.batch_size, self.config['BATCH_PAUSE'])
+        return stats
+
+    def expired_jobs(self):
+        cutoff = timezone.now() - timedelta(days=self.config['JOB_MAX_AGE_DAYS'])
+        return SearchJob.objects.filter(status__in=[SearchJob.DONE, SearchJob.FAILED], finished_at__lt=cutoff)
+
+
+_retention = None
+_retention_lock = threading.Lock()
+
+
+def get_retention() -> Retention:
+    """Return the process-wide retention policy, configured from CHATSHOP_RETENTION."""
+    global _retention
+    if _retention is None:
+        with _retention_lock:
+            if _retention is None:
+                _retention = Retention(getattr(settings, 'CHATSHOP_RETENTION', None))
+    return _retention
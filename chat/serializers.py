@@ -1,11 +1,26 @@
 from rest_framework import serializers
-from .models import ChatHistory
+from .models import ChatHistory, SearchJob
 
 class ChatHistorySerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
-    history = serializers.ReadOnlyField()
+    history = serializers.SerializerMethodField()
     products = serializers.ListField(read_only=True)
 
     class Meta:
         model = ChatHistory
-        fields = '__all__'
+        exclude = ['message_count', 'summary', 'summary_seq']
+
+    def get_history(self, obj):
+        return obj.get_history()
+
+
+class SearchJobSerializer(serializers.ModelSerializer):
+    session_key = serializers.CharField(source='chat.session_key', read_only=True, default=None)
+
+    class Meta:
+        model = SearchJob
+        fields = [
+            'id', 'status', 'query', 'sources', 'session_key', 'pages_done', 'pages_total', 'count',
+            'products', 'error', 'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
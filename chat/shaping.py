@@ -0,0 +1,84 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+DEFAULTS = {
+    # Product fields returned when a request doesn't choose them with ?fields=;
+    # None returns every field, e.g. ('title', 'price', 'url', 'image') for a lean default
+    'DEFAULT_FIELDS': None,
+    'MAX_FIELDS': 32,
+    # Keys the ranking adds for its own use (price_sort, rating_sort, ...); never returned
+    'INTERNAL_SUFFIXES': ('_sort',),
+    # Compress responses the client accepts gzip or br for (br needs the brotli package)
+    'COMPRESSION': True,
+    'MIN_COMPRESS_SIZE': 200,
+    # 0-11; higher levels cost far more CPU for a few percent on dynamic responses
+    'BROTLI_QUALITY': 5,
+}
+
+
+class ResponseShaper:
+    """Trims product payloads to what a client asked for.
+
+    ``?fields=title,price,url`` picks the product fields (alternates get the same
+    ones), ``?limit=`` the batch size; internal ranking keys are always dropped.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.internal_suffixes = tuple(self.config['INTERNAL_SUFFIXES'])
+        default = self.config['DEFAULT_FIELDS']
+        self.default_fields = tuple(default) if default is not None else None
+
+    def fields(self, params) -> Optional[Tuple[str, ...]]:
+        """The fields requested in ``params``; raises ValueError for an unusable list."""
+        raw = params.get('fields')
+        if raw is None:
+            return self.default_fields
+        names = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+        if not names:
+            raise ValueError("fields must name at least one field")
+        if len(names) > self.config['MAX_FIELDS']:
+            raise ValueError(f"fields may name at most {self.config['MAX_FIELDS']} fields")
+        return names
+
+    def limit(self, params, default: int, maximum: int) -> int:
+        raw = params.get('limit')
+        if raw is None:
+            return default
+        try:
+            return min(max(int(raw), 1), maximum)
+        except ValueError:
+            raise ValueError("limit must be a number")
+
+    def offset(self, params) -> int:
+        try:
+            return max(int(params.get('offset', 0)), 0)
+        except ValueError:
+            raise ValueError("offset must be a number")
+
+    def product(self, product: Dict[str, Any], fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        if fields is None:
+            return {key: value for key, value in product.items() if not key.endswith(self.internal_suffixes)}
+        shaped = {name: product[name] for name in fields if name in product and not name.endswith(self.internal_suffixes)}
+        if shaped.get('alternates'):
+            shaped['alternates'] = [self.product(alternate, fields) for alternate in shaped['alternates']]
+        return shaped
+
+    def products(self, products: Sequence[Dict[str, Any]], fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        return [self.product(product, fields) for product in products or ()]
+
+
+_shaper = None
+_shaper_lock = threading.Lock()
+
+
+def get_response_shaper() -> ResponseShaper:
+    """Return the process-wide response shaper, configured from CHATSHOP_RESPONSE."""
+    global _shaper
+    if _shaper is None:
+        with _shaper_lock:
+            if _shaper is None:
+                _shaper = ResponseShaper(getattr(settings, 'CHATSHOP_RESPONSE', None))
+    return _shaper
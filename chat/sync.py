@@ -0,0 +1,99 @@
+import asyncio
+import math
+import threading
+from typing import Any, Dict, Set, Tuple
+
+from django.conf import settings
+
+DEFAULTS = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+    # Longest ?wait= a long-poll may hold the request open for, in seconds
+    'MAX_WAIT': 30,
+    # How often a long-poll checks the database for messages written by other processes;
+    # messages written by this process wake it straight away
+    'POLL_INTERVAL': 1.0,
+}
+
+
+class SessionSignals:
+    """Wakes the long-polls of a session in this process when it gets new messages.
+
+    Waiters are asyncio events; ``notify`` may be called from any thread.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[Any, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key) -> asyncio.Event:
+        event = asyncio.Event()
+        with self._lock:
+            self._waiters.setdefault(key, set()).add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, key, event: asyncio.Event) -> None:
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                return
+            waiters.difference_update({waiter for waiter in waiters if waiter[1] is event})
+            if not waiters:
+                del self._waiters[key]
+
+    def notify(self, key) -> None:
+        with self._lock:
+            waiters = list(self._waiters.get(key, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop has already closed
+                pass
+
+
+class HistorySync:
+    """Settings for the incremental history endpoint, and the signals its long-polls wait on."""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.signals = SessionSignals()
+
+    def page_size(self, params) -> int:
+        try:
+            return min(max(int(params.get('limit', self.config['PAGE_SIZE'])), 1), self.config['MAX_PAGE_SIZE'])
+        except ValueError:
+            raise ValueError("limit must be a number")
+
+    def after(self, params) -> int:
+        try:
+            return max(int(params.get('after', 0)), 0)
+        except ValueError:
+            raise ValueError("after must be a message sequence number")
+
+    def wait(self, params) -> float:
+        try:
+            wait = float(params.get('wait', 0))
+        except ValueError:
+            raise ValueError("wait must be a number of seconds")
+        # nan would pass through the clamp below and make the long-poll spin
+        if not math.isfinite(wait):
+            raise ValueError("wait must be a number of seconds")
+        return min(max(wait, 0.0), self.config['MAX_WAIT'])
+
+    def notify(self, chat_id) -> None:
+        self.signals.notify(chat_id)
+
+
+_sync = None
+_sync_lock = threading.Lock()
+
+
+def get_history_sync() -> HistorySync:
+    """Return the process-wide history sync, configured from CHATSHOP_SYNC."""
+    global _sync
+    if _sync is None:
+        with _sync_lock:
+            if _sync is None:
+                _sync = HistorySync(getattr(settings, 'CHATSHOP_SYNC', None))
+    return _sync
@@ -1,3 +1,480 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from selectorlib import Extractor
+
+from .benchmarks import SOURCES, load_fixture
+from .fastpath import FastPath
+from .models import ChatHistory, ChatMessage, SearchJob, SearchLease
+from .retention import Retention, delete_in_batches
+from .sync import get_history_sync
+from .utils.cache import SearchCache
+from .utils.extraction import CompiledExtractor
+from .utils.product_index import ProductIndex
+from .utils.products import MultiPlatformSearcher
+from .utils.singleflight import MISSING, SingleFlight
+from .utils.source_guard import DEFAULTS as GUARD_DEFAULTS, CircuitOpen, Deadline, DeadlineExceeded, SourceGuard
+from .utils.throttle import HostPacer
+
+
+class ChatSyncViewTests(TestCase):
+    def setUp(self):
+        self.chat = ChatHistory.objects.create(email='user@example.com', session_key='s1', input='hi', history=[])
+        self.chat.append_messages([('user', 'hello'), ('model', 'hi there'), ('user', 'a phone')])
+        self.url = reverse('chat-sync', args=['user@example.com', 's1'])
+
+    def test_messages_after_seq(self):
+        response = self.client.get(self.url, {'after': 1})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([m['seq'] for m in body['messages']], [2, 3])
+        self.assertEqual(body['last_seq'], 3)
+        self.assertIsNone(body['next'])
+
+    def test_next_link_pages_through(self):
+        body = self.client.get(self.url, {'limit': 2}).json()
+        self.assertEqual([m['seq'] for m in body['messages']], [1, 2])
+        self.assertIn('after=2', body['next'])
+
+    def test_not_modified_for_matching_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, headers={'if-none-match': etag}).status_code, 304)
+        self.assertEqual(self.client.get(self.url, headers={'if-none-match': 'W/' + etag}).status_code, 304)
+        self.chat.append_messages([('model', 'here are some')])
+        self.assertEqual(self.client.get(self.url, headers={'if-none-match': etag}).status_code, 200)
+
+    def test_unknown_session(self):
+        url = reverse('chat-sync', args=['user@example.com', 'missing'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_wait_must_be_finite(self):
+        for wait in ('nan', 'inf', '-inf', 'soon'):
+            with self.subTest(wait=wait):
+                response = self.client.get(self.url, {'after': 3, 'wait': wait})
+                self.assertEqual(response.status_code, 400)
+
+    async def test_wait_times_out_unchanged(self):
+        response = await self.async_client.get(self.url, {'after': 3, 'wait': 0.2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['messages'], [])
+
+    async def test_session_deleted_during_wait(self):
+        async def delete():
+            await asyncio.sleep(0.1)
+            await ChatHistory.objects.filter(pk=self.chat.pk).adelete()
+
+        with mock.patch.dict(get_history_sync().config, {'POLL_INTERVAL': 0.05}):
+            task = asyncio.create_task(delete())
+            response = await self.async_client.get(self.url, {'after': 3, 'wait': 5})
+            await task
+        self.assertEqual(response.status_code, 404)
+
+
+class FastPathRuleTests(TestCase):
+    def setUp(self):
+        self.fast_path = FastPath({'RULES': True, 'CACHE_ALIAS': None})
+
+    def test_product_requests(self):
+        cases = {
+            "I want to buy an iphone 13 128gb": "iphone 13 128gb",
+            "looking for a samsung galaxy a54 phone": "samsung galaxy a54 phone",
+            "show me nike air max running shoes": "nike air max running shoes",
+            "I would like a dell xps 13 laptop please": "dell xps 13 laptop",
+            "hi, i need wireless noise cancelling headphones": "wireless noise cancelling headphones",
+        }
+        for text, product in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(self.fast_path.extract(text), product)
+
+    def test_other_requests_go_to_the_model(self):
+        for text in [
+            "I need to talk to a human agent",
+            "I want to know your return policy",
+            "I would like to cancel my order please",
+            "show me how to cook jollof rice",
+            "find my previous search results",
+            "I am looking for a job in lagos",
+            "I want something cheaper than that one",
+            "do you have iphone 13 pro max?",
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNone(self.fast_path.extract(text))
+
+    def test_rules_are_opt_in(self):
+        self.assertIsNone(FastPath().rule_reply("I want to buy an iphone 13 128gb", False))
+        reply = self.fast_path.rule_reply("I want to buy an iphone 13 128gb", False)
+        self.assertTrue(reply.text.startswith('{"product": "iphone 13 128gb"}'))
+
+
+    def test_reply_cache_key_covers_the_whole_context(self):
+        def entry(role, text):
+            return {'role': role, 'parts': [{'text': text}]}
+
+        tail = [entry('user', 'a phone'), entry('model', 'What budget?')]
+        turn = entry('user', 'under 200k')
+        mine = [entry('user', 'Summary of our conversation so far: wants an iphone')] + tail + [turn]
+        theirs = [entry('user', 'Summary of our conversation so far: wants a samsung')] + tail + [turn]
+        self.assertNotEqual(self.fast_path.key('under 200k', mine, False), self.fast_path.key('under 200k', theirs, False))
+        self.assertNotEqual(self.fast_path.key('under 200k', tail + [turn], False), self.fast_path.key('under 200k', mine, False))
+        # Opening turns carry no context of their own, so every new session shares them
+        self.assertEqual(self.fast_path.key('Hello!', [entry('user', 'Hello!')], True), self.fast_path.key('hello', [entry('user', 'hello')], True))
+
+
+class ChatMessageTests(TestCase):
+    def setUp(self):
+        self.chat = ChatHistory.objects.create(email='user@example.com', session_key='s1', input='hi', history=[])
+
+    def test_seqs_are_consecutive_across_turns(self):
+        self.chat.append_messages([('user', 'hello'), ('model', 'hi')])
+        self.chat.append_messages([('user', 'a phone')])
+        self.assertEqual(list(self.chat.messages.values_list('seq', flat=True)), [1, 2, 3])
+        self.assertEqual(self.chat.message_count, 3)
+        self.assertEqual(self.chat.get_history()[-1], {'role': 'user', 'parts': [{'text': 'a phone'}]})
+
+    def test_stale_instances_never_reuse_a_seq(self):
+        # Two requests holding their own copy of the session, as concurrent turns do
+        other = ChatHistory.objects.get(pk=self.chat.pk)
+        self.chat.append_messages([('user', 'one'), ('model', 'two')])
+        other.append_messages([('user', 'three')])
+        self.assertEqual(list(self.chat.messages.values_list('seq', 'text')), [(1, 'one'), (2, 'two'), (3, 'three')])
+        self.assertEqual(ChatHistory.objects.get(pk=self.chat.pk).message_count, 3)
+
+    def test_empty_append(self):
+        self.assertEqual(self.chat.append_messages([]), [])
+        self.assertEqual(ChatHistory.objects.get(pk=self.chat.pk).message_count, 0)
+
+
+class ChatListingPaginationTests(TestCase):
+    def test_cursor_pages_cover_every_session_once(self):
+        for i in range(5):
+            ChatHistory.objects.create(email='user@example.com', session_key=f's{i}', input='hi', history=[])
+        url = reverse('chat-get-by-email', args=['user@example.com']) + '?page_size=2'
+        seen = []
+        while url:
+            body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 2)
+            seen += [row['session_key'] for row in body['results']]
+            url = body['next']
+        self.assertEqual(sorted(seen), [f's{i}' for i in range(5)])
+
+
+class CompiledExtractorTests(TestCase):
+    def test_matches_selectorlib_on_fixtures(self):
+        for source, (_, yaml_string, _) in SOURCES.items():
+            with self.subTest(source=source):
+                html = load_fixture(source)
+                expected = Extractor.from_yaml_string(yaml_string).extract(html)
+                self.assertEqual(CompiledExtractor.from_yaml_string(yaml_string).extract(html), expected)
+                self.assertTrue(expected['products'])
+
+
+class FakeExtractor:
+    """Three distinct products per page, up to ``pages`` pages."""
+
+    def __init__(self, source, pages=3):
+        self.source = self.host = source
+        self.pages = pages
+        self.calls = []
+
+    def search(self, query, page=1, headers=None, timeout=None, deadline=None):
+        self.calls.append(page)
+        products = []
+        if page <= self.pages:
+            for i in range(3):
+                token = hashlib.sha1(f'{self.source}{page}{i}'.encode()).hexdigest()[:12]
+                products.append({
+                    'title': f'{token} {query}', 'url': f'https://{self.source}/{token}', 'image': f'{token}.jpg',
+                    'price': f'${10 + page + i}.00', 'rating': 4.0, 'source': self.source,
+                })
+        return {'query': query, 'page': page, 'products': products}
+
+
+def fake_searcher(extractors):
+    """A searcher over ``extractors`` with no shared cache, index or guard state."""
+    names = tuple(extractor.source for extractor in extractors)
+    registry = mock.Mock()
+    registry.select.side_effect = lambda selected: tuple(selected or names)
+    registry.extractors.side_effect = lambda selected: [e for e in extractors if e.source in selected]
+    with mock.patch('chat.utils.products.get_source_registry', return_value=registry):
+        searcher = MultiPlatformSearcher(host_interval=0)
+    searcher.index = ProductIndex({'ENABLED': False})
+    searcher.cache = SearchCache({'ALIAS': None})
+    searcher.cache.flight = SingleFlight({'SHARED': False})
+    searcher.guard = SourceGuard()
+    return searcher
+
+
+class SearchCursorTests(TestCase):
+    def setUp(self):
+        self.extractors = [FakeExtractor('A'), FakeExtractor('B')]
+        self.searcher = fake_searcher(self.extractors)
+
+    def test_pages_are_fetched_lazily(self):
+        products, sources, cursor = self.searcher.search_page('phone', limit=3)
+        self.assertEqual(len(products), 3)
+        self.assertEqual([e.calls for e in self.extractors], [[1], [1]])
+        self.assertEqual(sources['included'], ['A', 'B'])
+        self.assertIsNotNone(cursor)
+
+    def test_cursor_continues_without_repeats(self):
+        seen = []
+        products, _, cursor = self.searcher.search_page('phone', limit=4)
+        seen += products
+        while cursor:
+            products, _, cursor = self.searcher.search_page(cursor=cursor, limit=4)
+            seen += products
+        self.assertEqual(len(seen), 18)
+        self.assertEqual(len({product['url'] for product in seen}), 18)
+
+    def test_tampered_cursor(self):
+        _, _, cursor = self.searcher.search_page('phone', limit=3)
+        with self.assertRaises(ValueError):
+            self.searcher.search_page(cursor=cursor[:-2] + 'xx')
+
+
+class SourceGuardTests(TestCase):
+    def setUp(self):
+        self.extractor = FakeExtractor('A')
+        self.searcher = fake_searcher([self.extractor])
+        self.breaker = self.searcher.guard.breaker('A')
+
+    def test_deadline_is_not_a_source_failure(self):
+        # As when the search budget runs out during a hedged fetch
+        self.extractor.search = mock.Mock(side_effect=DeadlineExceeded())
+        self.extractor.asearch = mock.AsyncMock(side_effect=DeadlineExceeded())
+        for page in range(1, 6):
+            with self.assertRaises(DeadlineExceeded):
+                self.searcher._fetch_page(self.extractor, 'phone', page, Deadline(10))
+            with self.assertRaises(DeadlineExceeded):
+                asyncio.run(self.searcher._afetch_page(self.extractor, 'phone', page, Deadline(10)))
+        self.assertEqual((self.breaker.failures, self.breaker.state), (0, 'closed'))
+
+    def test_fetch_errors_open_the_circuit(self):
+        self.extractor.search = mock.Mock(side_effect=ConnectionError('refused'))
+        for page in range(1, 4):
+            with self.assertRaises(ConnectionError):
+                self.searcher._fetch_page(self.extractor, 'phone', page)
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_open_circuit_takes_no_host_slot(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.searcher.pacer = mock.Mock()
+        with self.assertRaises(CircuitOpen):
+            self.searcher._fetch_page(self.extractor, 'phone', 1)
+        with self.assertRaises(CircuitOpen):
+            asyncio.run(self.searcher._afetch_page(self.extractor, 'phone', 1))
+        self.searcher.pacer.reserve.assert_not_called()
+        self.assertEqual(self.extractor.calls, [])
+
+
+class HostPacerTests(TestCase):
+    def test_concurrent_searches_finish_inside_the_deadline(self):
+        # The default interval and deadline, scaled down to keep the test fast
+        scale = 0.025
+        pacer = HostPacer(min_interval=GUARD_DEFAULTS['HOST_INTERVAL'] * scale)
+        budget = GUARD_DEFAULTS['DEADLINE'] * scale
+        reports = []
+
+        def search(i):
+            searcher = fake_searcher([FakeExtractor('A')])
+            searcher.pacer = pacer
+            reports.append(searcher.search(f'phone {i}', num_pages=3, budget=budget)[1])
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.monotonic() - start, budget)
+        self.assertEqual([report['skipped'] or report['partial'] for report in reports], [{}] * 8)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.retention = Retention({'ARCHIVE_DIR': self.archive_dir, 'BATCH_SIZE': 2, 'BATCH_PAUSE': 0})
+        old = timezone.now() - timedelta(days=400)
+        for i in range(7):
+            chat = ChatHistory.objects.create(email='user@example.com', session_key=f's{i}', input='hi', history=[])
+            chat.append_messages([('user', f'hello {i}'), ('model', 'hi')])
+        ChatHistory.objects.filter(session_key__in=['s0', 's1', 's2', 's3', 's4']).update(updated_at=old)
+        SearchJob.objects.create(query='phone', status=SearchJob.DONE, finished_at=old)
+
+    def archived(self):
+        sessions = []
+        for path in sorted(Path(self.archive_dir).rglob('*.jsonl.gz')):
+            with gzip.open(path, 'rt') as f:
+                sessions += [json.loads(line) for line in f]
+        return sessions
+
+    def test_dry_run_only_counts(self):
+        stats = self.retention.run(dry_run=True)
+        self.assertEqual(stats, {'sessions': 5, 'messages': 10, 'files': 0, 'jobs': 1})
+        self.assertEqual(ChatHistory.objects.count(), 7)
+
+    def test_archives_then_deletes_in_batches(self):
+        stats = self.retention.run(log=lambda message: None)
+        self.assertEqual(stats, {'sessions': 5, 'messages': 10, 'files': 3, 'jobs': 1})
+        self.assertEqual(sorted(ChatHistory.objects.values_list('session_key', flat=True)), ['s5', 's6'])
+        self.assertEqual(ChatMessage.objects.count(), 4)
+        self.assertFalse(SearchJob.objects.exists())
+        archived = self.archived()
+        self.assertEqual(sorted(session['session_key'] for session in archived), ['s0', 's1', 's2', 's3', 's4'])
+        self.assertEqual([m['text'] for m in archived[0]['messages']], [f"hello {archived[0]['session_key'][1]}", 'hi'])
+
+    def test_max_batches(self):
+        stats = self.retention.run(max_batches=1, archive=False)
+        self.assertEqual((stats['sessions'], stats['files']), (2, 0))
+        self.assertEqual(ChatHistory.objects.count(), 5)
+
+    def test_delete_in_batches(self):
+        self.assertEqual(delete_in_batches(ChatHistory.objects.filter(email='user@example.com'), batch_size=3), 7)
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.flight = SingleFlight({'SHARED': False})
+
+    def test_concurrent_callers_share_one_fetch(self):
+        calls, results = [], []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        threads = [threading.Thread(target=lambda: results.append(self.flight.do('k', fetch, lambda: MISSING))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+    def test_errors_are_shared(self):
+        calls, errors = [], []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            raise RuntimeError('down')
+
+        def call():
+            try:
+                self.flight.do('k', fetch, lambda: MISSING)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), len(errors)), (1, 4))
+
+    def test_async_callers_share_one_fetch(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 'value'
+
+        async def lookup():
+            return MISSING
+
+        async def main():
+            return await asyncio.gather(*[self.flight.ado('k', fetch, lookup) for _ in range(6)])
+
+        self.assertEqual(asyncio.run(main()), ['value'] * 6)
+        self.assertEqual(len(calls), 1)
+
+    def test_cancelling_one_async_caller_keeps_the_fetch(self):
+        async def fetch():
+            await asyncio.sleep(0.1)
+            return 'value'
+
+        async def lookup():
+            return MISSING
+
+        async def main():
+            first = asyncio.ensure_future(self.flight.ado('k', fetch, lookup))
+            second = asyncio.ensure_future(self.flight.ado('k', fetch, lookup))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(main()), 'value')
+
+
+class SearchLeaseTests(TransactionTestCase):
+    # Leases are only taken outside a transaction, so these run without TestCase's
+    def setUp(self):
+        self.flight = SingleFlight({'LEASE': 0.3, 'POLL_INTERVAL': 0.05})
+
+    def test_acquire_and_release(self):
+        self.assertTrue(self.flight.acquire('k', 'one'))
+        self.assertFalse(self.flight.acquire('k', 'two'))
+        self.flight.release('k', 'one')
+        self.assertTrue(self.flight.acquire('k', 'two'))
+
+    def test_expired_lease_is_taken_over(self):
+        self.assertTrue(self.flight.acquire('k', 'one'))
+        time.sleep(0.35)
+        self.assertTrue(self.flight.acquire('k', 'two'))
+        self.assertEqual(SearchLease.objects.get(key='k').owner, 'two')
+
+    def test_heartbeat_keeps_a_long_fetch_leased(self):
+        other = SingleFlight({'LEASE': 0.3})
+
+        def fetch():
+            time.sleep(0.7)
+            self.assertFalse(other.acquire('k', 'other'))
+            return 'value'
+
+        self.assertEqual(self.flight.do('k', fetch, lambda: MISSING), 'value')
+        self.assertFalse(SearchLease.objects.exists())
+
+    def test_waits_for_result_published_by_lease_holder(self):
+        published = {}
+        self.assertTrue(self.flight.acquire('k', 'other'))
+
+        def publish():
+            time.sleep(0.2)
+            published['k'] = 'theirs'
+            self.flight.release('k', 'other')
+
+        threading.Thread(target=publish).start()
+        fetch = mock.Mock(return_value='mine')
+        self.assertEqual(self.flight.do('k', fetch, lambda: published.get('k', MISSING)), 'theirs')
+        fetch.assert_not_called()
+
+    def test_fetches_when_holder_releases_without_result(self):
+        self.assertTrue(self.flight.acquire('k', 'other'))
+        threading.Timer(0.1, self.flight.release, args=('k', 'other')).start()
+        self.assertEqual(self.flight.do('k', lambda: 'mine', lambda: MISSING), 'mine')
+
+    def test_one_lease_per_search(self):
+        searcher = fake_searcher([FakeExtractor('A'), FakeExtractor('B')])
+        searcher.cache.flight = self.flight
+        with mock.patch.object(self.flight, 'acquire', wraps=self.flight.acquire) as acquire, \
+                mock.patch('chat.utils.products._close_thread_connections') as close:
+            products, sources = searcher.search('phone', num_pages=2)
+        self.assertEqual(len(products), 12)
+        self.assertEqual([call.args[0].split(':')[1] for call in acquire.call_args_list], ['results'])
+        # Every pool task closes the connections its thread opened
+        self.assertEqual(close.call_count, 4)
@@ -1,9 +1,13 @@
 from django.urls import path, re_path
-from .views import ChatView, ChatGetView
+from .views import ChatView, AsyncChatView, ChatGetView, ChatSyncView, ProductSearchMoreView, SearchJobView
 
 urlpatterns = [
     path('product-chat', ChatView.as_view(), name="product-chat"),
+    path('product-chat/async', AsyncChatView.as_view(), name="product-chat-async"),
     path('chats/', ChatGetView.as_view(), name='chat-get-all'),
     path('chats/<str:email>/', ChatGetView.as_view(), name='chat-get-by-email'),
     path('chats/<email>/<str:session_key>/', ChatGetView.as_view(), name='chat-get-by-email-session'),
+    path('chats/<email>/<str:session_key>/messages/', ChatSyncView.as_view(), name='chat-sync'),
+    path('products/more', ProductSearchMoreView.as_view(), name='product-search-more'),
+    path('search-jobs/<uuid:pk>', SearchJobView.as_view(), name='search-job'),
 ]
\ No newline at end of file
@@ -1,9 +1,11 @@
-from selectorlib import Extractor
-import requests
+from .extractor import SearchExtractor
+import logging
 import re
 from typing import Dict, List, Any
 import time
 
+logger = logging.getLogger(__name__)
+
 YAML_STRING = """
 products:
     css: 'div.search-item-card-wrapper-gallery'
@@ -59,24 +61,19 @@ products:
             type: Text
 """
 
-class AliExpressSearchExtractor:
-    def __init__(self):
-        self._extractor = Extractor.from_yaml_string(YAML_STRING)
-
-    def _scrape(self, url: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
-        if not headers:
-            headers = {
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
-                "Connection": "keep-alive",
-            }
+HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
+    "Connection": "keep-alive",
+}
 
-        response = requests.get(url, headers=headers)
-
-        if response.status_code > 500:
-            raise Exception(f"Page {url} was blocked. Please try using better proxies.")
-        
-        return self._extractor.extract(response.text)
+class AliExpressSearchExtractor(SearchExtractor):
+    source = 'Aliexpress'
+    host = 'www.aliexpress.com'
+    search_url = "https://www.aliexpress.com/wholesale?SearchText={query}&page={page}"
+    yaml_string = YAML_STRING
+    default_headers = HEADERS
+    blocked_message = "Page {url} was blocked. Please try using better proxies."
 
     def _process_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
         processed = {}
@@ -99,7 +96,7 @@ class AliExpressSearchExtractor:
                         break
                 processed['rating'] = round(float(full_stars + partial_star), 1)
             except Exception as e:
-                print(f"Error processing star rating: {e}")
+                logger.warning("Error processing star rating: %s", e)
                 processed['rating'] = None
         else:
             processed['rating'] = None
@@ -116,31 +113,3 @@ class AliExpressSearchExtractor:
 
         
         return processed
-
-    def search(self, query: str, page: int = 1, headers: Dict[str, str] = None) -> Dict[str, List[Dict[str, Any]]]:
-        url = f"https://www.aliexpress.com/wholesale?SearchText={query}&page={page}"
-        raw_data = self._scrape(url, headers)
-        
-        processed_products = [self._process_product(product) for product in raw_data.get('products', [])]
-        
-        return {
-            "query": query,
-            "page": page,
-            "products": processed_products
-        }
-
-# # Usage example:
-# if __name__ == "__main__":
-#     extractor = AliExpressSearchExtractor()
-#     results = extractor.search("laptop", page=1)
-    
-#     print(f"Found {len(results['products'])} products:")
-#     for product in results['products']:
-#         print(f"Title: {product['title']}")
-#         print(f"URL: {product['url']}")
-#         print(f"Price: {product['price']}")
-#         print(f"Rating: {product['rating']}")
-#         print(f"Number of ratings: {product['number_of_ratings']}")
-#         print(f"Image URL: {product['image']}")
-#         print(f"Shipping: {product['shipping']}")
-#         print("-" * 50)
\ No newline at end of file
@@ -1,5 +1,5 @@
-from selectorlib import Extractor
-import requests
+from .extractor import SearchExtractor
+from . import http_client
 from typing import Dict, List, Any
 
 YAML_STRING = """
@@ -54,32 +54,27 @@ products:
             type: Text
 """
 
-class AmazonSearchExtractor:
-    def __init__(self):
-        self._extractor = Extractor.from_yaml_string(YAML_STRING)
+HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Sec-Fetch-Site": "none",
+    "Host": "www.amazon.com",
+    "Accept-Language": "en-IN,en-GB;q=0.9,en;q=0.8",
+    "Sec-Fetch-Mode": "navigate",
+    "Accept-Encoding": http_client.ACCEPT_ENCODING,
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Priority": "u=0, i",
+}
 
-    def _scrape(self, url: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
-        if not headers:
-            headers = {
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "Sec-Fetch-Site": "none",
-                "Host": "www.amazon.com",
-                "Accept-Language": "en-IN,en-GB;q=0.9,en;q=0.8",
-                "Sec-Fetch-Mode": "navigate",
-                "Accept-Encoding": "gzip, deflate, br",
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-                "Sec-Fetch-Dest": "document",
-                "Priority": "u=0, i",
-            }
-
-        response = requests.get(url, headers=headers)
-
-        if response.status_code > 500:
-            raise Exception(f"Page {url} was blocked by Amazon. Please try using better proxies.")
-        
-        return self._extractor.extract(response.text)
+class AmazonSearchExtractor(SearchExtractor):
+    source = 'Amazon'
+    host = 'www.amazon.com'
+    search_url = "https://www.amazon.com/s?k={query}&page={page}&currency=NGN"
+    yaml_string = YAML_STRING
+    default_headers = HEADERS
+    blocked_message = "Page {url} was blocked by Amazon. Please try using better proxies."
 
     def _process_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
         processed = {}
@@ -96,34 +91,7 @@ class AmazonSearchExtractor:
         
         processed['price'] = product.get('price', '').strip().replace(" ", "")
         processed['original_price'] = product.get('original_price', '').strip()
-        #processed['discount'] = product.get('discount', '').strip()
         processed['is_sponsored'] = product.get('is_sponsored') == 'Sponsored'
         processed['source'] = 'Amazon'
         
         return processed
-
-    def search(self, query: str, page: int = 1, headers: Dict[str, str] = None) -> Dict[str, List[Dict[str, Any]]]:
-        url = f"https://www.amazon.com/s?k={query}&page={page}&currency=NGN"
-        raw_data = self._scrape(url, headers)
-        
-        processed_products = [self._process_product(product) for product in raw_data.get('products', [])]
-        
-        return {
-            "query": query,
-            "page": page,
-            "products": processed_products
-        }
-
-# # Usage example:
-# if __name__ == "__main__":
-#     extractor = AmazonSearchExtractor()
-#     results = extractor.search("laptop", page=1)
-    
-#     print(f"Found {len(results['products'])} products:")
-#     for product in results['products']:
-#         print(f"Title: {product['title']}")
-#         print(f"Price: {product['price']}")
-#         print(f"Rating: {product['rating']}")
-#         print(f"Number of ratings: {product['number_of_ratings']}")
-#         print(f"Image URL: {product['image']}")
-#         print("-" * 50)
\ No newline at end of file
@@ -1,5 +1,4 @@
-from selectorlib import Extractor
-import requests
+from .extractor import SearchExtractor
 from typing import Dict, List, Any
 
 YAML_STRING = """
@@ -48,24 +47,19 @@ products:
             type: Text
 """
 
-class JumiaSearchExtractor:
-    def __init__(self):
-        self._extractor = Extractor.from_yaml_string(YAML_STRING)
+HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
+    "Connection": "keep-alive",
+}
 
-    def _scrape(self, url: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
-        if not headers:
-            headers = {
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
-                "Connection": "keep-alive",
-            }
-
-        response = requests.get(url, headers=headers)
-
-        if response.status_code > 500:
-            raise Exception(f"Page {url} was blocked by Jumia. Please try using better proxies.")
-        
-        return self._extractor.extract(response.text)
+class JumiaSearchExtractor(SearchExtractor):
+    source = 'Jumia'
+    host = 'www.jumia.com.ng'
+    search_url = "https://www.jumia.com.ng/catalog/?q={query}&page={page}"
+    yaml_string = YAML_STRING
+    default_headers = HEADERS
+    blocked_message = "Page {url} was blocked by Jumia. Please try using better proxies."
 
     def _process_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
         processed = {}
@@ -81,29 +75,3 @@ class JumiaSearchExtractor:
         processed['source'] = 'Jumia'
         
         return processed
-
-    def search(self, query: str, page: int = 1, headers: Dict[str, str] = None) -> Dict[str, List[Dict[str, Any]]]:
-        url = f"https://www.jumia.com.ng/catalog/?q={query}&page={page}"
-        raw_data = self._scrape(url, headers)
-        
-        processed_products = [self._process_product(product) for product in raw_data.get('products', [])]
-        
-        return {
-            "query": query,
-            "page": page,
-            "products": processed_products
-        }
-
-# # Usage example:
-# if __name__ == "__main__":
-#     extractor = JumiaSearchExtractor()
-#     results = extractor.search("laptop", page=1)
-    
-#     print(f"Found {len(results['products'])} products:")
-#     for product in results['products']:
-#         print(f"Title: {product['title']}")
-#         print(f"Price: {product['price']}")
-#         print(f"Rating: {product['rating']}")
-#         #print(f"Number of ratings: {product['number_of_ratings']}")
-#         print(f"Image URL: {product['image']}")
-#         print("-" * 50)
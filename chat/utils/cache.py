@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from cachetools import TLRUCache
+
+from .singleflight import MISSING, get_single_flight
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Django cache alias used as the shared second tier
+    'ALIAS': 'search',
+    # Number of entries kept in each worker's in-process LRU
+    'MAXSIZE': 1024,
+    # Seconds a result is served as fresh, per source (falls back to DEFAULT_TTL)
+    'DEFAULT_TTL': 15 * 60,
+    'TTL': {},
+    # Extra seconds a result may be served stale while it is refreshed in the background
+    'STALE_TTL': 60 * 60,
+}
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    fresh_until: float
+    stale_until: float
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r'\s+', ' ', query or '').strip().lower()
+
+
+def make_key(kind: str, query: str, source: str = '*', page: Any = '*', variant: str = '') -> str:
+    # Hash the query so keys stay short and free of characters some cache backends reject
+    digest = hashlib.sha1(f"{normalize_query(query)}|{variant}".encode('utf-8')).hexdigest()
+    return f"chatshop:{kind}:{source}:{page}:{digest}"
+
+
+def _close_thread_connections() -> None:
+    # Background threads open their own DB connections for the shared tier; Django only
+    # cleans up connections for request threads, so release ours explicitly.
+    try:
+        from django.db import connections
+        connections.close_all()
+    except Exception:
+        pass
+
+
+class SearchCache:
+    """In-process LRU in front of a shared Django cache, with stale-while-revalidate.
+
+    Concurrent misses for a key, in this process or in other workers, share one
+    fetch (see SingleFlight), as do the background refreshes of a stale entry.
+    Keys fetched with ``shared=False`` are only coalesced within the process.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self._local = TLRUCache(
+            maxsize=self.config['MAXSIZE'],
+            ttu=lambda key, entry, now: entry.stale_until,
+            timer=time.time,
+        )
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        # Strong references to background refresh tasks so they are not garbage collected
+        self._tasks = set()
+        self.flight = get_single_flight()
+
+    def ttl_for(self, source: str) -> float:
+        return self.config['TTL'].get(source, self.config['DEFAULT_TTL'])
+
+    def _shared(self):
+        try:
+            from django.conf import settings
+            from django.core.cache import caches
+            if not settings.configured:
+                return None
+            return caches[self.config['ALIAS']]
+        except Exception:
+            return None
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._local.get(key)
+        if entry is not None:
+            return entry
+
+        shared = self._shared()
+        if shared is None:
+            return None
+        try:
+            entry = shared.get(key)
+        except Exception as e:
+            logger.warning("Search cache read failed for %s: %s", key, e)
+            return None
+        if entry is None:
+            return None
+
+        entry = CacheEntry(*entry)
+        if entry.stale_until > time.time():
+            with self._lock:
+                self._local[key] = entry
+            return entry
+        return None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        entry = CacheEntry(value, now + ttl, now + ttl + self.config['STALE_TTL'])
+        with self._lock:
+            self._local[key] = entry
+
+        shared = self._shared()
+        if shared is None:
+            return
+        try:
+            shared.set(key, tuple(entry), timeout=int(entry.stale_until - now) + 1)
+        except Exception as e:
+            logger.warning("Search cache write failed for %s: %s", key, e)
+
+    def _lookup(self, key: str) -> Any:
+        entry = self._get(key)
+        return MISSING if entry is None else entry.value
+
+    def _refresh(self, key: str, fetch: Callable[[], Any], ttl: float, shared: bool = True) -> None:
+        try:
+            # Skipped when another worker is already refreshing it
+            self.flight.lead(key, lambda: self.set(key, fetch(), ttl), shared)
+        except Exception as e:
+            logger.warning("Background refresh failed for %s: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+            _close_thread_connections()
+
+    def _refresh_in_background(self, key: str, fetch: Callable[[], Any], ttl: float, shared: bool = True) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key, fetch, ttl, shared), daemon=True).start()
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any], ttl: float, shared: bool = True) -> Any:
+        entry = self._get(key)
+        if entry is not None:
+            if entry.fresh_until <= time.time():
+                self._refresh_in_background(key, fetch, ttl, shared)
+            return entry.value
+
+        def fetch_and_store():
+            value = fetch()
+            self.set(key, value, ttl)
+            return value
+
+        return self.flight.do(key, fetch_and_store, lambda: self._lookup(key), shared)
+
+    async def _aget(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._local.get(key)
+        if entry is not None:
+            return entry
+
+        shared = self._shared()
+        if shared is None:
+            return None
+        try:
+            entry = await shared.aget(key)
+        except Exception as e:
+            logger.warning("Search cache read failed for %s: %s", key, e)
+            return None
+        if entry is None:
+            return None
+
+        entry = CacheEntry(*entry)
+        if entry.stale_until > time.time():
+            with self._lock:
+                self._local[key] = entry
+            return entry
+        return None
+
+    async def aset(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        entry = CacheEntry(value, now + ttl, now + ttl + self.config['STALE_TTL'])
+        with self._lock:
+            self._local[key] = entry
+
+        shared = self._shared()
+        if shared is None:
+            return
+        try:
+            await shared.aset(key, tuple(entry), timeout=int(entry.stale_until - now) + 1)
+        except Exception as e:
+            logger.warning("Search cache write failed for %s: %s", key, e)
+
+    async def _alookup(self, key: str) -> Any:
+        entry = await self._aget(key)
+        return MISSING if entry is None else entry.value
+
+    async def _arefresh(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: float, shared: bool = True) -> None:
+        async def refresh():
+            await self.aset(key, await fetch(), ttl)
+
+        try:
+            await self.flight.alead(key, refresh, shared)
+        except Exception as e:
+            logger.warning("Background refresh failed for %s: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def aget_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: float, shared: bool = True) -> Any:
+        """Async counterpart of get_or_fetch; ``fetch`` is a coroutine function."""
+        entry = await self._aget(key)
+        if entry is not None:
+            if entry.fresh_until <= time.time():
+                with self._lock:
+                    refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                if refresh:
+                    task = asyncio.create_task(self._arefresh(key, fetch, ttl, shared))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            return entry.value
+
+        async def fetch_and_store():
+            value = await fetch()
+            await self.aset(key, value, ttl)
+            return value
+
+        return await self.flight.ado(key, fetch_and_store, lambda: self._alookup(key), shared)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    """Return the process-wide search cache, configured from CHATSHOP_SEARCH_CACHE."""
+    global _search_cache
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_SEARCH_CACHE', None)
+                except ImportError:
+                    pass
+                _search_cache = SearchCache(config)
+    return _search_cache
@@ -0,0 +1,234 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULTS = {
+    'ENABLED': True,
+    # MinHash signature length; split into BANDS bands for locality-sensitive hashing.
+    # Two titles become candidates when any band matches, which is likely from a
+    # Jaccard similarity of about (1 / BANDS) ** (1 / (NUM_PERM / BANDS)) upwards
+    'NUM_PERM': 64,
+    'BANDS': 32,
+    # Estimated Jaccard similarity of the title shingles needed to merge two candidates.
+    # Titles must also mention the same numbers, so "8GB" and "16GB" variants of
+    # an otherwise identical listing stay apart
+    'THRESHOLD': 0.5,
+    # Bytes per title shingle (at most 8)
+    'SHINGLE_SIZE': 4,
+    # An image shared by more listings than this is taken for a placeholder and ignored
+    'IMAGE_MAX_SHARE': 8,
+    # Fields kept on the alternates attached to a cluster's best offer
+    'ALTERNATE_FIELDS': ('title', 'price', 'rating', 'url', 'image', 'source'),
+}
+
+# Bound on shingles hashed in one vectorized step (NUM_PERM x this many uint32s)
+_CHUNK = 8192
+# Odd 64-bit multiplier (golden ratio) for hashing packed shingles
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+_word = re.compile(r'[a-z0-9]+')
+_number = re.compile(r'\d+(?:\.\d+)?')
+# Size and crop modifiers the marketplace CDNs add to the same picture, e.g.
+# "._AC_UY218_.jpg" on Amazon, ".jpg_480x480.jpg" on AliExpress and
+# "/fit-in/300x300/" on Jumia
+_image_variant = re.compile(r'\._[A-Z0-9_,]+_(?=\.\w+$)|_\d+x\d+\w*\.\w+$|/(?:unsafe/)?(?:fit-in/)?\d+x\d+(?:/filters:[^/]*)?(?=/)')
+
+
+def normalize_title(title: str) -> str:
+    return ' '.join(_word.findall(title.lower()))
+
+
+def title_numbers(title: str) -> int:
+    """Hash of the set of numbers in a title (model numbers, capacities, sizes)."""
+    return hash(frozenset(_number.findall(title)))
+
+
+def image_key(url: Optional[str]) -> Optional[str]:
+    if not url or url.startswith('data:'):
+        return None
+    url = url.split('?', 1)[0].split('#', 1)[0]
+    url = re.sub(r'^https?:', '', url)
+    return _image_variant.sub('', url).lower() or None
+
+
+class _DisjointSet:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            # Keep the earliest listing as the root so labels are deterministic
+            self.parent[max(i, j)] = min(i, j)
+
+
+class Deduplicator:
+    """Groups listings of the same item across and within marketplaces.
+
+    Listings are merged when their titles are near duplicates, found with MinHash
+    and banded LSH so only listings sharing a band are ever compared, or when they
+    show the same picture. Clustering a batch is roughly linear in its size.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self.num_perm = self.config['NUM_PERM']
+        self.bands = self.config['BANDS']
+        self.rows = self.num_perm // self.bands
+        self.threshold = self.config['THRESHOLD']
+        self.shingle_size = self.config['SHINGLE_SIZE']
+        self.alternate_fields = self.config['ALTERNATE_FIELDS']
+        # Fixed seed: the same batch must always cluster the same way
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(0, 2 ** 31, size=self.num_perm, dtype=np.uint32) * np.uint32(2) + np.uint32(1)
+        self._b = rng.integers(0, 2 ** 32, size=self.num_perm, dtype=np.uint32)
+        self._band_mix = rng.integers(0, 2 ** 63, size=self.rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """MinHash signatures of the byte shingles of each (non-empty) text, one row per text."""
+        size = self.shingle_size
+        # Pad short texts so each has at least one shingle
+        encoded = [text.encode('utf-8').ljust(size) for text in texts]
+        lengths = np.array([len(text) for text in encoded])
+        counts = lengths - size + 1
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+
+        # Every shingle packed into one integer, for all texts at once; the ones
+        # straddling two texts are dropped below
+        windows = np.zeros(len(data) - size + 1, dtype=np.uint64)
+        for k in range(size):
+            windows |= data[k:len(data) - size + 1 + k] << np.uint64(8 * (size - 1 - k))
+        starts = np.cumsum(lengths) - lengths
+        valid = np.repeat(starts, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        # One well-mixed 32-bit hash per shingle (multiply-shift; uint64 arithmetic wraps)
+        hashes = ((windows[valid] * _MIX + _MIX) >> np.uint64(32)).astype(np.uint32)
+        ends = np.cumsum(counts)
+        offsets = ends - counts
+
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        row = 0
+        while row < len(texts):
+            # Hash as many texts per step as fit in _CHUNK shingles: one
+            # (NUM_PERM x shingles) product and a segmented minimum
+            end = max(row + 1, int(np.searchsorted(ends, offsets[row] + _CHUNK, side='right')))
+            chunk = hashes[offsets[row]:ends[end - 1]]
+            # NUM_PERM random affine permutations of the 32-bit hashes
+            permuted = self._a[:, None] * chunk[None, :]
+            permuted += self._b[:, None]
+            signatures[row:end] = np.minimum.reduceat(permuted, offsets[row:end] - offsets[row], axis=1).T
+            row = end
+        return signatures
+
+    def candidate_pairs(self, signatures: np.ndarray, numbers: np.ndarray) -> np.ndarray:
+        """Pairs of signature rows that are near duplicates, found through banded LSH."""
+        count = len(signatures)
+        # One key per (row, band): the band's slice of the signature mixed down to a
+        # single integer, salted with the band number so bands never share buckets
+        bands = signatures.reshape(count, self.bands, self.rows).astype(np.uint64)
+        keys = (bands * self._band_mix).sum(axis=2, dtype=np.uint64)
+        keys += np.arange(self.bands, dtype=np.uint64) * _MIX
+        _, first, bucket = np.unique(keys.ravel(), return_index=True, return_inverse=True)
+
+        # Compare every row with the first row in each of its buckets only; with a
+        # bucket per band, true duplicates almost always meet one way or another
+        rows = np.repeat(np.arange(count), self.bands)
+        anchors = first[bucket.ravel()] // self.bands
+        candidates = (anchors != rows) & (numbers[rows] == numbers[anchors])
+        pairs = np.unique(rows[candidates] * count + anchors[candidates])
+        pairs = np.stack([pairs // count, pairs % count], axis=1)
+        similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+        return pairs[similarity >= self.threshold]
+
+    def cluster(self, products: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Return a cluster label per product; duplicates share a label."""
+        groups = _DisjointSet(len(products))
+
+        # Identical titles (repeats across pages, sponsored slots) are merged outright
+        # and hashed once
+        by_title: Dict[str, int] = {}
+        for i, product in enumerate(products):
+            title = product.get('title') or ''
+            if title in by_title:
+                groups.union(by_title[title], i)
+            else:
+                by_title[title] = i
+
+        rows = []
+        texts = []
+        numbers = []
+        for title, i in by_title.items():
+            text = normalize_title(title)
+            if text:
+                rows.append(i)
+                texts.append(text)
+                numbers.append(title_numbers(text))
+        if len(rows) > 1:
+            rows = np.array(rows, dtype=np.intp)
+            numbers = np.array(numbers, dtype=np.int64)
+            signatures = self.signatures(texts)
+            for i, j in self.candidate_pairs(signatures, numbers).tolist():
+                groups.union(int(rows[i]), int(rows[j]))
+
+        by_image: Dict[str, List[int]] = {}
+        for i, product in enumerate(products):
+            key = image_key(product.get('image'))
+            if key is not None:
+                by_image.setdefault(key, []).append(i)
+        for members in by_image.values():
+            if 1 < len(members) <= self.config['IMAGE_MAX_SHARE']:
+                for i in members[1:]:
+                    groups.union(members[0], i)
+
+        return np.fromiter((groups.find(i) for i in range(len(products))), dtype=np.intp, count=len(products))
+
+    @staticmethod
+    def group(labels: np.ndarray, order: np.ndarray, top_k: Optional[int] = None) -> Tuple[List[Tuple[int, List[int]]], int]:
+        """Fold a ranking into clusters.
+
+        Returns ``(clusters, total)``: up to ``top_k`` ``(best, alternates)`` pairs of
+        product indices, in the order of each cluster's best ranked member, and the
+        number of clusters in the ranking.
+        """
+        ranked_labels = labels[order].tolist()
+        _, first = np.unique(ranked_labels, return_index=True)
+        first.sort()
+        members: Dict[int, List[int]] = {ranked_labels[position]: [] for position in first[:top_k]}
+        for position, label in enumerate(ranked_labels):
+            cluster = members.get(label)
+            if cluster is not None:
+                cluster.append(int(order[position]))
+        return [(cluster[0], cluster[1:]) for cluster in members.values()], len(first)
+
+    def alternate(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: product.get(field) for field in self.alternate_fields}
+
+
+_deduplicator: Optional[Deduplicator] = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator() -> Deduplicator:
+    """Return the process-wide deduplicator, configured from CHATSHOP_DEDUP."""
+    global _deduplicator
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_DEDUP', None)
+                except ImportError:
+                    pass
+                _deduplicator = Deduplicator(config)
+    return _deduplicator
@@ -0,0 +1,125 @@
+import asyncio
+import json
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from . import http_client
+from .extraction import CompiledExtractor
+from .metrics import timed
+from .parsing import get_parse_pool
+
+
+class SearchExtractor:
+    """Fetch, parse and post-process flow shared by the marketplace extractors.
+
+    Subclasses provide the selector spec, the search URL template, default
+    headers and ``_process_product``. A ``definition`` (see chat.utils.sources)
+    overrides them, or describes a whole marketplace without a subclass: ``name``,
+    ``search_url``, ``selectors`` (YAML or a mapping), and optionally ``host``,
+    ``headers``, ``base_url`` for relative links, ``blocked_message`` and
+    ``process``, a dotted path to a ``product -> product`` function.
+    """
+    source: str = None
+    host: str = None
+    # Format string with {query} and {page} placeholders
+    search_url: str = None
+    yaml_string: str = None
+    default_headers: Dict[str, str] = {}
+    base_url: str = None
+    blocked_message = "Page {url} was blocked. Please try using better proxies."
+
+    def __init__(self, definition: Dict[str, Any] = None):
+        definition = definition or {}
+        # Enough for a parse pool worker to build the same extractor
+        self.spec = (f'{type(self).__module__}.{type(self).__qualname__}', json.dumps(definition, sort_keys=True))
+        self.source = definition.get('name', self.source)
+        self.search_url = definition.get('search_url', self.search_url)
+        self.host = definition.get('host') or self.host or urlsplit(self.search_url).netloc
+        self.default_headers = {**self.default_headers, **definition.get('headers', {})}
+        self.base_url = definition.get('base_url', self.base_url)
+        self.blocked_message = definition.get('blocked_message', self.blocked_message)
+        self._process: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None
+        if definition.get('process'):
+            from django.utils.module_loading import import_string
+            self._process = import_string(definition['process'])
+
+        selectors = definition.get('selectors', self.yaml_string)
+        if isinstance(selectors, str):
+            self._extractor = CompiledExtractor.from_yaml_string(selectors)
+        else:
+            self._extractor = CompiledExtractor(selectors)
+
+    def _check_response(self, url: str, status_code: int) -> None:
+        if status_code > 500:
+            raise Exception(self.blocked_message.format(url=url))
+
+    def _scrape(self, url: str, headers: Dict[str, str] = None, timeout: Optional[Tuple[float, float]] = None, deadline=None) -> List[Dict[str, Any]]:
+        with timed('fetch', source=self.source):
+            response = http_client.get(url, headers=headers or self.default_headers, timeout=timeout or http_client.DEFAULT_TIMEOUT)
+        self._check_response(url, response.status_code)
+        pool = get_parse_pool()
+        if pool.accepts(len(response.content)):
+            remaining = deadline.remaining() if deadline is not None else None
+            products = pool.parse(self, response.content, response.encoding, remaining)
+            if products is not None:
+                return products
+        with timed('parse', source=self.source):
+            raw_data = self.parse(response.text)
+        with timed('normalize', source=self.source):
+            return self.process(raw_data)
+
+    async def _ascrape(self, url: str, headers: Dict[str, str] = None, timeout: Optional[Tuple[float, float]] = None, deadline=None) -> List[Dict[str, Any]]:
+        with timed('fetch', source=self.source):
+            response = await http_client.aget(url, headers=headers or self.default_headers, timeout=timeout)
+        self._check_response(url, response.status_code)
+        pool = get_parse_pool()
+        if pool.accepts(len(response.content)):
+            remaining = deadline.remaining() if deadline is not None else None
+            products = await pool.aparse(self, response.content, response.encoding, remaining)
+            if products is not None:
+                return products
+        # Parsing is CPU-bound; keep it off the event loop
+        with timed('parse', source=self.source):
+            raw_data = await asyncio.to_thread(self.parse, response.text)
+        with timed('normalize', source=self.source):
+            return self.process(raw_data)
+
+    def parse(self, text: str) -> Dict[str, Any]:
+        """Selector matches of a result page, as selectorlib would return them."""
+        return self._extractor.extract(text)
+
+    def process(self, raw_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Product records from the matches of ``parse``."""
+        if self._process is None:
+            return [self._process_product(product) for product in raw_data.get('products') or []]
+        products = [self._process(product) for product in raw_data.get('products') or []]
+        for product in products:
+            product.setdefault('source', self.source)
+        return products
+
+    def _process_product(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        # Declared marketplaces: trimmed text and absolute links
+        processed = {field: value.strip() if isinstance(value, str) else value for field, value in product.items()}
+        if self.base_url:
+            for field in ('url', 'image'):
+                if processed.get(field):
+                    processed[field] = urljoin(self.base_url, processed[field])
+        processed['source'] = self.source
+        return processed
+
+    def _build_result(self, query: str, page: int, products: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            "query": query,
+            "page": page,
+            "products": products
+        }
+
+    def search(self, query: str, page: int = 1, headers: Dict[str, str] = None, timeout: Optional[Tuple[float, float]] = None, deadline=None) -> Dict[str, List[Dict[str, Any]]]:
+        """``timeout`` is a (connect, read) pair in seconds, http_client.DEFAULT_TIMEOUT by default;
+        ``deadline`` (a source_guard.Deadline) bounds the wait for the parse pool."""
+        url = self.search_url.format(query=query, page=page)
+        return self._build_result(query, page, self._scrape(url, headers, timeout, deadline))
+
+    async def asearch(self, query: str, page: int = 1, headers: Dict[str, str] = None, timeout: Optional[Tuple[float, float]] = None, deadline=None) -> Dict[str, List[Dict[str, Any]]]:
+        url = self.search_url.format(query=query, page=page)
+        return self._build_result(query, page, await self._ascrape(url, headers, timeout, deadline))
@@ -0,0 +1,147 @@
+import asyncio
+import random
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader, MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    # requests can only decode br when a brotli package is installed
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT: Tuple[float, float] = (3.05, 15)
+
+# Number of distinct hosts kept in the pool cache and connections kept alive per host
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
+RETRY_TOTAL = 2
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_BACKOFF_JITTER = 0.5
+RETRY_STATUS_FORCELIST = (429, 502, 503, 504)
+# Longest Retry-After honoured, in seconds; a server asking for more gets its response
+# handed back rather than stalling the search past its deadline
+RETRY_AFTER_MAX = 5.0
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def retry_after(response) -> Optional[float]:
+    """Seconds asked for by a response's Retry-After header, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return Retry(0).parse_retry_after(value)
+    except InvalidHeader:
+        return None
+
+
+class BoundedRetry(Retry):
+    """Retry that gives up instead of waiting out a Retry-After above RETRY_AFTER_MAX."""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None:
+            seconds = retry_after(response)
+            if seconds is not None and seconds > RETRY_AFTER_MAX:
+                # With raise_on_status off the pool returns this response to the caller
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After of {seconds:.0f}s is too long"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _build_session() -> requests.Session:
+    retry = BoundedRetry(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=RETRY_TOTAL,
+        status=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        backoff_jitter=RETRY_BACKOFF_JITTER,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        # Hand the final response back to the caller instead of raising, the extractors
+        # inspect the status code themselves
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": ACCEPT_ENCODING,
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get(url: str, headers: Dict[str, str] = None, timeout: Tuple[float, float] = DEFAULT_TIMEOUT) -> requests.Response:
+    return get_session().get(url, headers=headers, timeout=timeout)
+
+
+# httpx.AsyncClient is tied to the event loop it was first used on, so keep one per loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _build_async_client() -> httpx.AsyncClient:
+    connect, read = DEFAULT_TIMEOUT
+    return httpx.AsyncClient(
+        headers={"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"},
+        timeout=httpx.Timeout(read, connect=connect),
+        limits=httpx.Limits(max_connections=POOL_CONNECTIONS * POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+        # Connection failures are retried by the transport, retryable statuses in aget below
+        transport=httpx.AsyncHTTPTransport(retries=RETRY_TOTAL),
+        follow_redirects=True,
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the pooled async client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _build_async_client()
+    return client
+
+
+async def aget(url: str, headers: Dict[str, str] = None, timeout: Optional[Tuple[float, float]] = None) -> httpx.Response:
+    client = get_async_client()
+    # The client's own (DEFAULT_TIMEOUT) applies unless the caller narrows it
+    request_timeout = httpx.USE_CLIENT_DEFAULT if timeout is None else httpx.Timeout(timeout[1], connect=timeout[0])
+    # Never sleep longer than the caller's (deadline-shortened) read timeout either
+    max_wait = RETRY_AFTER_MAX if timeout is None else min(RETRY_AFTER_MAX, timeout[1])
+    for attempt in range(RETRY_TOTAL + 1):
+        response = await client.get(url, headers=headers, timeout=request_timeout)
+        if response.status_code not in RETRY_STATUS_FORCELIST or attempt == RETRY_TOTAL:
+            return response
+        # Same schedule as the sync session: exponential backoff plus jitter, honouring a
+        # Retry-After up to max_wait and giving up on a longer one
+        delay = RETRY_BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, RETRY_BACKOFF_JITTER)
+        seconds = retry_after(response)
+        if seconds is not None:
+            if seconds > max_wait:
+                return response
+            delay = max(delay, seconds)
+        await asyncio.sleep(min(delay, max_wait))
+    return response
@@ -0,0 +1,238 @@
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Add a Server-Timing header with the stages of each request
+    'SERVER_TIMING': True,
+    # Histogram bucket bounds in seconds
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    # With several worker processes, each writes its histograms here every
+    # FLUSH_INTERVAL seconds and the metrics endpoint adds them all up
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5.0,
+    'PREFIX': 'chatshop',
+}
+
+HELP = {
+    'request': 'Time to produce an HTTP response, excluding streamed bodies.',
+    'llm': 'Time spent waiting for the language model.',
+    'fetch': 'Time spent downloading a marketplace result page.',
+    'parse': 'Time spent extracting listings from a result page.',
+    'normalize': 'Time spent cleaning up the listings of a result page.',
+    'rank': 'Time spent deduplicating and ranking search results.',
+    'search': 'Time to answer a product search, fetching included.',
+    'db': 'Time spent writing to the database.',
+}
+
+_token = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Stages of the request being handled, when Server-Timing is collected for it
+_current: contextvars.ContextVar = contextvars.ContextVar('chatshop_request_timings', default=None)
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class RequestTimings:
+    """Stage durations of one request, summed per stage and label for Server-Timing."""
+
+    def __init__(self):
+        self._entries: Dict[str, List[float]] = {}
+        # Fetches of one request run on several threads
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._entries.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def header(self, total: Optional[float] = None) -> str:
+        with self._lock:
+            entries = list(self._entries.items())
+        parts = []
+        for name, (seconds, count) in entries:
+            part = f'{name};dur={seconds * 1000:.1f}'
+            if count > 1:
+                # Durations of parallel calls add up past the wall clock time
+                part += f';desc="{count} calls"'
+            parts.append(part)
+        if total is not None:
+            parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def _timing_name(stage: str, labels: Dict[str, Any]) -> str:
+    return '.'.join([stage] + [_token.sub('_', str(value)).lower() for value in labels.values() if value])
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Latency histograms per stage, rendered in the Prometheus text format."""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self.buckets = tuple(sorted(self.config['BUCKETS']))
+        # (stage, labels) -> [count per bucket..., +Inf count, sum]
+        self._series: Dict[SeriesKey, List[float]] = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def observe(self, stage: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        timings = _current.get()
+        if timings is not None:
+            timings.add(_timing_name(stage, labels), seconds)
+
+        key = (stage, tuple(sorted((name, str(value)) for name, value in labels.items())))
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+        if self.config['MULTIPROCESS_DIR'] and self._flusher is None:
+            self._start_flusher()
+
+    @contextmanager
+    def timed(self, stage: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    # Several processes
+
+    def snapshot(self) -> List[Any]:
+        with self._lock:
+            return [[stage, list(labels), list(series)] for (stage, labels), series in self._series.items()]
+
+    def _snapshot_path(self, pid: int = None) -> str:
+        return os.path.join(self.config['MULTIPROCESS_DIR'], f'metrics-{pid or os.getpid()}.json')
+
+    def flush(self) -> None:
+        path = self._snapshot_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning("Writing metrics to %s failed: %s", path, e)
+
+    def _start_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_periodically, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.config['FLUSH_INTERVAL'])
+            self.flush()
+
+    def _merged(self) -> Dict[SeriesKey, List[float]]:
+        merged: Dict[SeriesKey, List[float]] = {}
+        snapshots = [self.snapshot()]
+        if self.config['MULTIPROCESS_DIR']:
+            own = self._snapshot_path()
+            # Files of exited workers are kept so their counts never go backwards
+            for path in glob.glob(os.path.join(self.config['MULTIPROCESS_DIR'], 'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.warning("Reading metrics from %s failed: %s", path, e)
+        for snapshot in snapshots:
+            for stage, labels, series in snapshot:
+                key = (stage, tuple(tuple(label) for label in labels))
+                total = merged.setdefault(key, [0] * len(series))
+                if len(total) == len(series):
+                    for i, value in enumerate(series):
+                        total[i] += value
+        return merged
+
+    def render(self) -> str:
+        prefix = self.config['PREFIX']
+        by_stage: Dict[str, List[Tuple[Tuple[Tuple[str, str], ...], List[float]]]] = {}
+        for (stage, labels), series in sorted(self._merged().items()):
+            by_stage.setdefault(stage, []).append((labels, series))
+
+        lines = []
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for stage, entries in by_stage.items():
+            name = f'{prefix}_{stage}_seconds'
+            lines.append(f'# HELP {name} {HELP.get(stage, f"Time spent in the {stage} stage.")}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, series in entries:
+                label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+                cumulative = 0
+                for bound, count in zip(bounds, series[:-1]):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{name}_bucket{{{label_text + "," if label_text else ""}{le}}} {int(cumulative)}')
+                suffix = f'{{{label_text}}}' if label_text else ''
+                lines.append(f'{name}_sum{suffix} {series[-1]}')
+                lines.append(f'{name}_count{suffix} {int(cumulative)}')
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def collect_request_timings():
+    """Collect the stages timed while the block runs (including on threads started
+    with a copy of this context) for a Server-Timing header."""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Return the process-wide metrics registry, configured from CHATSHOP_METRICS."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_METRICS', None)
+                except ImportError:
+                    pass
+                _metrics = Metrics(config)
+    return _metrics
+
+
+def timed(stage: str, **labels):
+    """Time a block as ``stage``: ``with timed('fetch', source='Amazon'): ...``."""
+    return get_metrics().timed(stage, **labels)
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Processes parsing result pages; 0 parses on the fetching thread instead
+    'WORKERS': 0,
+    # Smaller pages are parsed in place; shipping them to a worker costs more than it saves
+    'MIN_BYTES': 32 * 1024,
+    # 'spawn' or 'forkserver'; forking a worker that already runs threads is unsafe
+    'START_METHOD': 'spawn',
+    # Replace a worker after this many pages to cap lxml's memory growth (Python 3.11+)
+    'MAX_TASKS_PER_CHILD': 1000,
+    # Longest a page waits for a worker before it is parsed in place; a search's
+    # remaining deadline, when shorter, wins
+    'TIMEOUT': 10.0,
+}
+
+# Extractors built in a worker process, by SearchExtractor.spec
+_worker_extractors: Dict[Tuple[str, str], Any] = {}
+
+
+def _worker_extractor(spec: Tuple[str, str]):
+    extractor = _worker_extractors.get(spec)
+    if extractor is None:
+        from django.utils.module_loading import import_string
+        class_path, definition = spec
+        extractor = _worker_extractors[spec] = import_string(class_path)(json.loads(definition) or None)
+    return extractor
+
+
+def parse_page(spec: Tuple[str, str], content: bytes, encoding: Optional[str]) -> Tuple[List[Dict[str, Any]], float]:
+    """Runs in a worker: the processed products of a page, and the seconds spent processing them."""
+    extractor = _worker_extractor(spec)
+    raw = extractor.parse(content.decode(encoding or 'utf-8', errors='replace'))
+    start = time.perf_counter()
+    products = extractor.process(raw)
+    return products, time.perf_counter() - start
+
+
+class ParsePool:
+    """Parses result pages in worker processes, so parsing scales past the GIL.
+
+    Fetching stays on threads or the event loop; a worker gets the raw page bytes
+    and sends back only the processed product dicts. If the pool breaks (a worker
+    killed by the OOM killer, say) it is rebuilt and that page is parsed in place,
+    as is a page the pool doesn't return in time.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.workers = self.config['WORKERS'] or 0
+        self.enabled = self.workers > 0
+        self.metrics = get_metrics()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def accepts(self, size: int) -> bool:
+        return self.enabled and size >= self.config['MIN_BYTES']
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                kwargs = {}
+                if self.config['MAX_TASKS_PER_CHILD'] and sys.version_info >= (3, 11):
+                    kwargs['max_tasks_per_child'] = self.config['MAX_TASKS_PER_CHILD']
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.config['START_METHOD']),
+                    **kwargs,
+                )
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor, source: str, error: Exception) -> None:
+        logger.warning("Parse pool failed, parsing %s in place: %s", source, error)
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _timeout(self, remaining: Optional[float]) -> float:
+        timeout = self.config['TIMEOUT']
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def _observe(self, source: str, elapsed: float, processing: float) -> None:
+        # The round trip, minus the post-processing the worker reports, counts as parsing
+        self.metrics.observe('parse', max(elapsed - processing, 0.0), source=source)
+        self.metrics.observe('normalize', processing, source=source)
+
+    def parse(self, extractor, content: bytes, encoding: Optional[str], remaining: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """The processed products of a page, or None if the pool is unusable or too slow;
+        ``remaining`` is what is left of the search's deadline, in seconds."""
+        start = time.perf_counter()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(parse_page, extractor.spec, content, encoding)
+            products, processing = future.result(timeout=self._timeout(remaining))
+        except BrokenProcessPool as e:
+            self._discard(executor, extractor.source, e)
+            return None
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning("Parse pool too slow, parsing %s in place", extractor.source)
+            return None
+        self._observe(extractor.source, time.perf_counter() - start, processing)
+        return products
+
+    async def aparse(self, extractor, content: bytes, encoding: Optional[str], remaining: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        start = time.perf_counter()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(parse_page, extractor.spec, content, encoding)
+            # wait_for cancels the pool future too if it hasn't started yet
+            products, processing = await asyncio.wait_for(asyncio.wrap_future(future), self._timeout(remaining))
+        except BrokenProcessPool as e:
+            self._discard(executor, extractor.source, e)
+            return None
+        except asyncio.TimeoutError:
+            logger.warning("Parse pool too slow, parsing %s in place", extractor.source)
+            return None
+        self._observe(extractor.source, time.perf_counter() - start, processing)
+        return products
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool: Optional[ParsePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ParsePool:
+    """Return the process-wide parse pool, configured from CHATSHOP_PARSING."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_PARSING', None)
+                except ImportError:
+                    pass
+                _pool = ParsePool(config)
+    return _pool
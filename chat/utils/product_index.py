@@ -0,0 +1,261 @@
+import hashlib
+import logging
+import queue
+import re
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .cache import _close_thread_connections
+from .metrics import timed
+from .ranking import get_ranker, parse_price
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # A query is answered from the index when it has at least this many matches...
+    'MIN_MATCHES': 10,
+    # ...scraped within MAX_AGE seconds
+    'MAX_AGE': 24 * 60 * 60,
+    # When the newest of those matches is older than this, the query is also scraped
+    # again in the background
+    'REFRESH_AFTER': 60 * 60,
+    # Matches read per query
+    'LIMIT': 200,
+    # Pages waiting to be written; more are dropped rather than slowing searches down
+    'QUEUE_SIZE': 256,
+    # Attempts at a batch the database refused with a transient error (e.g. SQLite's
+    # "database is locked" while requests write), backing off from RETRY_DELAY seconds
+    'WRITE_ATTEMPTS': 5,
+    'RETRY_DELAY': 0.2,
+}
+
+_term = re.compile(r'\w+')
+_amazon_asin = re.compile(r'/dp/([A-Z0-9]{10})')
+
+# Terms used in a full-text query, so a rambling query can't produce a huge one
+MAX_TERMS = 12
+
+
+class IndexHit(NamedTuple):
+    products: List[Dict[str, Any]]
+    stale: bool
+
+
+def listing_key(product: Dict[str, Any]) -> str:
+    """Stable key for a listing: tracking parameters and Amazon's ref paths differ per scrape."""
+    url = product.get('url') or ''
+    asin = _amazon_asin.search(url)
+    canonical = asin.group(1) if asin else url.split('?', 1)[0].split('#', 1)[0]
+    return hashlib.sha1(f"{product.get('source')}|{canonical}".encode('utf-8')).hexdigest()
+
+
+def query_terms(query: str) -> List[str]:
+    return [term.lower() for term in _term.findall(query or '')][:MAX_TERMS]
+
+
+class ProductIndex:
+    """Listings from every scrape, searchable by title.
+
+    Writes go through a queue drained by one background thread so scraping never
+    waits on the database. Lookups use Postgres full-text and trigram indexes or
+    SQLite FTS5, depending on the database (see migration 0007).
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self._queue = queue.Queue(maxsize=self.config['QUEUE_SIZE'])
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._has_fts = None
+
+    # Writing
+
+    def add(self, products: List[Dict[str, Any]]) -> None:
+        """Queue scraped listings for writing; never blocks."""
+        if not self.enabled or not products:
+            return
+        self._start_writer()
+        try:
+            self._queue.put_nowait(products)
+        except queue.Full:
+            logger.warning("Product index queue is full, dropping %s listings", len(products))
+
+    def _start_writer(self) -> None:
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._drain, name='product-index-writer', daemon=True)
+                    self._writer.start()
+
+    def _drain(self) -> None:
+        while True:
+            batch = list(self._queue.get())
+            # Write whatever else piled up in the same statement
+            while True:
+                try:
+                    batch.extend(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_with_retries(batch)
+            finally:
+                _close_thread_connections()
+
+    def _write_with_retries(self, batch: List[Dict[str, Any]]) -> None:
+        from django.db import OperationalError
+
+        attempts = max(self.config['WRITE_ATTEMPTS'], 1)
+        for attempt in range(attempts):
+            try:
+                self.write(batch)
+                return
+            except OperationalError as e:
+                if attempt + 1 == attempts:
+                    logger.warning("Writing %s listings to the product index failed after %s attempts: %s", len(batch), attempts, e)
+                    return
+                # Start the retry on a fresh connection
+                _close_thread_connections()
+                time.sleep(self.config['RETRY_DELAY'] * 2 ** attempt)
+            except Exception as e:
+                logger.warning("Writing %s listings to the product index failed: %s", len(batch), e)
+                return
+
+    def write(self, products: List[Dict[str, Any]]) -> None:
+        """Insert or refresh listings in one statement."""
+        from django.utils import timezone
+        from chat.models import Product
+
+        ranker = get_ranker()
+        defaults = ranker.config['SOURCE_CURRENCIES']
+        now = timezone.now()
+        rows = {}
+        for product in products:
+            if not product.get('url') or not product.get('title'):
+                continue
+            amount, currency = parse_price(product.get('price'), defaults.get(product.get('source')))
+            price = ranker.fx.to_base_amount(amount, currency)
+            key = listing_key(product)
+            # Postgres refuses to upsert the same row twice in one statement; keep the latest
+            rows[key] = Product(
+                key=key,
+                source=product.get('source') or '',
+                url=product['url'],
+                title=product['title'],
+                image=product.get('image') or '',
+                price=price,
+                currency=currency or '',
+                rating=product.get('rating'),
+                number_of_ratings=product.get('number_of_ratings'),
+                data=product,
+                last_seen=now,
+            )
+        with timed('db', operation='index_write'):
+            Product.objects.bulk_create(
+                rows.values(),
+                update_conflicts=True,
+                unique_fields=['key'],
+                update_fields=['url', 'title', 'image', 'price', 'currency', 'rating', 'number_of_ratings', 'data', 'last_seen'],
+            )
+
+    # Reading
+
+    def search(self, query: str, max_age: float = None, limit: int = None) -> List[Any]:
+        """Listings seen within ``max_age`` seconds whose titles match every term of ``query``, best first."""
+        from django.db import connection
+        from django.utils import timezone
+        from chat.models import Product
+
+        terms = query_terms(query)
+        if not terms:
+            return []
+        since = timezone.now() - timedelta(seconds=self.config['MAX_AGE'] if max_age is None else max_age)
+        limit = limit or self.config['LIMIT']
+
+        if connection.vendor == 'postgresql':
+            ids = self._search_postgres(connection, terms, since, limit)
+        elif connection.vendor == 'sqlite' and self._sqlite_has_fts(connection):
+            ids = self._search_sqlite(connection, terms, since, limit)
+        else:
+            matches = Product.objects.filter(last_seen__gte=since)
+            for term in terms:
+                matches = matches.filter(title__icontains=term)
+            ids = list(matches.order_by('-last_seen').values_list('id', flat=True)[:limit])
+
+        rows = Product.objects.in_bulk(ids)
+        return [rows[i] for i in ids if i in rows]
+
+    def _search_postgres(self, connection, terms, since, limit):
+        # Prefix-match every term; failing that, the trigram index catches misspellings
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        text = ' '.join(terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id FROM chat_product
+                WHERE last_seen >= %s
+                  AND (to_tsvector('simple', title) @@ to_tsquery('simple', %s) OR %s <%% title)
+                ORDER BY ts_rank(to_tsvector('simple', title), to_tsquery('simple', %s)) DESC,
+                         word_similarity(%s, title) DESC
+                LIMIT %s
+                """,
+                [since, tsquery, text, tsquery, text, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _search_sqlite(self, connection, terms, since, limit):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT chat_product.id FROM chat_product_fts
+                JOIN chat_product ON chat_product.id = chat_product_fts.rowid
+                WHERE chat_product_fts MATCH %s AND chat_product.last_seen >= %s
+                ORDER BY bm25(chat_product_fts)
+                LIMIT %s
+                """,
+                [match, connection.ops.adapt_datetimefield_value(since), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _sqlite_has_fts(self, connection) -> bool:
+        if self._has_fts is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_product_fts'")
+                self._has_fts = cursor.fetchone() is not None
+        return self._has_fts
+
+    def lookup(self, query: str) -> Optional[IndexHit]:
+        """Indexed listings for ``query``, or None when there are too few recent ones."""
+        from django.utils import timezone
+
+        rows = self.search(query)
+        if len(rows) < self.config['MIN_MATCHES']:
+            return None
+        newest = max(row.last_seen for row in rows)
+        stale = newest < timezone.now() - timedelta(seconds=self.config['REFRESH_AFTER'])
+        return IndexHit([row.data for row in rows], stale)
+
+
+_product_index: Optional[ProductIndex] = None
+_product_index_lock = threading.Lock()
+
+
+def get_product_index() -> ProductIndex:
+    """Return the process-wide product index, configured from CHATSHOP_PRODUCT_INDEX."""
+    global _product_index
+    if _product_index is None:
+        with _product_index_lock:
+            if _product_index is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_PRODUCT_INDEX', None)
+                except ImportError:
+                    pass
+                _product_index = ProductIndex(config)
+    return _product_index
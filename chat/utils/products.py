@@ -1,78 +1,506 @@
+import asyncio
+import contextvars
+import logging
+import threading
 import time
-import re
-from operator import itemgetter
-from .SearchAmazon import AmazonSearchExtractor
-from .SearchAliexpress import AliExpressSearchExtractor
-from .SearchJumia import JumiaSearchExtractor
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from asgiref.sync import sync_to_async
+from .sources import get_source_registry
+from .throttle import HostPacer, get_host_pacer
+from .cache import get_search_cache, make_key, normalize_query, _close_thread_connections
+from .ranking import get_ranker
+from .dedup import get_deduplicator
+from .product_index import get_product_index, listing_key
+from .metrics import timed
+from .source_guard import CircuitOpen, DeadlineExceeded, SourceReport, get_source_guard, skip_reason
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+# Queries being scraped again in the background to refresh the product index
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+CURSOR_SALT = 'chat.search-cursor'
+# Characters of a listing key a cursor keeps per product already shown
+SHOWN_KEY_LENGTH = 10
+
+
+def shown_key(product):
+    return listing_key(product)[:SHOWN_KEY_LENGTH]
+
+
+def encode_cursor(state):
+    from django.core import signing
+    return signing.dumps(state, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """Return the search state in ``cursor``; raises ValueError if it was tampered with."""
+    from django.core import signing
+    try:
+        return signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise ValueError('Invalid search cursor')
+
+
+def _run_and_close(fn, *args):
+    """Run a search pool task, then close the DB connections its thread opened."""
+    try:
+        return fn(*args)
+    finally:
+        _close_thread_connections()
+
+
+class _PartialResult(Exception):
+    def __init__(self, result):
+        super().__init__('partial search result')
+        self.result = result
+
 
 class MultiPlatformSearcher:
-    def __init__(self):
-        self.extractors = [
-            AmazonSearchExtractor(),
-            AliExpressSearchExtractor(),
-            JumiaSearchExtractor()
-        ]
+    def __init__(self, max_workers=None, host_interval=None, sources=None):
+        self.registry = get_source_registry()
+        # Names of the marketplaces to search (see SourceRegistry.select); raises ValueError for unknown ones
+        self.use_sources(sources)
+        self.max_workers = max_workers
+        # Pages from the same marketplace are spaced out, across every search in the process;
+        # different marketplaces run side by side. host_interval gives this searcher its own pacer
+        self.pacer = get_host_pacer() if host_interval is None else HostPacer(min_interval=host_interval)
+        self.cache = get_search_cache()
+        self.ranker = get_ranker()
+        self.deduplicator = get_deduplicator()
+        self.index = get_product_index()
+        self.guard = get_source_guard()
 
-    def search_and_sort_products(self, query, num_pages=3, sort_criteria=[('price', False), ('rating', True)]):
-        all_products = []
+    def use_sources(self, sources):
+        """Search only ``sources`` from now on; None for the deployment's default set."""
+        self.sources = self.registry.select(sources)
+        # Shared, already built extractors; constructing a searcher compiles nothing
+        self.extractors = self.registry.extractors(self.sources)
+
+    def _fetch_page(self, extractor, query, page, deadline=None):
+        def fetch():
+            breaker = self.guard.breaker(extractor.source)
+            # Before taking a host slot, so a skipped source holds up no other search
+            if not breaker.allow():
+                raise CircuitOpen(extractor.source)
+            try:
+                delay = self.pacer.reserve(extractor.host, deadline.remaining() if deadline is not None else None)
+                if deadline is not None:
+                    # Don't queue behind the pacer for a slot the search can't wait for
+                    deadline.check(delay)
+                if delay > 0:
+                    time.sleep(delay)
+                timeout = deadline.timeout(http_client.DEFAULT_TIMEOUT) if deadline is not None else None
+                products = self.guard.hedge(lambda: extractor.search(query, page, timeout=timeout, deadline=deadline), deadline)['products']
+            except (DeadlineExceeded, FuturesTimeout):
+                # Out of search budget; says nothing about the source
+                breaker.release()
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+            self.index.add(products)
+            return products
 
-        for extractor in self.extractors:
-            for page in range(1, num_pages + 1):
-                print(f"Searching {extractor.__class__.__name__} page {page}...")
+        key = make_key('page', query, extractor.source, page)
+        # Pages coalesce within the process only; the lease is taken per search result
+        return self.cache.get_or_fetch(key, fetch, self.cache.ttl_for(extractor.source), shared=False)
+
+    def _tasks(self, num_pages):
+        return [(extractor, page) for extractor in self.extractors for page in range(1, num_pages + 1)]
+
+    def iter_search(self, query, num_pages=3):
+        """Yield (source, page, products) for every page as soon as its fetch completes."""
+        tasks = self._tasks(num_pages)
+        if not tasks:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers or len(tasks))
+        try:
+            futures = {
+                executor.submit(contextvars.copy_context().run, _run_and_close, self._fetch_page, extractor, query, page): (extractor, page)
+                for extractor, page in tasks
+            }
+            for future in as_completed(futures):
+                extractor, page = futures[future]
                 try:
-                    results = extractor.search(query, page)
-                    all_products.extend(results['products'])
+                    products = future.result()
                 except Exception as e:
-                    print(f"Error searching {extractor.__class__.__name__} page {page}: {e}")
-                time.sleep(2)  # Add a delay to avoid overwhelming the server
-
-        # Remove products with missing data for any of the sort fields
-        filtered_products = [p for p in all_products if all(field in p and p[field] is not None for field, _ in sort_criteria)]
-
-        # Prepare the products for sorting
-        for product in filtered_products:
-            for field, _ in sort_criteria:
-                if field == 'price':
-                    product[f'{field}_sort'] = float(re.sub(r'[^\d.]', '', product[field]))
-                elif field in ['rating', 'number_of_ratings']:
-                    product[f'{field}_sort'] = float(product[field]) if product[field] else 0
-                else:
-                    product[f'{field}_sort'] = product[field]
-
-        # Sort the products
-        for field, reverse in reversed(sort_criteria):
-            filtered_products.sort(key=itemgetter(f'{field}_sort'), reverse=reverse)
-
-        return filtered_products
-
-    # @staticmethod
-    # def print_product(product):
-    #     print(f"Title: {product['title']}")
-    #     print(f"Price: {product['price']}")
-    #     print(f"Rating: {product['rating']}")
-    #     print(f"Number of Ratings: {product['number_of_ratings']}" or f'Number of Ratings: {None}')
-    #     print(f"URL: {product['url']}")
-    #     print(f"Image URL: {product['image']}")
-    #     print(f"Source: {product.get('source', 'Unknown')}")
-    #     print("-" * 50)
-
-
-# if __name__ == "__main__":
-#     start = time.time()
-#     searcher = MultiPlatformSearcher()
-    
-#     query = input("Enter your search query: ")
-#     num_pages = int(input("Enter the number of pages to search per site (default 3): ") or 3)
-    
-#     # Example sort criteria: first by price (ascending), then by rating (descending)
-#     sort_criteria = [('price', False), ('rating', True)]
-    
-#     products = searcher.search_and_sort_products(query, num_pages, sort_criteria)
-#     print(products)
-#     stop = time.time()
-#     print(f"\nFound {len(products)} products. Sorted by multiple criteria: {sort_criteria}")
-#     print("\n\nTIME_TAKEN: ", stop-start, "\n\n")
-#     for product in products[:10]:  # Print top 10 results
-#         MultiPlatformSearcher.print_product(product)
-
-#     print(f"Total products: {len(products)}")
\ No newline at end of file
+                    logger.warning("Error searching %s page %s: %s", extractor.__class__.__name__, page, e)
+                    products = []
+                yield extractor.source, page, products
+        finally:
+            # If the consumer stops early (e.g. a streaming client disconnects) drop the queued fetches
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch_pages(self, query, tasks, deadline=None):
+        """Fetch ``(extractor, page)`` tasks side by side.
+
+        Returns ``(extractor, page, products, error)`` in task order; ``error`` is None
+        on success, and pages still missing at ``deadline`` fail with a timeout.
+        """
+        if not tasks:
+            return []
+        results = []
+        executor = ThreadPoolExecutor(max_workers=self.max_workers or len(tasks))
+        try:
+            # Each fetch runs in a copy of this context so its timings reach the request's Server-Timing
+            futures = [
+                executor.submit(contextvars.copy_context().run, _run_and_close, self._fetch_page, extractor, query, page, deadline)
+                for extractor, page in tasks
+            ]
+            # Collect in submission order so the merged list (and the stable sort below) is deterministic
+            for (extractor, page), future in zip(tasks, futures):
+                try:
+                    results.append((extractor, page, future.result(timeout=deadline.remaining() if deadline is not None else None), None))
+                except Exception as e:
+                    logger.warning("Skipping %s page %s: %s", extractor.__class__.__name__, page, skip_reason(e))
+                    results.append((extractor, page, [], e))
+        finally:
+            # Pages still in flight at the deadline finish in the background and land in the page cache
+            executor.shutdown(wait=False)
+        return results
+
+    @staticmethod
+    def _merge(results, report, products):
+        """Add fetched pages to ``products`` and ``report``."""
+        for extractor, _, page_products, error in results:
+            if error is None:
+                products.extend(page_products)
+                report.ok(extractor.source)
+            else:
+                report.skip(extractor.source, skip_reason(error))
+
+    def _fetch_all(self, query, num_pages, deadline=None):
+        """Return ``(products, report)``, leaving out the pages still missing at ``deadline``."""
+        all_products = []
+        report = SourceReport()
+        self._merge(self._fetch_pages(query, self._tasks(num_pages), deadline), report, all_products)
+        return all_products, report
+
+    def iter_rounds(self, query, fetched=None, exhausted=(), deadline=None):
+        """Yield fetched pages a round at a time (see _fetch_pages): the next page of every
+        source still going, side by side, then the page after that, and so on.
+
+        ``fetched`` maps sources to the pages already consumed. A source drops out
+        once it fails or comes back empty, and nothing is fetched until the consumer
+        asks for the next round.
+        """
+        fetched = dict(fetched or {})
+        active = [extractor for extractor in self.extractors if extractor.source not in exhausted]
+        while active and not (deadline is not None and deadline.expired):
+            results = self._fetch_pages(query, [(extractor, fetched.get(extractor.source, 0) + 1) for extractor in active], deadline)
+            for extractor, page, _, error in results:
+                if error is None:
+                    fetched[extractor.source] = page
+            active = [extractor for extractor, _, products, error in results if error is None and products]
+            yield results
+
+    def search_index(self, query, num_pages):
+        """Listings for ``query`` from the product index, or None to scrape them live."""
+        if not self.index.enabled:
+            return None
+        try:
+            hit = self.index.lookup(query)
+        except Exception as e:
+            logger.warning("Product index lookup failed: %s", e)
+            return None
+        if hit is None:
+            return None
+        if hit.stale:
+            self.refresh_in_background(query, num_pages)
+        if {product.get('source') for product in hit.products} <= set(self.sources):
+            return hit.products
+        products = [product for product in hit.products if product.get('source') in self.sources]
+        # Too few listings left for the sources asked for; scrape them instead
+        return products if len(products) >= self.index.config['MIN_MATCHES'] else None
+
+    def refresh_in_background(self, query, num_pages=3):
+        """Scrape ``query`` again off the request path; the results land in the index."""
+        key = (normalize_query(query), num_pages)
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+
+        def refresh():
+            try:
+                self._fetch_all(query, num_pages)
+            except Exception as e:
+                logger.warning("Background refresh of %r failed: %s", query, e)
+            finally:
+                with _refreshing_lock:
+                    _refreshing.discard(key)
+                _close_thread_connections()
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _result_key(self, query, num_pages, sort_criteria, top_k):
+        sources = ','.join(extractor.source for extractor in self.extractors)
+        return make_key('results', query, sources, num_pages, variant=repr((sort_criteria, top_k)))
+
+    def _result_ttl(self):
+        return min(self.cache.ttl_for(extractor.source) for extractor in self.extractors) if self.extractors else 0
+
+    def search(self, query, num_pages=3, sort_criteria=None, top_k=None, budget=None):
+        """Return ``(products, sources)``: the ranked products and which marketplaces they
+        came from, as ``{'included': [...], 'skipped': {source: reason}, 'partial': {...}}``.
+
+        Fetching stops after ``budget`` seconds (CHATSHOP_SOURCE_GUARD['DEADLINE'] by
+        default) and whatever arrived by then is ranked. Sources whose circuit is open
+        are skipped without being contacted.
+        """
+        sort_criteria = sort_criteria or self.ranker.config['SORT_CRITERIA']
+        key = self._result_key(query, num_pages, sort_criteria, top_k)
+
+        def fetch():
+            # A fresh budget per fetch, background refreshes of a stale entry included
+            deadline = self.guard.deadline(budget)
+            indexed = self.search_index(query, num_pages)
+            if indexed is not None:
+                sources = SourceReport.all_included(extractor.source for extractor in self.extractors)
+                return self.sort_products(indexed, sort_criteria, top_k), sources.as_dict()
+            all_products, report = self._fetch_all(query, num_pages, deadline)
+            result = self.sort_products(all_products, sort_criteria, top_k), report.as_dict()
+            if not report.complete:
+                # Don't let a transient failure of one marketplace stick around for a whole TTL
+                raise _PartialResult(result)
+            return result
+
+        try:
+            return self.cache.get_or_fetch(key, fetch, self._result_ttl())
+        except _PartialResult as partial:
+            return partial.result
+
+    def search_and_sort_products(self, query, num_pages=3, sort_criteria=None, top_k=None):
+        return self.search(query, num_pages, sort_criteria, top_k)[0]
+
+    def _start_state(self, query):
+        # q: query, e: sources searched, i: served from the product index, f: pages
+        # consumed per source, x: sources with no pages left, s: shown_key() of every
+        # product shown so far
+        return {'q': query, 'e': list(self.sources), 'i': False, 'f': {}, 'x': [], 's': []}
+
+    def _resume_state(self, cursor):
+        state = decode_cursor(cursor)
+        if state.get('e'):
+            self.use_sources(state['e'])
+        return state
+
+    def _consumed_tasks(self, state):
+        return [
+            (extractor, page)
+            for extractor in self.extractors
+            for page in range(1, state['f'].get(extractor.source, 0) + 1)
+        ]
+
+    def _absorb(self, results, state, report, products):
+        self._merge(results, report, products)
+        for extractor, page, page_products, error in results:
+            if error is None:
+                state['f'][extractor.source] = page
+                if not page_products:
+                    state['x'].append(extractor.source)
+
+    def _has_enough(self, products, state, limit, sort_criteria):
+        # Qualifying products (clusters, with deduplication) against what this batch needs
+        return self.rank_products(products, sort_criteria, top_k=0)[1] >= len(state['s']) + limit
+
+    def _next_batch(self, products, state, report, limit, sort_criteria):
+        shown = set(state['s'])
+        ranked, _ = self.rank_products(products, sort_criteria)
+        fresh = [product for product in ranked if shown_key(product) not in shown]
+        batch = fresh[:limit]
+        state['s'] = state['s'] + [shown_key(product) for product in batch]
+        more = len(fresh) > limit or (not state['i'] and len(state['x']) < len(self.extractors))
+        return batch, report.as_dict(), encode_cursor(state) if more else None
+
+    def search_page(self, query=None, limit=20, cursor=None, sort_criteria=None, max_rounds=3, budget=None):
+        """Return ``(products, sources, cursor)`` for one batch of a lazily fetched search.
+
+        Pages are fetched a round at a time, page 1 of every marketplace before any
+        page 2, only until ``limit`` products qualify under ``sort_criteria`` (and at
+        most ``max_rounds`` rounds per call). Pass the returned ``cursor`` instead of
+        ``query`` to continue with the next batch, which picks up at the next page
+        and never repeats a product; it is None once there is nothing more to show.
+        ``sources`` is as for search().
+        """
+        state = self._start_state(query) if cursor is None else self._resume_state(cursor)
+        deadline = self.guard.deadline(budget)
+        report = SourceReport()
+        products = None
+        if cursor is None or state['i']:
+            products = self.search_index(state['q'], max_rounds)
+            state['i'] = products is not None
+        if products is not None:
+            report = SourceReport.all_included(extractor.source for extractor in self.extractors)
+            return self._next_batch(products, state, report, limit, sort_criteria)
+
+        # Pages consumed by earlier batches, normally straight from the page cache
+        products = []
+        self._merge(self._fetch_pages(state['q'], self._consumed_tasks(state), deadline), report, products)
+        rounds = self.iter_rounds(state['q'], state['f'], state['x'], deadline)
+        try:
+            for _ in range(max_rounds):
+                if self._has_enough(products, state, limit, sort_criteria):
+                    break
+                results = next(rounds, None)
+                if results is None:
+                    break
+                self._absorb(results, state, report, products)
+        finally:
+            rounds.close()
+        return self._next_batch(products, state, report, limit, sort_criteria)
+
+    async def _afetch_page(self, extractor, query, page, deadline=None):
+        async def fetch():
+            breaker = self.guard.breaker(extractor.source)
+            if not breaker.allow():
+                raise CircuitOpen(extractor.source)
+            try:
+                delay = self.pacer.reserve(extractor.host, deadline.remaining() if deadline is not None else None)
+                if deadline is not None:
+                    deadline.check(delay)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                timeout = deadline.timeout(http_client.DEFAULT_TIMEOUT) if deadline is not None else None
+                products = (await self.guard.ahedge(lambda: extractor.asearch(query, page, timeout=timeout, deadline=deadline), deadline))['products']
+            except (asyncio.CancelledError, DeadlineExceeded, asyncio.TimeoutError):
+                # Cut off by the search's deadline; says nothing about the source
+                breaker.release()
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+            self.index.add(products)
+            return products
+
+        key = make_key('page', query, extractor.source, page)
+        return await self.cache.aget_or_fetch(key, fetch, self.cache.ttl_for(extractor.source), shared=False)
+
+    async def _afetch_page_safe(self, extractor, query, page, deadline=None):
+        """Return ``(extractor, page, products, error)``; ``error`` is None on success."""
+        try:
+            return extractor, page, await self._afetch_page(extractor, query, page, deadline), None
+        except Exception as e:
+            logger.warning("Skipping %s page %s: %s", extractor.__class__.__name__, page, skip_reason(e))
+            return extractor, page, [], e
+
+    async def aiter_search(self, query, num_pages=3):
+        """Async counterpart of iter_search: yield (source, page, products) as pages complete."""
+        tasks = [asyncio.ensure_future(self._afetch_page_safe(extractor, query, page)) for extractor, page in self._tasks(num_pages)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                extractor, page, products, _ = await next_done
+                yield extractor.source, page, products
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _afetch_pages(self, query, tasks, deadline=None):
+        """Async counterpart of _fetch_pages; pages missing at the deadline are cancelled."""
+        if not tasks:
+            return []
+        futures = [asyncio.ensure_future(self._afetch_page_safe(extractor, query, page, deadline)) for extractor, page in tasks]
+        _, pending = await asyncio.wait(futures, timeout=deadline.remaining() if deadline is not None else None)
+        for future in pending:
+            future.cancel()
+        return [
+            (extractor, page, [], DeadlineExceeded()) if future in pending else future.result()
+            for (extractor, page), future in zip(tasks, futures)
+        ]
+
+    async def aiter_rounds(self, query, fetched=None, exhausted=(), deadline=None):
+        """Async counterpart of iter_rounds."""
+        fetched = dict(fetched or {})
+        active = [extractor for extractor in self.extractors if extractor.source not in exhausted]
+        while active and not (deadline is not None and deadline.expired):
+            results = await self._afetch_pages(query, [(extractor, fetched.get(extractor.source, 0) + 1) for extractor in active], deadline)
+            for extractor, page, _, error in results:
+                if error is None:
+                    fetched[extractor.source] = page
+            active = [extractor for extractor, _, products, error in results if error is None and products]
+            yield results
+
+    async def asearch_page(self, query=None, limit=20, cursor=None, sort_criteria=None, max_rounds=3, budget=None):
+        """Async counterpart of search_page."""
+        state = self._start_state(query) if cursor is None else self._resume_state(cursor)
+        deadline = self.guard.deadline(budget)
+        report = SourceReport()
+        products = None
+        if cursor is None or state['i']:
+            products = await sync_to_async(self.search_index)(state['q'], max_rounds)
+            state['i'] = products is not None
+        if products is not None:
+            report = SourceReport.all_included(extractor.source for extractor in self.extractors)
+            return self._next_batch(products, state, report, limit, sort_criteria)
+
+        products = []
+        self._merge(await self._afetch_pages(state['q'], self._consumed_tasks(state), deadline), report, products)
+        rounds = self.aiter_rounds(state['q'], state['f'], state['x'], deadline)
+        try:
+            for _ in range(max_rounds):
+                if self._has_enough(products, state, limit, sort_criteria):
+                    break
+                results = await anext(rounds, None)
+                if results is None:
+                    break
+                self._absorb(results, state, report, products)
+        finally:
+            await rounds.aclose()
+        return self._next_batch(products, state, report, limit, sort_criteria)
+
+    async def asearch(self, query, num_pages=3, sort_criteria=None, top_k=None, budget=None):
+        """Async counterpart of search; pages missing at the deadline are cancelled."""
+        sort_criteria = sort_criteria or self.ranker.config['SORT_CRITERIA']
+        key = self._result_key(query, num_pages, sort_criteria, top_k)
+
+        async def fetch():
+            deadline = self.guard.deadline(budget)
+            indexed = await sync_to_async(self.search_index)(query, num_pages)
+            if indexed is not None:
+                sources = SourceReport.all_included(extractor.source for extractor in self.extractors)
+                return self.sort_products(indexed, sort_criteria, top_k), sources.as_dict()
+
+            all_products = []
+            report = SourceReport()
+            self._merge(await self._afetch_pages(query, self._tasks(num_pages), deadline), report, all_products)
+            result = self.sort_products(all_products, sort_criteria, top_k), report.as_dict()
+            if not report.complete:
+                raise _PartialResult(result)
+            return result
+
+        try:
+            return await self.cache.aget_or_fetch(key, fetch, self._result_ttl())
+        except _PartialResult as partial:
+            return partial.result
+
+    async def asearch_and_sort_products(self, query, num_pages=3, sort_criteria=None, top_k=None):
+        return (await self.asearch(query, num_pages, sort_criteria, top_k))[0]
+
+    def rank_products(self, all_products, sort_criteria=None, top_k=None):
+        """Return ``(ranked, total)``: the best ``top_k`` offers and how many qualified.
+
+        With deduplication on, listings of the same item are folded into one entry,
+        its best ranked offer, with the others under ``alternates``.
+        """
+        with timed('rank'):
+            if not self.deduplicator.enabled:
+                return self.ranker.rank(all_products, sort_criteria, top_k)
+
+            all_products = list(all_products)
+            order, columns, _ = self.ranker.order(all_products, sort_criteria)
+            clusters, total = self.deduplicator.group(self.deduplicator.cluster(all_products), order, top_k)
+            ranked = []
+            for best, alternates in clusters:
+                product = self.ranker.annotate(all_products[best], best, columns)
+                product['alternates'] = [self.deduplicator.alternate(all_products[i]) for i in alternates]
+                ranked.append(product)
+            return ranked, total
+
+    def sort_products(self, all_products, sort_criteria=None, top_k=None):
+        return self.rank_products(all_products, sort_criteria, top_k)[0]
@@ -0,0 +1,284 @@
+import logging
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Used when a caller doesn't pass its own; see Ranker for the two forms
+    'SORT_CRITERIA': [('price', False), ('rating', True)],
+    # Every price is converted to this currency before ranking
+    'BASE_CURRENCY': 'NGN',
+    # Value of one unit of each currency in BASE_CURRENCY; used as is when FX_URL is
+    # unset and as the fallback until (or whenever) the live table cannot be fetched
+    'RATES': {
+        'NGN': 1.0,
+        'USD': 1600.0,
+        'EUR': 1750.0,
+        'GBP': 2050.0,
+        'INR': 19.0,
+    },
+    # Optional JSON endpoint answering {"rates": {"USD": 0.000625, ...}}, i.e. quoted
+    # per one unit of BASE_CURRENCY as most exchange rate APIs do
+    'FX_URL': None,
+    'FX_TTL': 6 * 60 * 60,
+    # Currency assumed when a price carries no symbol or code
+    'SOURCE_CURRENCIES': {
+        'Amazon': 'USD',
+        'Aliexpress': 'USD',
+        'Jumia': 'NGN',
+    },
+}
+
+# Longest markers first so "US $" wins over "$"
+_currency_marker = re.compile(r'US\s*\$|NGN|USD|EUR|GBP|INR|Rs\.?|[₦$€£₹]')
+_number = re.compile(r'\d(?:[\d.,]*\d)?')
+_thousands_only = re.compile(r'\d{1,3},\d{3}')
+
+CURRENCY_MARKERS = {
+    '₦': 'NGN',
+    '$': 'USD',
+    '€': 'EUR',
+    '£': 'GBP',
+    '₹': 'INR',
+    'Rs': 'INR',
+    'Rs.': 'INR',
+}
+
+# Fields compared as numbers even when scraped as strings
+NUMERIC_FIELDS = ('price', 'rating', 'number_of_ratings')
+# Heavy-tailed fields are compared on a log scale when scoring, so a few very
+# expensive or very popular items don't flatten everyone else's score
+LOG_SCALED_FIELDS = ('price', 'number_of_ratings')
+
+
+def parse_number(token: str) -> float:
+    """Parse ``1,234.56``, ``1.234,56``, ``1,00,000`` or ``12,99`` style numbers."""
+    if ',' in token and '.' in token:
+        decimal = ',' if token.rfind(',') > token.rfind('.') else '.'
+    elif ',' in token:
+        # A single comma is a decimal one unless it groups thousands ("1,234")
+        decimal = ',' if token.count(',') == 1 and not _thousands_only.fullmatch(token) else None
+    elif token.count('.') > 1:
+        decimal = None
+    else:
+        decimal = '.'
+
+    for separator in ',.':
+        if separator != decimal:
+            token = token.replace(separator, '')
+    return float(token.replace(',', '.'))
+
+
+@lru_cache(maxsize=65536)
+def parse_price(text: Optional[str], default_currency: Optional[str] = None) -> Tuple[float, Optional[str]]:
+    """Return ``(amount, currency)`` for a scraped price, ``(nan, None)`` if it has no number.
+
+    Ranges such as ``₦1,000 - ₦2,000`` resolve to their lower bound. Results are
+    memoized: the same price strings come back on every page and every search.
+    """
+    if not text:
+        return math.nan, None
+    number = _number.search(text)
+    if number is None:
+        return math.nan, None
+    marker = _currency_marker.search(text)
+    if marker is None:
+        currency = default_currency
+    else:
+        code = re.sub(r'\s+', '', marker.group(0))
+        currency = CURRENCY_MARKERS.get(code, 'USD' if code.endswith('$') else code)
+    try:
+        return parse_number(number.group(0)), currency
+    except ValueError:
+        return math.nan, None
+
+
+class FxTable:
+    """Exchange rates into the base currency, refreshed in the background."""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.base = self.config['BASE_CURRENCY']
+        self._rates = {code.upper(): float(rate) for code, rate in self.config['RATES'].items()}
+        self._rates[self.base] = 1.0
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def rates(self) -> Dict[str, float]:
+        # Serve the current table and refresh it off the request path, a slow FX
+        # endpoint must never hold up a search
+        if self.config['FX_URL'] and time.time() >= self._expires:
+            with self._lock:
+                start = not self._refreshing and time.time() >= self._expires
+                self._refreshing = self._refreshing or start
+            if start:
+                threading.Thread(target=self._refresh, daemon=True).start()
+        return self._rates
+
+    def _refresh(self) -> None:
+        try:
+            quoted = http_client.get(self.config['FX_URL']).json()['rates']
+            rates = {code.upper(): 1 / float(rate) for code, rate in quoted.items() if float(rate) > 0}
+            rates[self.base] = 1.0
+            self._rates = {**self._rates, **rates}
+        except Exception as e:
+            logger.warning("Fetching FX rates failed, keeping the previous table: %s", e)
+        finally:
+            with self._lock:
+                # Wait a full TTL either way so a failing endpoint isn't hit on every search
+                self._expires = time.time() + self.config['FX_TTL']
+                self._refreshing = False
+
+    def to_base_amount(self, amount: float, currency: Optional[str]) -> Optional[float]:
+        value = amount * self.rates().get(currency, math.nan)
+        return None if math.isnan(value) else value
+
+    def to_base(self, amounts: np.ndarray, currencies: Sequence[Optional[str]]) -> np.ndarray:
+        """Convert ``amounts`` to the base currency; unknown currencies become NaN."""
+        rates = self.rates()
+        factors = np.array([rates.get(currency, math.nan) for currency in currencies], dtype=float)
+        return amounts * factors
+
+
+def _top(keys: List[np.ndarray], top_k: Optional[int]) -> np.ndarray:
+    """Indices ordered by ``keys`` (primary first, ascending), stopping after ``top_k``.
+
+    With a ``top_k`` only the rows tied with or ahead of the k-th primary key are
+    fully sorted; finding them is a linear partial selection.
+    """
+    count = len(keys[0])
+    if top_k is not None and top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.arange(count)
+    if top_k is not None and top_k < count:
+        primary = keys[0]
+        kth = np.partition(primary, top_k - 1)[top_k - 1]
+        candidates = np.flatnonzero(primary <= kth)
+    # lexsort is stable and treats its last key as the primary one, so ties keep
+    # the order the products came in
+    order = candidates[np.lexsort([key[candidates] for key in reversed(keys)])]
+    return order if top_k is None else order[:top_k]
+
+
+class Ranker:
+    """Orders search results across marketplaces.
+
+    ``sort_criteria`` is a list of ``(field, reverse)`` pairs compared in order, like
+    a multi-key sort; products missing any of the fields are dropped. Entries with a
+    third element, ``(field, reverse, weight)``, switch to weighted scoring instead:
+    each field is scaled to 0..1 (1 being best) over the batch and the weighted sum
+    decides the order, and missing values count as the worst. Prices are parsed and
+    converted to the base currency before either comparison.
+    """
+
+    def __init__(self, fx: FxTable = None, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.fx = fx or FxTable(self.config)
+
+    def prices(self, products: Sequence[Dict[str, Any]]) -> np.ndarray:
+        defaults = self.config['SOURCE_CURRENCIES']
+        parsed = [parse_price(product.get('price'), defaults.get(product.get('source'))) for product in products]
+        amounts, currencies = zip(*parsed) if parsed else ((), ())
+        return self.fx.to_base(np.array(amounts, dtype=float), currencies)
+
+    def column(self, products: Sequence[Dict[str, Any]], field: str) -> np.ndarray:
+        if field == 'price':
+            return self.prices(products)
+        values = [product.get(field) for product in products]
+        if field in NUMERIC_FIELDS or all(value is None or isinstance(value, (int, float)) for value in values):
+            # Scraped counts may be '' when the element was present but empty
+            return np.fromiter((math.nan if value is None else float(value or 0) for value in values), dtype=float, count=len(values))
+        # Anything else is compared by the rank of its string value
+        present = np.array([value is not None for value in values])
+        _, codes = np.unique(np.array([str(value) for value in values]), return_inverse=True)
+        return np.where(present, codes.astype(float), math.nan)
+
+    @staticmethod
+    def _score(field: str, column: np.ndarray, reverse: bool) -> np.ndarray:
+        values = np.log1p(np.maximum(column, 0)) if field in LOG_SCALED_FIELDS else column
+        present = ~np.isnan(values)
+        if not present.any():
+            return np.zeros(len(values))
+        low, high = values[present].min(), values[present].max()
+        scaled = (values - low) / (high - low) if high > low else np.ones(len(values))
+        if not reverse:
+            # Ascending fields (e.g. price) are best at their lowest
+            scaled = 1 - scaled
+        return np.where(present, scaled, 0.0)
+
+    def order(self, products: Sequence[Dict[str, Any]], sort_criteria=None, top_k: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray], int]:
+        """Return ``(indices, columns, total)``.
+
+        ``indices`` are the positions in ``products`` of at most ``top_k`` qualifying
+        products in rank order, ``columns`` the parsed sort fields (aligned with
+        ``products``) and ``total`` how many products qualified.
+        """
+        if sort_criteria is None:
+            sort_criteria = self.config['SORT_CRITERIA']
+        # Missing values (and prices that could not be parsed or converted) are NaN
+        columns = {criterion[0]: self.column(products, criterion[0]) for criterion in sort_criteria}
+        if not sort_criteria:
+            indices = np.arange(len(products))
+            return (indices if top_k is None else indices[:max(top_k, 0)]), columns, len(products)
+
+        if any(len(criterion) > 2 for criterion in sort_criteria):
+            keep = np.arange(len(products))
+            score = np.zeros(len(products))
+            for field, reverse, *weight in sort_criteria:
+                score += (weight[0] if weight else 1.0) * self._score(field, columns[field], reverse)
+            keys = [-score]
+        else:
+            keep = np.flatnonzero(~np.any([np.isnan(column) for column in columns.values()], axis=0))
+            keys = [-columns[field][keep] if reverse else columns[field][keep] for field, reverse in sort_criteria]
+        return keep[_top(keys, top_k)], columns, len(keep)
+
+    def annotate(self, product: Dict[str, Any], index: int, columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+        """Return a copy of ``product`` with its ``<field>_sort`` keys."""
+        # Work on copies: the page results are shared with the search cache and must
+        # not pick up the sort keys
+        product = dict(product)
+        for field, column in columns.items():
+            if field in NUMERIC_FIELDS:
+                value = column[index]
+                product[f'{field}_sort'] = None if math.isnan(value) else float(value)
+            else:
+                product[f'{field}_sort'] = product.get(field)
+        return product
+
+    def rank(self, products: Sequence[Dict[str, Any]], sort_criteria=None, top_k: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Return ``(ranked, total)``: at most ``top_k`` ranked copies and how many products qualified."""
+        if not isinstance(products, list):
+            products = list(products)
+        indices, columns, total = self.order(products, sort_criteria, top_k)
+        return [self.annotate(products[i], i, columns) for i in indices], total
+
+
+_ranker: Optional[Ranker] = None
+_ranker_lock = threading.Lock()
+
+
+def get_ranker() -> Ranker:
+    """Return the process-wide ranker, configured from CHATSHOP_RANKING."""
+    global _ranker
+    if _ranker is None:
+        with _ranker_lock:
+            if _ranker is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_RANKING', None)
+                except ImportError:
+                    pass
+                _ranker = Ranker(config=config)
+    return _ranker
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Callers missing the cache for the same key share one fetch
+    'ENABLED': True,
+    # Also share it with other worker processes, through a lease row in the database
+    'SHARED': True,
+    # Seconds a lease lasts without a heartbeat. The holder extends it every LEASE / 3
+    # seconds while it fetches, so this only bounds how long a worker that died
+    # mid-fetch keeps others waiting before one of them takes over
+    'LEASE': 10,
+    # How often a worker waiting on another worker's fetch looks for its result in the shared cache
+    'POLL_INTERVAL': 0.2,
+    # Longest a caller waits on another worker's fetch before fetching itself; keep it
+    # above CHATSHOP_SOURCE_GUARD['DEADLINE'] so a healthy fetch is never duplicated
+    'MAX_WAIT': 30,
+}
+
+# Returned by a lookup when the key is not cached; cached values may themselves be None
+MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent fetches of the same key into one.
+
+    In a process, the first caller for a key fetches and the others wait for its
+    result (or its exception). Across processes the fetching caller holds a lease
+    row (SearchLease) on the key; callers in other workers that find it taken poll
+    ``lookup`` for the result the holder publishes, and fetch themselves if the
+    lease is released without one or they waited MAX_WAIT. The fetch passed in
+    must publish its result where ``lookup`` finds it before it returns.
+
+    Every lease costs database writes and a heartbeat thread, so callers pass
+    ``shared=False`` for keys not worth coordinating across workers.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self.shared = self.config['SHARED']
+        self.lease = timedelta(seconds=self.config['LEASE'])
+        self.metrics = get_metrics()
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        # Shared fetches by (event loop, key), and how many callers await each
+        self._tasks: Dict[Any, asyncio.Task] = {}
+        self._waiters: Dict[Any, int] = {}
+
+    # Leases
+
+    def acquire(self, key: str, owner: str) -> Optional[bool]:
+        """Take the lease on ``key``; None when the database can't be used for leases."""
+        from django.db import IntegrityError, connection, transaction
+        from django.utils import timezone
+        from chat.models import SearchLease
+
+        if connection.in_atomic_block:
+            # Other workers wouldn't see the lease before the caller's transaction commits
+            return None
+        now = timezone.now()
+        try:
+            try:
+                with transaction.atomic():
+                    SearchLease.objects.create(key=key, owner=owner, lease_until=now + self.lease)
+                return True
+            except IntegrityError:
+                # Held already; take it over only if its holder stopped its heartbeat
+                return bool(
+                    SearchLease.objects.filter(key=key, lease_until__lt=now)
+                    .update(owner=owner, lease_until=now + self.lease)
+                )
+        except Exception:
+            logger.warning("Search lease unavailable for %s, fetching without it", key, exc_info=True)
+            return None
+
+    def extend(self, key: str, owner: str) -> bool:
+        """Push ``key``'s lease forward; False once ``owner`` no longer holds it."""
+        from django.utils import timezone
+        from chat.models import SearchLease
+
+        try:
+            return bool(SearchLease.objects.filter(key=key, owner=owner).update(lease_until=timezone.now() + self.lease))
+        except Exception:
+            logger.warning("Search lease heartbeat failed for %s", key, exc_info=True)
+            return True
+
+    def release(self, key: str, owner: str) -> None:
+        from chat.models import SearchLease
+
+        try:
+            SearchLease.objects.filter(key=key, owner=owner).delete()
+        except Exception:
+            logger.warning("Search lease release failed for %s", key, exc_info=True)
+
+    def _heartbeat(self, key: str, owner: str, stop: threading.Event) -> None:
+        try:
+            while not stop.wait(self.lease.total_seconds() / 3):
+                if not self.extend(key, owner):
+                    logger.warning("Search lease for %s was taken over", key)
+                    return
+        finally:
+            from django.db import connections
+            connections.close_all()
+
+    @contextmanager
+    def _holding(self, key: str, owner: str):
+        """Keep ``key``'s lease alive until the block ends, then release it."""
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(key, owner, stop), name='search-lease-heartbeat', daemon=True).start()
+        try:
+            yield
+        finally:
+            stop.set()
+            self.release(key, owner)
+
+    @asynccontextmanager
+    async def _aholding(self, key: str, owner: str):
+        from asgiref.sync import sync_to_async
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.lease.total_seconds() / 3)
+                if not await sync_to_async(self.extend)(key, owner):
+                    logger.warning("Search lease for %s was taken over", key)
+                    return
+
+        task = asyncio.create_task(heartbeat())
+        try:
+            yield
+        finally:
+            task.cancel()
+            await sync_to_async(self.release)(key, owner)
+
+    # Blocking callers
+
+    def do(self, key: str, fetch: Callable[[], Any], lookup: Callable[[], Any], shared: bool = True) -> Any:
+        """Return ``fetch()``, sharing one call among everyone asking for ``key`` at once.
+
+        ``lookup`` returns the published result for ``key``, or MISSING. With
+        ``shared=False`` only callers in this process share it.
+        """
+        if not self.enabled:
+            return fetch()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            start = time.perf_counter()
+            call.done.wait()
+            self.metrics.observe('coalesce', time.perf_counter() - start, scope='process')
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._fetch_shared(key, fetch, lookup) if shared else fetch()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _fetch_shared(self, key: str, fetch: Callable[[], Any], lookup: Callable[[], Any]) -> Any:
+        if not self.shared:
+            return fetch()
+        owner = uuid.uuid4().hex
+        start = time.perf_counter()
+        give_up = time.monotonic() + self.config['MAX_WAIT']
+        while True:
+            acquired = self.acquire(key, owner)
+            if acquired is None:
+                return fetch()
+            if acquired:
+                with self._holding(key, owner):
+                    # Another worker may have published it between our cache miss and now
+                    value = lookup()
+                    return fetch() if value is MISSING else value
+            if time.monotonic() >= give_up:
+                return fetch()
+            time.sleep(self.config['POLL_INTERVAL'])
+            value = lookup()
+            if value is not MISSING:
+                self.metrics.observe('coalesce', time.perf_counter() - start, scope='workers')
+                return value
+
+    def lead(self, key: str, run: Callable[[], Any], shared: bool = True) -> bool:
+        """Run ``run()`` unless another worker holds ``key``'s lease; True if it ran."""
+        owner = uuid.uuid4().hex
+        acquired = self.acquire(key, owner) if self.enabled and self.shared and shared else None
+        if acquired is False:
+            return False
+        if acquired:
+            with self._holding(key, owner):
+                run()
+        else:
+            run()
+        return True
+
+    # Async callers
+
+    async def ado(self, key: str, fetch: Callable[[], Awaitable[Any]], lookup: Callable[[], Awaitable[Any]],
+                  shared: bool = True) -> Any:
+        """Async counterpart of ``do``; ``fetch`` and ``lookup`` are coroutine functions.
+
+        The shared fetch is cancelled only once every caller waiting on it is.
+        """
+        if not self.enabled:
+            return await fetch()
+        loop = asyncio.get_running_loop()
+        slot = (loop, key)
+        with self._lock:
+            task = self._tasks.get(slot)
+            leader = task is None
+            if leader:
+                task = self._tasks[slot] = loop.create_task(self._afetch_shared(key, fetch, lookup) if shared else fetch())
+                task.add_done_callback(lambda t: self._forget(slot, t))
+            self._waiters[slot] = self._waiters.get(slot, 0) + 1
+
+        start = time.perf_counter()
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            with self._lock:
+                abandoned = self._waiters.get(slot) == 1
+            if abandoned:
+                task.cancel()
+            raise
+        finally:
+            with self._lock:
+                if slot in self._waiters:
+                    self._waiters[slot] -= 1
+            if not leader:
+                self.metrics.observe('coalesce', time.perf_counter() - start, scope='process')
+
+    async def alead(self, key: str, run: Callable[[], Awaitable[Any]], shared: bool = True) -> bool:
+        """Async counterpart of ``lead``; ``run`` is a coroutine function."""
+        from asgiref.sync import sync_to_async
+
+        owner = uuid.uuid4().hex
+        acquired = await sync_to_async(self.acquire)(key, owner) if self.enabled and self.shared and shared else None
+        if acquired is False:
+            return False
+        if acquired:
+            async with self._aholding(key, owner):
+                await run()
+        else:
+            await run()
+        return True
+
+    def _forget(self, slot, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._tasks.get(slot) is task:
+                del self._tasks[slot]
+                self._waiters.pop(slot, None)
+        if not task.cancelled():
+            # Retrieved here too, so a failure nobody awaited any more isn't reported as lost
+            task.exception()
+
+    async def _afetch_shared(self, key: str, fetch: Callable[[], Awaitable[Any]], lookup: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.shared:
+            return await fetch()
+        from asgiref.sync import sync_to_async
+
+        owner = uuid.uuid4().hex
+        start = time.perf_counter()
+        give_up = time.monotonic() + self.config['MAX_WAIT']
+        while True:
+            acquired = await sync_to_async(self.acquire)(key, owner)
+            if acquired is None:
+                return await fetch()
+            if acquired:
+                async with self._aholding(key, owner):
+                    value = await lookup()
+                    return await fetch() if value is MISSING else value
+            if time.monotonic() >= give_up:
+                return await fetch()
+            await asyncio.sleep(self.config['POLL_INTERVAL'])
+            value = await lookup()
+            if value is not MISSING:
+                self.metrics.observe('coalesce', time.perf_counter() - start, scope='workers')
+                return value
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the process-wide single flight, configured from CHATSHOP_SINGLE_FLIGHT."""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_SINGLE_FLIGHT', None)
+                except ImportError:
+                    pass
+                _single_flight = SingleFlight(config)
+    return _single_flight
@@ -0,0 +1,260 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+DEFAULTS = {
+    # Seconds a search may spend fetching before it returns what it has; None waits for every page
+    'DEADLINE': 20.0,
+    # Consecutive failed page fetches that open a source's circuit...
+    'FAILURE_THRESHOLD': 3,
+    # ...which then skips the source for this many seconds before letting one trial fetch through
+    'COOLDOWN': 60.0,
+    # Start a second, identical fetch when a page hasn't arrived after this many seconds
+    # and use whichever answers first; None disables hedging
+    'HEDGE_AFTER': None,
+    # Threads shared by all hedged fetches in the process
+    'HEDGE_WORKERS': 16,
+    # Seconds between requests to the same marketplace host from one worker process
+    # (see throttle.get_host_pacer). A worker fetches at most DEADLINE / HOST_INTERVAL
+    # pages per host within one search's deadline, 40 by default: about 13 concurrent
+    # searches of 3 pages. Beyond that, pages are skipped as "deadline exceeded"
+    'HOST_INTERVAL': 0.5,
+}
+
+
+class CircuitOpen(Exception):
+    def __init__(self, source: str):
+        super().__init__(f'{source} is failing, skipped until its cool-down ends')
+        self.source = source
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__('search deadline exceeded')
+
+
+class Deadline:
+    """Time budget shared by every fetch of one search."""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, never negative; None when there is no deadline."""
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self, delay: float = 0.0) -> None:
+        """Raise DeadlineExceeded if the budget is gone, or would be after ``delay`` seconds."""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= delay:
+            raise DeadlineExceeded()
+
+    def timeout(self, default: Tuple[float, float]) -> Tuple[float, float]:
+        """``default`` (connect, read) HTTP timeouts, shortened to fit the remaining budget."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        # Never hand out a zero timeout, which some clients read as "no timeout"
+        remaining = max(remaining, 0.1)
+        return min(default[0], remaining), min(default[1], remaining)
+
+
+class CircuitBreaker:
+    """Closed, open for ``cooldown`` seconds after ``threshold`` consecutive failures,
+    then half-open: a single trial call decides whether it closes again."""
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() >= self.opened_at + self.cooldown else 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() < self.opened_at + self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def release(self) -> None:
+        """Give up a call without a verdict, e.g. when it was cancelled."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                # A failed trial restarts the cool-down
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class SourceReport:
+    """Which sources made it into a search result, and why the others didn't."""
+
+    def __init__(self):
+        self._included: Dict[str, None] = {}
+        self._skipped: Dict[str, str] = {}
+
+    def ok(self, source: str) -> None:
+        self._included[source] = None
+
+    def skip(self, source: str, reason: str) -> None:
+        self._skipped.setdefault(source, reason)
+
+    @property
+    def complete(self) -> bool:
+        return not self._skipped
+
+    def as_dict(self) -> Dict[str, Any]:
+        """``included`` sources, ``skipped`` ones with the reason, and ``partial`` ones
+        that are included but missing some pages."""
+        return {
+            'included': list(self._included),
+            'skipped': {source: reason for source, reason in self._skipped.items() if source not in self._included},
+            'partial': {source: reason for source, reason in self._skipped.items() if source in self._included},
+        }
+
+    @classmethod
+    def all_included(cls, sources: Iterable[str]) -> 'SourceReport':
+        report = cls()
+        for source in sources:
+            report.ok(source)
+        return report
+
+
+def skip_reason(error: BaseException) -> str:
+    if isinstance(error, (DeadlineExceeded, FuturesTimeout, asyncio.TimeoutError)):
+        return 'deadline exceeded'
+    if isinstance(error, CircuitOpen):
+        return 'circuit open'
+    return f'failed: {error}'
+
+
+class SourceGuard:
+    """Deadlines, per-source circuit breakers and hedged fetches for the marketplace searches.
+
+    Breaker state is kept per process; every web and search worker learns about a
+    failing source on its own.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.hedge_after = self.config['HEDGE_AFTER']
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def deadline(self, seconds: Optional[float] = None) -> Deadline:
+        return Deadline(self.config['DEADLINE'] if seconds is None else seconds)
+
+    def breaker(self, source: str) -> CircuitBreaker:
+        breaker = self._breakers.get(source)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    source, CircuitBreaker(self.config['FAILURE_THRESHOLD'], self.config['COOLDOWN'])
+                )
+        return breaker
+
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.config['HEDGE_WORKERS'], thread_name_prefix='hedge')
+        return self._executor
+
+    def hedge(self, call: Callable[[], Any], deadline: Deadline = None) -> Any:
+        """Run ``call``, starting a second copy if the first is slower than HEDGE_AFTER."""
+        if not self.hedge_after:
+            return call()
+        executor = self._hedge_executor()
+        first = executor.submit(contextvars.copy_context().run, call)
+        try:
+            return first.result(timeout=self.hedge_after)
+        except FuturesTimeout:
+            pass
+        pending = {first, executor.submit(contextvars.copy_context().run, call)}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining() if deadline else None, return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded()
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def ahedge(self, call: Callable[[], Awaitable[Any]], deadline: Deadline = None) -> Any:
+        """Async counterpart of hedge; the slower copy is cancelled."""
+        if not self.hedge_after:
+            return await call()
+        first = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        pending = {first, asyncio.ensure_future(call())}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline.remaining() if deadline else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise DeadlineExceeded()
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+_source_guard: Optional[SourceGuard] = None
+_source_guard_lock = threading.Lock()
+
+
+def get_source_guard() -> SourceGuard:
+    """Return the process-wide source guard, configured from CHATSHOP_SOURCE_GUARD."""
+    global _source_guard
+    if _source_guard is None:
+        with _source_guard_lock:
+            if _source_guard is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_SOURCE_GUARD', None)
+                except ImportError:
+                    pass
+                _source_guard = SourceGuard(config)
+    return _source_guard
@@ -0,0 +1,127 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import yaml
+
+from .extractor import SearchExtractor
+
+DEFAULTS = {
+    # Marketplace definitions by name, merged key by key over BUILTIN_SOURCES; a
+    # definition needs at least ``search_url`` and ``selectors``, see SearchExtractor
+    'DEFINITIONS': {},
+    # YAML file with more definitions in the same form
+    'DEFINITIONS_FILE': None,
+    # Sources searched when a request doesn't pick its own; None for every enabled one
+    'ENABLED': None,
+}
+
+BUILTIN_SOURCES = {
+    'Amazon': {'class': 'chat.utils.SearchAmazon.AmazonSearchExtractor'},
+    'Aliexpress': {'class': 'chat.utils.SearchAliexpress.AliExpressSearchExtractor'},
+    'Jumia': {'class': 'chat.utils.SearchJumia.JumiaSearchExtractor'},
+}
+
+
+class SourceRegistry:
+    """The worker's marketplace extractors, each built (and its selectors compiled) once.
+
+    Definitions are plain data, so a marketplace can be added, or a built-in one
+    given new selectors, URL or headers, from settings or a YAML file::
+
+        Konga:
+          search_url: https://www.konga.com/search?search={query}&page={page}
+          base_url: https://www.konga.com
+          selectors: |
+            products:
+              css: 'li.product'
+              multiple: true
+              children:
+                title: {css: 'h3'}
+                price: {css: 'span.price'}
+                url: {css: 'a', type: Link}
+          process: myapp.konga.process_product   # optional, product -> product
+
+    ``class`` names a SearchExtractor subclass for sources that need code, and
+    ``enabled: false`` keeps a source out of the default selection.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.definitions = self.load_definitions()
+        self._extractors: Dict[str, SearchExtractor] = {}
+        self._lock = threading.Lock()
+        enabled = self.config['ENABLED']
+        if enabled:
+            self.default = self.select(enabled)
+        else:
+            self.default = tuple(name for name, definition in self.definitions.items() if definition.get('enabled', True))
+
+    def load_definitions(self) -> Dict[str, Dict[str, Any]]:
+        extra = {}
+        if self.config['DEFINITIONS_FILE']:
+            with open(self.config['DEFINITIONS_FILE']) as f:
+                extra.update(yaml.safe_load(f) or {})
+        extra.update(self.config['DEFINITIONS'])
+
+        definitions = {name: dict(definition) for name, definition in BUILTIN_SOURCES.items()}
+        for name, definition in extra.items():
+            definitions[name] = {**definitions.get(name, {}), **(definition or {})}
+        return definitions
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(self.definitions)
+
+    def select(self, names: Union[None, str, Iterable[str]] = None) -> Tuple[str, ...]:
+        """Source names for ``names`` (a list or a comma separated string, any case), in
+        definition order; the default selection when empty. Raises ValueError for an
+        unknown name."""
+        if isinstance(names, str):
+            names = names.split(',')
+        wanted = {name.strip().lower() for name in names or () if name.strip()}
+        if not wanted:
+            return self.default
+        known = {name.lower() for name in self.definitions}
+        unknown = wanted - known
+        if unknown:
+            raise ValueError(f"Unknown source(s): {', '.join(sorted(unknown))}; choose from {', '.join(self.names)}")
+        return tuple(name for name in self.definitions if name.lower() in wanted)
+
+    def get(self, name: str) -> SearchExtractor:
+        extractor = self._extractors.get(name)
+        if extractor is None:
+            with self._lock:
+                extractor = self._extractors.get(name)
+                if extractor is None:
+                    extractor = self._extractors[name] = self.build(name, self.definitions[name])
+        return extractor
+
+    def build(self, name: str, definition: Dict[str, Any]) -> SearchExtractor:
+        from django.utils.module_loading import import_string
+
+        cls = import_string(definition['class']) if definition.get('class') else SearchExtractor
+        return cls({**definition, 'name': name})
+
+    def extractors(self, names: Union[None, str, Iterable[str]] = None) -> List[SearchExtractor]:
+        return [self.get(name) for name in self.select(names)]
+
+
+_registry: Optional[SourceRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_source_registry() -> SourceRegistry:
+    """Return the process-wide source registry, configured from CHATSHOP_SOURCES."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = None
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        config = getattr(settings, 'CHATSHOP_SOURCES', None)
+                except ImportError:
+                    pass
+                _registry = SourceRegistry(config)
+    return _registry
@@ -0,0 +1,54 @@
+import threading
+import time
+from typing import Dict, Optional
+
+
+class HostPacer:
+    """Spaces out requests to the same host while letting different hosts run in parallel."""
+
+    def __init__(self, min_interval: float = 2.0):
+        self.min_interval = min_interval
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, host: str, max_delay: Optional[float] = None) -> float:
+        """Claim the next free slot for ``host`` and return how long to wait for it.
+
+        A slot ``max_delay`` seconds away or more is not claimed, so a caller that
+        gives up on it doesn't push back everyone queued after it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            if max_delay is None or slot - now < max_delay:
+                self._next_slot[host] = slot + self.min_interval
+        return slot - now
+
+
+_pacer: Optional[HostPacer] = None
+_pacer_lock = threading.Lock()
+
+
+def get_host_pacer() -> HostPacer:
+    """Return the process-wide host pacer, spaced by CHATSHOP_SOURCE_GUARD['HOST_INTERVAL'].
+
+    Shared so concurrent searches in a worker queue behind each other per host,
+    instead of each request pacing only its own fetches. That caps a worker at
+    1 / HOST_INTERVAL pages per second per marketplace: pages that can't get a
+    slot within the search's DEADLINE are skipped, so HOST_INTERVAL has to leave
+    room for every page of the searches a worker runs at once.
+    """
+    global _pacer
+    if _pacer is None:
+        with _pacer_lock:
+            if _pacer is None:
+                from .source_guard import DEFAULTS
+                interval = DEFAULTS['HOST_INTERVAL']
+                try:
+                    from django.conf import settings
+                    if settings.configured:
+                        interval = (getattr(settings, 'CHATSHOP_SOURCE_GUARD', None) or {}).get('HOST_INTERVAL', interval)
+                except ImportError:
+                    pass
+                _pacer = HostPacer(min_interval=interval)
+    return _pacer
@@ -1,64 +1,93 @@
+import asyncio
 import json
+import logging
 from django.conf import settings
 import google.generativeai as genai
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.generics import GenericAPIView
-from .models import ChatHistory
-from .serializers import ChatHistorySerializer
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
+from django.utils.http import parse_etags, urlencode
+from rest_framework.utils.urls import replace_query_param
+from .models import ChatHistory, ChatMessage, SearchJob
+from .serializers import ChatHistorySerializer, SearchJobSerializer
+from .renderers import STREAMING_RENDERER_CLASSES, dumps, json_response
+from .pagination import ChatHistoryCursorPagination
 from django.core.exceptions import ObjectDoesNotExist
 from .utils.key import generate_unique_key
+from .llm import get_llm_client, LLMBusyError, LLMTimeoutError
+from .context import ContextWindow
+from .jobs import get_search_job_queue
+from .fastpath import get_fast_path
+from .shaping import get_response_shaper
+from .sync import get_history_sync
+from .retention import delete_in_batches, get_retention
 from .utils.products import MultiPlatformSearcher
-import os
+from .utils.sources import get_source_registry
+from .utils.metrics import get_metrics, timed
 from dotenv import load_dotenv
 from django.utils.html import escape
 
 load_dotenv()
 
-class ChatView(GenericAPIView):
-    serializer_class = ChatHistorySerializer
-    queryset = ChatHistory.objects.all()
+logger = logging.getLogger(__name__)
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
 
-    def post(self, request, format=None):
-        serializer = self.get_serializer(data=request.data)
-        if not serializer.is_valid():
-            # print(1)
-            return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+def search_more_url(cursor, request):
+    """Link to the next batch of a search, or None when it has been shown in full.
 
-        try:
-            # print('a')
-            chat_history, created = self.get_or_create_chat_history(serializer.validated_data)
-            # print('b')
-            user_input = serializer.validated_data.get('input', '')
-            # print('c')
-            
-            # Save user input to chat history
-            # print(2)
-            self.update_chat_history(chat_history, user_input, 'user')
-            # print(3)
+    Carries the request's ``fields`` and ``limit`` over so every batch has the same shape.
+    """
+    if cursor is None:
+        return None
+    params = {'cursor': cursor}
+    for name in ('fields', 'limit'):
+        if request.GET.get(name):
+            params[name] = request.GET[name]
+    return request.build_absolute_uri(f"{reverse('product-search-more')}?{urlencode(params)}")
 
-            chat = self.model.start_chat(history=self.format_chat_history(chat_history.history or []))
-            # print('d')
-            
-            response = self.get_ai_response(chat, user_input, created)
-            # print('e')
-            return self.process_ai_response(response, chat_history)
-        except genai.types.generation_types.BlockedPromptException:
-            return Response({"error": "The input was blocked due to safety concerns"}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            # print(e)
-            # print(4)
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def get_or_create_chat_history(self, validated_data):
-        email = validated_data['email']
-        session_key = validated_data.get('session_key') or generate_unique_key()
-        return ChatHistory.objects.get_or_create(email=email, session_key=session_key)
+class ChatTurnMixin:
+    """Prompting and response handling shared by the sync and async product-chat views."""
+    num_pages = 3
+    # None ranks by CHATSHOP_RANKING['SORT_CRITERIA']
+    sort_criteria = None
+    # Number of top ranked products repeated in the closing event of a streamed response
+    stream_summary_size = 20
+    # Products per batch of a regular response; the rest come from the `next` link
+    result_limit = 20
+    max_result_limit = 100
+    # Product fields picked with ?fields=; None returns every public field
+    product_fields = None
+    # Marketplaces picked with ?sources=; None searches the deployment's default set
+    sources = None
+    stream_content_types = {
+        'ndjson': 'application/x-ndjson',
+        'sse': 'text/event-stream',
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pending_messages = []
+        self.model = get_llm_client()
+        self.context_window = ContextWindow(self.model)
+        self.search_jobs = get_search_job_queue()
+        self.fast_path = get_fast_path()
+        self.shaper = get_response_shaper()
+
+    def read_shaping(self, params):
+        """Apply ?fields=, ?limit= and ?sources= to this request; raises ValueError for bad values."""
+        self.product_fields = self.shaper.fields(params)
+        self.result_limit = self.shaper.limit(params, self.result_limit, self.max_result_limit)
+        if params.get('sources'):
+            self.sources = get_source_registry().select(params['sources'])
+
+    def shape_products(self, products):
+        return self.shaper.products(products, self.product_fields)
 
     def format_chat_history(self, history):
         formatted_history = []
@@ -66,11 +95,10 @@ class ChatView(GenericAPIView):
             formatted_history.append({'parts': [{'text': message['parts'][0]['text']}], 'role': message['role']})
         return formatted_history
 
-    def get_ai_response(self, chat, user_input, is_new_session):
+    def get_prompt(self, user_input, is_new_session):
         sanitized_input = escape(user_input)
         
         if is_new_session:
-            # print('a1')
             prompt = f"""
             User input: {sanitized_input}
 
@@ -99,57 +127,327 @@ class ChatView(GenericAPIView):
 
             Respond:
             """
-        return chat.send_message(prompt)
+        return prompt
+
+    def choose_stream_format(self, stream_param, accept):
+        if stream_param in self.stream_content_types:
+            return stream_param
+        for name, content_type in self.stream_content_types.items():
+            if content_type in accept:
+                return name
+        return None
+
+    def parse_ai_response(self, text):
+        """Split a model reply into (product query or None, message shown to the user)."""
+        try:
+            product_json = self.extract_json(text)
+            return product_json['product'], self.strip_json(text)
+        except (ValueError, KeyError, TypeError, json.JSONDecodeError):
+            return None, text
+
+    def stream_headers(self, streaming_response):
+        streaming_response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream until it completes
+        streaming_response['X-Accel-Buffering'] = 'no'
+        return streaming_response
+
+    def encode_event(self, event, stream_format):
+        data = dumps(event)
+        if stream_format == 'sse':
+            return b"event: " + event['type'].encode() + b"\ndata: " + data + b"\n\n"
+        return data + b"\n"
+
+    def strip_json(self, text):
+        try:
+            j = text.rindex('}') + 1
+            return text[j:]
+        except ValueError:
+            return text
+
+    def extract_json(self, text):
+        json_start = text.index('{')
+        json_end = text.rindex('}') + 1
+        json_str = text[json_start:json_end]
+        return json.loads(json_str)
+
+    def job_reference(self, job, request):
+        url = reverse('search-job', kwargs={'pk': job.pk})
+        return {'id': str(job.pk), 'status': job.status, 'url': request.build_absolute_uri(url)}
+
+    def update_chat_history(self, chat_history, message, role):
+        # Buffered so both turns of a request are written with a single insert in save_chat_history
+        self.pending_messages.append((role, message))
+
+
+class ChatView(ChatTurnMixin, GenericAPIView):
+    serializer_class = ChatHistorySerializer
+    queryset = ChatHistory.objects.all()
+    renderer_classes = STREAMING_RENDERER_CLASSES
+
+    def post(self, request, format=None):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            self.read_shaping(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        chat_history = None
+        try:
+            chat_history, created = self.get_or_create_chat_history(serializer.validated_data)
+            user_input = serializer.validated_data.get('input', '')
+            
+            # Save user input to chat history
+            self.update_chat_history(chat_history, user_input, 'user')
+
+            response = self.respond(chat_history, user_input, created)
+            stream_format = self.get_stream_format(request)
+            if stream_format:
+                return self.stream_ai_response(response, chat_history, stream_format)
+            return self.process_ai_response(response, chat_history)
+        except genai.types.generation_types.BlockedPromptException:
+            return Response({"error": "The input was blocked due to safety concerns"}, status=status.HTTP_400_BAD_REQUEST)
+        except LLMBusyError as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except LLMTimeoutError as e:
+            return Response({"error": str(e)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            logger.exception("Chat turn failed")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            if chat_history is not None:
+                self.save_chat_history(chat_history)
+
+    def get_or_create_chat_history(self, validated_data):
+        email = validated_data['email']
+        session_key = validated_data.get('session_key') or generate_unique_key()
+        return ChatHistory.objects.get_or_create(email=email, session_key=session_key)
+
+    def get_ai_response(self, chat, user_input, is_new_session):
+        return chat.send_message(self.get_prompt(user_input, is_new_session))
+
+    def respond(self, chat_history, user_input, is_new_session):
+        """The model's reply to this turn, from the fast path when it has one."""
+        response = self.fast_path.rule_reply(user_input, is_new_session)
+        if response is not None:
+            return response
+        history = self.format_chat_history(self.get_chat_history(chat_history))
+        key = self.fast_path.key(user_input, history, is_new_session)
+        response = self.fast_path.get(key)
+        if response is None:
+            response = self.get_ai_response(self.model.start_chat(history=history), user_input, is_new_session)
+            self.fast_path.set(key, response.text)
+        return response
 
     def process_ai_response(self, response, chat_history):
         try:
             product_json = self.extract_json(response.text)
-            products = self.search_products(product_json['product'])
+            if self.search_jobs.enabled:
+                # Leave the scraping to run_search_worker; the client polls the job
+                job = self.search_jobs.enqueue(product_json['product'], chat=chat_history, num_pages=self.num_pages, sources=self.sources)
+                self.update_chat_history(chat_history, response.text, 'model')
+                return Response({
+                    'search_job': self.job_reference(job, self.request),
+                    'message': self.strip_json(response.text),
+                    'session_key': chat_history.session_key
+                }, status=status.HTTP_200_OK)
+            products, sources, cursor = self.search_products(product_json['product'])
             
             # Save AI response to chat history
-            # print(5)
             self.update_chat_history(chat_history, response.text, 'model')
-            # print(6)
-            try:
-                j = response.text.rindex('}') + 1
-                text = response.text[j:]
-            except: 
-                text = response.text
             return Response({
-                'products': products,
-                'message': text,
+                'products': self.shape_products(products),
+                'sources': sources,
+                'next': search_more_url(cursor, self.request),
+                'message': self.strip_json(response.text),
                 'session_key': chat_history.session_key
             }, status=status.HTTP_200_OK)
         except (ValueError, json.JSONDecodeError):
             # Save AI response to chat history
-            # print(7)
             self.update_chat_history(chat_history, response.text, 'model')
-            # print(8)
 
             return Response({
                 'message': response.text,
                 'session_key': chat_history.session_key
             }, status=status.HTTP_200_OK)
 
-    def extract_json(self, text):
-        json_start = text.index('{')
-        json_end = text.rindex('}') + 1
-        json_str = text[json_start:json_end]
-        print("Products",json_str)
-        return json.loads(json_str)
+    def get_stream_format(self, request):
+        return self.choose_stream_format(request.query_params.get('stream'), request.META.get('HTTP_ACCEPT', ''))
+
+    def stream_ai_response(self, response, chat_history, stream_format):
+        product, message = self.parse_ai_response(response.text)
+        self.update_chat_history(chat_history, response.text, 'model')
+
+        events = self.iter_chat_events(message, chat_history.session_key, product)
+        streaming_response = StreamingHttpResponse(
+            (self.encode_event(event, stream_format) for event in events),
+            content_type=self.stream_content_types[stream_format],
+        )
+        return self.stream_headers(streaming_response)
+
+    def iter_chat_events(self, message, session_key, product):
+        yield {'type': 'message', 'message': message, 'session_key': session_key}
+        if product is None:
+            yield {'type': 'done', 'count': 0, 'products': []}
+            return
+
+        searcher = MultiPlatformSearcher(sources=self.sources)
+        all_products = []
+        try:
+            for source, page, products in searcher.iter_search(product, num_pages=self.num_pages):
+                all_products.extend(products)
+                yield {'type': 'products', 'source': source, 'page': page, 'products': self.shape_products(products)}
+        except Exception as e:
+            yield {'type': 'error', 'error': str(e)}
+
+        ranked, count = searcher.rank_products(all_products, self.sort_criteria, top_k=self.stream_summary_size)
+        yield {'type': 'done', 'count': count, 'products': self.shape_products(ranked)}
 
     def search_products(self, product):
-        searcher = MultiPlatformSearcher()
-        sort_criteria = [('price', False), ('rating', True)]
-        return searcher.search_and_sort_products(product, num_pages=3, sort_criteria=sort_criteria)
+        """Return ``(products, sources, cursor)`` for the first batch, see MultiPlatformSearcher.search_page."""
+        searcher = MultiPlatformSearcher(sources=self.sources)
+        with timed('search'):
+            return searcher.search_page(product, limit=self.result_limit, sort_criteria=self.sort_criteria, max_rounds=self.num_pages)
 
-    def update_chat_history(self, chat_history, message, role):
-        chat_history.history.append({'role': role, 'parts': [{'text': message}]})
-        chat_history.save()
+    def get_chat_history(self, chat_history):
+        return self.context_window.build(chat_history, self.pending_messages)
+
+    def save_chat_history(self, chat_history):
+        messages, self.pending_messages = self.pending_messages, []
+        chat_history.append_messages(messages)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatView(ChatTurnMixin, View):
+    """Async product-chat endpoint.
+
+    Same request and response shapes as ChatView (including ?stream=), but the
+    model call, the marketplace fetches and the ORM access all await instead of
+    blocking, so under ASGI a single worker can hold many waiting chats.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except json.JSONDecodeError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ChatHistorySerializer(data=data)
+        if not serializer.is_valid():
+            return json_response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            self.read_shaping(request.GET)
+        except ValueError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        chat_history = None
+        try:
+            email = serializer.validated_data['email']
+            session_key = serializer.validated_data.get('session_key') or generate_unique_key()
+            chat_history, created = await ChatHistory.objects.aget_or_create(email=email, session_key=session_key)
+            user_input = serializer.validated_data.get('input', '')
+            self.update_chat_history(chat_history, user_input, 'user')
+
+            response = await self.arespond(chat_history, user_input, created)
+
+            product, message = self.parse_ai_response(response.text)
+            self.update_chat_history(chat_history, response.text, 'model')
+            # Persist the turn before searching; the search can take a while
+            await self.asave_chat_history(chat_history)
+
+            stream_format = self.choose_stream_format(request.GET.get('stream'), request.headers.get('Accept', ''))
+            if stream_format:
+                events = self.aiter_chat_events(message, chat_history.session_key, product)
+                streaming_response = StreamingHttpResponse(
+                    self.aencode_events(events, stream_format),
+                    content_type=self.stream_content_types[stream_format],
+                )
+                return self.stream_headers(streaming_response)
+
+            if product is None:
+                return json_response({
+                    'message': response.text,
+                    'session_key': chat_history.session_key
+                }, status=status.HTTP_200_OK)
+
+            if self.search_jobs.enabled:
+                job = await self.search_jobs.aenqueue(product, chat=chat_history, num_pages=self.num_pages, sources=self.sources)
+                return json_response({
+                    'search_job': self.job_reference(job, request),
+                    'message': message,
+                    'session_key': chat_history.session_key
+                }, status=status.HTTP_200_OK)
+
+            searcher = MultiPlatformSearcher(sources=self.sources)
+            with timed('search'):
+                products, sources, cursor = await searcher.asearch_page(
+                    product, limit=self.result_limit, sort_criteria=self.sort_criteria, max_rounds=self.num_pages
+                )
+            return json_response({
+                'products': self.shape_products(products),
+                'sources': sources,
+                'next': search_more_url(cursor, request),
+                'message': message,
+                'session_key': chat_history.session_key
+            }, status=status.HTTP_200_OK)
+        except genai.types.generation_types.BlockedPromptException:
+            return json_response({"error": "The input was blocked due to safety concerns"}, status=status.HTTP_400_BAD_REQUEST)
+        except LLMBusyError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except LLMTimeoutError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            logger.exception("Chat turn failed")
+            return json_response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            if chat_history is not None:
+                await self.asave_chat_history(chat_history)
+
+    async def arespond(self, chat_history, user_input, is_new_session):
+        response = self.fast_path.rule_reply(user_input, is_new_session)
+        if response is not None:
+            return response
+        history = self.format_chat_history(await self.context_window.abuild(chat_history, self.pending_messages))
+        key = self.fast_path.key(user_input, history, is_new_session)
+        response = await self.fast_path.aget(key)
+        if response is None:
+            chat = self.model.start_chat(history=history)
+            response = await chat.asend_message(self.get_prompt(user_input, is_new_session))
+            await self.fast_path.aset(key, response.text)
+        return response
+
+    async def aiter_chat_events(self, message, session_key, product):
+        yield {'type': 'message', 'message': message, 'session_key': session_key}
+        if product is None:
+            yield {'type': 'done', 'count': 0, 'products': []}
+            return
+
+        searcher = MultiPlatformSearcher(sources=self.sources)
+        all_products = []
+        try:
+            async for source, page, products in searcher.aiter_search(product, num_pages=self.num_pages):
+                all_products.extend(products)
+                yield {'type': 'products', 'source': source, 'page': page, 'products': self.shape_products(products)}
+        except Exception as e:
+            yield {'type': 'error', 'error': str(e)}
+
+        ranked, count = searcher.rank_products(all_products, self.sort_criteria, top_k=self.stream_summary_size)
+        yield {'type': 'done', 'count': count, 'products': self.shape_products(ranked)}
+
+    async def aencode_events(self, events, stream_format):
+        async for event in events:
+            yield self.encode_event(event, stream_format)
+
+    async def asave_chat_history(self, chat_history):
+        messages, self.pending_messages = self.pending_messages, []
+        await chat_history.aappend_messages(messages)
 
 class ChatGetView(GenericAPIView):
     serializer_class = ChatHistorySerializer
     queryset = ChatHistory.objects.all()
+    pagination_class = ChatHistoryCursorPagination
+    # Rows fetched per round trip when streaming a full listing
+    stream_chunk_size = 500
 
     def get(self, request, id=None, email=None, session_key=None):
         try:
@@ -161,14 +459,36 @@ class ChatGetView(GenericAPIView):
                 chat_history = ChatHistory.objects.filter(session_key=session_key)
             else:
                 chat_history = ChatHistory.objects.all()
+            chat_history = chat_history.prefetch_related('messages')
+
+            if request.query_params.get('stream'):
+                return self.stream_chat_history(chat_history)
+
+            if email and session_key:
+                serializer = ChatHistorySerializer(chat_history, many=True)
+                return Response(serializer.data, status=status.HTTP_200_OK)
 
-            serializer = ChatHistorySerializer(chat_history, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # Listings can span many sessions, so they are returned a page at a time
+            page = self.paginate_queryset(chat_history)
+            serializer = ChatHistorySerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
 
         except Exception as e:
-            # print(9)
+            logger.exception("Reading chat history failed")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def stream_chat_history(self, chat_history):
+        """Stream the whole listing as one JSON array without loading every row at once."""
+        def render():
+            yield b'['
+            rows = chat_history.order_by('-created_at', '-id').iterator(chunk_size=self.stream_chunk_size)
+            for i, row in enumerate(rows):
+                data = dumps(ChatHistorySerializer(row).data)
+                yield data if i == 0 else b',' + data
+            yield b']'
+
+        return StreamingHttpResponse(render(), content_type='application/json')
+
     def delete(self, request, id=None, email=None, session_key=None):
         try:
             if email and session_key:
@@ -183,11 +503,13 @@ class ChatGetView(GenericAPIView):
             if not chat_history.exists():
                 return Response({"error": "Chat history not found"}, status=status.HTTP_404_NOT_FOUND)
 
-            chat_history.delete()
+            # Batched, so deleting a busy email's sessions doesn't lock them all in one transaction
+            retention = get_retention()
+            delete_in_batches(chat_history, retention.batch_size, retention.config['BATCH_PAUSE'])
             return Response({"message": "Chat history deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
         except Exception as e:
-            # print(10)
+            logger.exception("Deleting chat history failed")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def put(self, request, id=None, email=None, session_key=None):
@@ -203,9 +525,172 @@ class ChatGetView(GenericAPIView):
             if serializer.is_valid():
                 serializer.save()
                 return Response(serializer.data, status=status.HTTP_200_OK)
-            # print(11)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
-            # print(12)
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            logger.exception("Updating chat history failed")
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ChatSyncView(View):
+    """Messages of a session after ``?after=<seq>``, for clients keeping a copy in sync.
+
+    Answers ``304 Not Modified`` when ``If-None-Match`` still matches the session's
+    ETag. With ``?wait=<seconds>`` a request that would get nothing new is held open
+    until the next message arrives (or the wait runs out), so clients can long-poll.
+    Async, so under ASGI a waiting poll holds no thread.
+    """
+    http_method_names = ['get']
+
+    async def get(self, request, email, session_key):
+        sync = get_history_sync()
+        try:
+            after = sync.after(request.GET)
+            limit = sync.page_size(request.GET)
+            wait = sync.wait(request.GET)
+        except ValueError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        state = await self.get_state(email, session_key)
+        if state is None:
+            return json_response({"error": "Chat history not found"}, status=status.HTTP_404_NOT_FOUND)
+        known = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+
+        if wait and self.unchanged(state, after, known):
+            # state turns None if the session is deleted mid-wait
+            pk = state['pk']
+            event = sync.signals.subscribe(pk)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + wait
+            try:
+                while self.unchanged(state, after, known):
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(event.wait(), min(remaining, sync.config['POLL_INTERVAL']))
+                    except asyncio.TimeoutError:
+                        pass
+                    event.clear()
+                    state = await self.get_state(email, session_key)
+                    if state is None:
+                        return json_response({"error": "Chat history not found"}, status=status.HTTP_404_NOT_FOUND)
+            finally:
+                sync.signals.unsubscribe(pk, event)
+
+        etag = self.etag(state)
+        if etag in known or '*' in known:
+            return self.with_headers(HttpResponseNotModified(), etag)
+
+        messages = [
+            message.as_sync_entry()
+            async for message in ChatMessage.objects.filter(chat_id=state['pk'], seq__gt=after).order_by('seq')[:limit + 1]
+        ]
+        next_url = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_url = request.build_absolute_uri(f"{request.path}?{urlencode({'after': messages[-1]['seq'], 'limit': limit})}")
+        return self.with_headers(json_response({
+            'session_key': session_key,
+            'messages': messages,
+            'last_seq': state['message_count'],
+            'next': next_url,
+        }), etag)
+
+    @staticmethod
+    async def get_state(email, session_key):
+        return await ChatHistory.objects.filter(email=email, session_key=session_key).values('pk', 'message_count').afirst()
+
+    @staticmethod
+    def etag(state):
+        # Messages are append-only, so the last seq identifies every response for the session
+        return f'"{state["pk"].hex}.{state["message_count"]}"'
+
+    def unchanged(self, state, after, known):
+        return state['message_count'] <= after or self.etag(state) in known
+
+    @staticmethod
+    def with_headers(response, etag):
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ProductSearchMoreView(GenericAPIView):
+    """The next batch of a product search, from the `next` link of a chat response."""
+    num_pages = ChatTurnMixin.num_pages
+    sort_criteria = ChatTurnMixin.sort_criteria
+    result_limit = ChatTurnMixin.result_limit
+    max_result_limit = ChatTurnMixin.max_result_limit
+
+    def get(self, request):
+        cursor = request.query_params.get('cursor')
+        if not cursor:
+            return Response({"error": "cursor is required"}, status=status.HTTP_400_BAD_REQUEST)
+        shaper = get_response_shaper()
+        try:
+            fields = shaper.fields(request.query_params)
+            limit = shaper.limit(request.query_params, self.result_limit, self.max_result_limit)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        searcher = MultiPlatformSearcher()
+        try:
+            with timed('search'):
+                products, sources, cursor = searcher.search_page(
+                    limit=limit, cursor=cursor, sort_criteria=self.sort_criteria, max_rounds=self.num_pages
+                )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'products': shaper.products(products, fields),
+            'sources': sources,
+            'next': search_more_url(cursor, request),
+        }, status=status.HTTP_200_OK)
+
+
+class SearchJobView(GenericAPIView):
+    """Progress and results of a search queued by a chat turn.
+
+    ``products`` holds the best offers found so far while the job is queued or
+    running, and the ranked list once ``status`` is ``done``, ``limit`` at a time
+    from ``offset``; ``next`` links to the following slice.
+    """
+    serializer_class = SearchJobSerializer
+    queryset = SearchJob.objects.select_related('chat')
+    result_limit = ChatTurnMixin.result_limit
+    max_result_limit = ChatTurnMixin.max_result_limit
+
+    def get(self, request, pk):
+        shaper = get_response_shaper()
+        try:
+            fields = shaper.fields(request.query_params)
+            limit = shaper.limit(request.query_params, self.result_limit, self.max_result_limit)
+            offset = shaper.offset(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        job = self.get_queryset().filter(pk=pk).first()
+        if job is None:
+            return Response({"error": "Search job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        data = self.get_serializer(job).data
+        products = data['products'] or []
+        data['products'] = shaper.products(products[offset:offset + limit], fields)
+        data['next'] = None
+        if job.finished and offset + limit < len(products):
+            data['next'] = replace_query_param(request.build_absolute_uri(), 'offset', offset + limit)
+        response = Response(data, status=status.HTTP_200_OK)
+        if not job.finished:
+            response['Retry-After'] = str(max(int(get_search_job_queue().poll_interval), 1))
+        return response
+
+
+class MetricsView(View):
+    """Stage latency histograms in the Prometheus text format."""
+    http_method_names = ['get']
+
+    def get(self, request):
+        metrics = get_metrics()
+        if not metrics.enabled:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -52,7 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'chat.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -103,8 +105,217 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The search tier is shared by every worker. `migrate` creates its table (chat migration 0012);
+# after adding another DatabaseCache alias or changing a LOCATION, run `python manage.py createcachetable`.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'chatshop_search_cache',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+CHATSHOP_SEARCH_CACHE = {
+    'ALIAS': 'search',
+    'MAXSIZE': 1024,
+    'DEFAULT_TTL': 15 * 60,
+    'TTL': {
+        'Amazon': 10 * 60,
+        'Aliexpress': 30 * 60,
+        'Jumia': 30 * 60,
+    },
+    'STALE_TTL': 60 * 60,
+}
+
+# Concurrent searches for the same query, source and page share one scrape; see chat/utils/singleflight.py
+CHATSHOP_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'SHARED': True,
+    # Extended by a heartbeat while the fetch runs; only a dead holder's lease lapses
+    'LEASE': 10,
+    'POLL_INTERVAL': 0.2,
+    # Above CHATSHOP_SOURCE_GUARD['DEADLINE'], so waiters outlast a healthy fetch
+    'MAX_WAIT': 30,
+}
+
+
+CHATSHOP_RANKING = {
+    # (field, reverse) pairs sort in order; give each a weight, e.g.
+    # [('price', False, 0.6), ('rating', True, 0.3), ('number_of_ratings', True, 0.1)],
+    # to rank by a weighted score instead
+    'SORT_CRITERIA': [('price', False), ('rating', True)],
+    'BASE_CURRENCY': 'NGN',
+    'RATES': {
+        'NGN': 1.0,
+        'USD': 1600.0,
+        'EUR': 1750.0,
+        'GBP': 2050.0,
+        'INR': 19.0,
+    },
+    'FX_URL': os.environ.get('CHATSHOP_FX_URL'),
+    'FX_TTL': 6 * 60 * 60,
+}
+
+
+CHATSHOP_DEDUP = {
+    # Fold listings of the same item into their best offer, with the rest as alternates
+    'ENABLED': True,
+    'NUM_PERM': 64,
+    'BANDS': 32,
+    'THRESHOLD': 0.5,
+    'SHINGLE_SIZE': 4,
+    'IMAGE_MAX_SHARE': 8,
+}
+
+
+CHATSHOP_PRODUCT_INDEX = {
+    # Answer searches from previously scraped listings when enough recent ones match
+    'ENABLED': True,
+    'MIN_MATCHES': 10,
+    'MAX_AGE': 24 * 60 * 60,
+    'REFRESH_AFTER': 60 * 60,
+    'LIMIT': 200,
+    'QUEUE_SIZE': 256,
+    'WRITE_ATTEMPTS': 5,
+    'RETRY_DELAY': 0.2,
+}
+
+
+CHATSHOP_SOURCES = {
+    # Marketplaces by name; these are merged over the built-in Amazon, Aliexpress and
+    # Jumia definitions (see chat/utils/sources.py for the format)
+    'DEFINITIONS': {},
+    'DEFINITIONS_FILE': os.environ.get('CHATSHOP_SOURCES_FILE'),
+    # e.g. CHATSHOP_SOURCES=Amazon,Jumia; requests can narrow it further with ?sources=
+    'ENABLED': os.environ.get('CHATSHOP_SOURCES') or None,
+}
+
+
+CHATSHOP_PARSING = {
+    # Processes parsing result pages off the GIL, per worker process; 0 parses on the fetching
+    # threads. Opt-in: measure with `benchmark_search --pool-workers N` first
+    'WORKERS': int(os.environ.get('CHATSHOP_PARSE_WORKERS', 0)),
+    'MIN_BYTES': 32 * 1024,
+    'START_METHOD': 'spawn',
+    'MAX_TASKS_PER_CHILD': 1000,
+    'TIMEOUT': 10.0,
+}
+
+
+CHATSHOP_SOURCE_GUARD = {
+    # Seconds a chat turn waits for marketplace pages before answering with what it has
+    'DEADLINE': 20.0,
+    # Skip a marketplace for COOLDOWN seconds after this many consecutive failed pages
+    'FAILURE_THRESHOLD': 3,
+    'COOLDOWN': 60.0,
+    # e.g. 4.0 to race a second request against pages slower than that
+    'HEDGE_AFTER': None,
+    'HEDGE_WORKERS': 16,
+    # Spacing of requests to one marketplace host, across all requests of a worker process.
+    # Caps a worker at DEADLINE / HOST_INTERVAL pages per host per search deadline (40,
+    # about 13 concurrent 3-page searches); raise it only with the deadline in mind
+    'HOST_INTERVAL': 0.5,
+}
+
+
+CHATSHOP_SEARCH_JOBS = {
+    # Queue chat-turn searches for `manage.py run_search_worker` instead of scraping in the request
+    'ENABLED': os.environ.get('CHATSHOP_SEARCH_JOBS', '').lower() in ('1', 'true', 'yes'),
+    'LEASE': 120,
+    'MAX_ATTEMPTS': 3,
+    'POLL_INTERVAL': 1.0,
+    'PARTIAL_LIMIT': 20,
+}
+
+
+CHATSHOP_LLM = {
+    # 'gemini', or 'stub' to load-test without calling the model
+    'BACKEND': os.environ.get('CHATSHOP_LLM_BACKEND', 'gemini'),
+    'MODEL': 'gemini-1.5-flash',
+    'TIMEOUT': 30,
+    'MAX_IN_FLIGHT': 8,
+    'ACQUIRE_TIMEOUT': 5,
+    'STUB_LATENCY': float(os.environ.get('CHATSHOP_LLM_STUB_LATENCY', 0)),
+}
+
+
+CHATSHOP_FAST_PATH = {
+    # Skip the model for turns it has answered before; RULES also skips it for explicit
+    # product requests, recognised by pattern
+    'ENABLED': True,
+    'RULES': False,
+    'MIN_WORDS': 3,
+    'MAX_WORDS': 12,
+    'CACHE_ALIAS': 'search',
+    'CACHE_TTL': 24 * 60 * 60,
+}
+
+
+CHATSHOP_METRICS = {
+    # Per-stage timings as Server-Timing headers and histograms on /metrics
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    # Set (to a directory writable by every worker) when running several worker processes
+    'MULTIPROCESS_DIR': os.environ.get('CHATSHOP_METRICS_DIR'),
+    'FLUSH_INTERVAL': 5.0,
+}
+
+
+CHATSHOP_SYNC = {
+    # Incremental history: chats/<email>/<session_key>/messages/?after=<seq>&wait=<seconds>
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+    'MAX_WAIT': 30,
+    'POLL_INTERVAL': 1.0,
+}
+
+
+CHATSHOP_RESPONSE = {
+    # Product fields returned when a request doesn't pick them with ?fields=; None returns them all
+    'DEFAULT_FIELDS': None,
+    'MAX_FIELDS': 32,
+    'INTERNAL_SUFFIXES': ('_sort',),
+    # Set to False when a proxy in front already compresses responses
+    'COMPRESSION': os.environ.get('CHATSHOP_COMPRESSION', 'true').lower() in ('1', 'true', 'yes'),
+    'MIN_COMPRESS_SIZE': 200,
+    # br is only offered once the optional Brotli package is installed (pip install Brotli==1.1.0);
+    # without it responses are gzipped
+    'BROTLI_QUALITY': 5,
+}
+
+
+CHATSHOP_CONTEXT = {
+    'MAX_MESSAGES': 12,
+    'SUMMARY_STEP': 6,
+    'MAX_SUMMARY_CHARS': 2000,
+}
+
+# See chat/retention.py; run `manage.py purge_chat_history` daily
+CHATSHOP_RETENTION = {
+    'MAX_AGE_DAYS': int(os.environ.get('CHATSHOP_RETENTION_DAYS', 180)),
+    'ARCHIVE': True,
+    # A STORAGES alias (e.g. an S3 bucket) for the archive, or files under ARCHIVE_DIR
+    'STORAGE': os.environ.get('CHATSHOP_ARCHIVE_STORAGE') or None,
+    'ARCHIVE_DIR': os.environ.get('CHATSHOP_ARCHIVE_DIR', BASE_DIR / 'archive'),
+    'BATCH_SIZE': 500,
+    'BATCH_PAUSE': 0.05,
+    'JOB_MAX_AGE_DAYS': 7,
+}
+
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        'chat.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 SPECTACULAR_SETTINGS = {